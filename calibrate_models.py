@@ -6,17 +6,13 @@ This script demonstrates the ASC calibration process:
 2. Estimate base models (MNL, NL, ML)
 3. Calculate actual market shares
 4. Show uncalibrated market shares
-5. Calibrate ASCs (including CAR)
+5. Calibrate ASCs (CAR is the reference alternative)
 6. Show calibrated market shares
 """
 
 from mcbs.datasets import DatasetLoader
 from mcbs.models.modecanada_model import MultinomialLogitModel_MC, NestedLogitModel3_MC, MixedLogitModel_MC
-import pandas as pd
-import numpy as np
-import biogeme.database as db
-import biogeme.biogeme as bio
-from biogeme import models
+from mcbs.engine import Scenario
 
 def calculate_actual_shares(data):
     """Calculate actual market shares from the data."""
@@ -32,122 +28,25 @@ def calculate_actual_shares(data):
 
 def simulate_market_shares(model, data, betas=None):
     """Simulate market shares using provided beta values."""
-    # Use provided betas or get from model
-    if betas is None:
-        betas = model.results.get_beta_values()
-    
-    # Get utility functions for simulation
-    V1 = (betas['ASC_TRAIN'] + 
-          betas['B_TIME'] * model.TRAIN_TIME + 
-          betas['B_COST'] * model.TRAIN_COST)
-    
-    V2 = (betas.get('ASC_CAR', 0) + 
-          betas['B_TIME'] * model.CAR_TIME + 
-          betas['B_COST'] * model.CAR_COST)
-    
-    V3 = (betas['ASC_BUS'] + 
-          betas['B_TIME'] * model.BUS_TIME + 
-          betas['B_COST'] * model.BUS_COST)
-    
-    V4 = (betas['ASC_AIR'] + 
-          betas['B_TIME'] * model.AIR_TIME + 
-          betas['B_COST'] * model.AIR_COST)
-    
-    # Associate utility functions with alternatives
-    V = {1: V1, 2: V2, 3: V3, 4: V4}
-    
-    # Associate availability conditions
-    av = {1: model.TRAIN_AV,
-          2: model.CAR_AV,
-          3: model.BUS_AV,
-          4: model.AIR_AV}
-    
-    # Calculate choice probabilities based on model type
-    if isinstance(model, NestedLogitModel3_MC):
-        prob_train = models.nested(V, None, model.nests, 1)
-        prob_car = models.nested(V, None, model.nests, 2)
-        prob_bus = models.nested(V, None, model.nests, 3)
-        prob_air = models.nested(V, None, model.nests, 4)
-    else:  # MNL and Mixed Logit use standard logit probabilities
-        prob_train = models.logit(V, av, 1)
-        prob_car = models.logit(V, av, 2)
-        prob_bus = models.logit(V, av, 3)
-        prob_air = models.logit(V, av, 4)
-    
-    # Setup simulation
-    simulate = {
-        'Prob. train': prob_train,
-        'Prob. car': prob_car,
-        'Prob. bus': prob_bus,
-        'Prob. air': prob_air
-    }
-    
-    # Run simulation
-    biogeme = bio.BIOGEME(model.database, simulate)
-    biogeme.modelName = "market_share_simulation"
-    
-    # Ensure ASC_CAR is in the betas dictionary
-    sim_betas = betas.copy()
-    if 'ASC_CAR' not in sim_betas:
-        sim_betas['ASC_CAR'] = 0
-    
-    simulatedValues = biogeme.simulate(sim_betas)
-    
-    # Calculate market shares (mean probability for each alternative)
-    market_shares = {
-        1: simulatedValues['Prob. train'].mean(),
-        2: simulatedValues['Prob. car'].mean(),
-        3: simulatedValues['Prob. bus'].mean(),
-        4: simulatedValues['Prob. air'].mean()
-    }
-    
-    return market_shares
+    shares = model.simulate_scenarios([Scenario('baseline', [])], betas)
+    return shares.loc['baseline'].to_dict()
 
 def calibrate_alternative_constants(model, data, actual_shares, max_iter=100, tolerance=1e-6):
-    """Calibrate ASCs to match observed market shares."""
-    # Get current beta values
-    beta_values = model.results.get_beta_values()
-    
-    # Add ASC_CAR if it doesn't exist (it's not estimated, fixed at 0)
-    if 'ASC_CAR' not in beta_values:
-        beta_values['ASC_CAR'] = 0
-    
-    # Define modes to calibrate
-    modes = {
-        1: 'ASC_TRAIN',
-        2: 'ASC_CAR',
-        3: 'ASC_BUS',
-        4: 'ASC_AIR'
-    }
-    
-    # Iterative calibration
-    for iteration in range(max_iter):
-        # Get current predicted shares
-        predicted_shares = simulate_market_shares(model, data, beta_values)
-        
-        # Calculate maximum absolute difference in shares
-        max_diff = max(abs(actual_shares[mode] - predicted_shares[mode]) 
-                      for mode in modes.keys())
-        
-        print(f"\nIteration {iteration + 1}")
-        print("Current shares:")
-        for mode in modes.keys():
-            print(f"Mode {mode}: Actual = {actual_shares[mode]:.3f}, "
-                  f"Predicted = {predicted_shares[mode]:.3f}")
-        print(f"Max difference: {max_diff:.6f}")
-        
-        # Check convergence
-        if max_diff < tolerance:
-            print("Converged!")
-            break
-        
-        # Adjust ASCs
-        for mode_num, asc_name in modes.items():
-            if mode_num in actual_shares and mode_num in predicted_shares:
-                adjustment = np.log(actual_shares[mode_num] / predicted_shares[mode_num])
-                beta_values[asc_name] += adjustment
-    
-    return beta_values
+    """
+    Calibrate alternative-specific constants to match observed market shares.
+    Solves the share equations by Newton's method on the model's utilities.
+    
+    Args:
+        model: Estimated model object (MNL, NL or Mixed Logit)
+        data (pd.DataFrame): Original dataset
+        actual_shares (dict): Dictionary of actual market shares
+        max_iter: Maximum number of Newton iterations
+        tolerance: Convergence tolerance for share differences
+    
+    Returns:
+        dict: Adjusted beta values with calibrated ASCs
+    """
+    return model.calibrate_constants(actual_shares, tolerance=tolerance, max_iter=max_iter)
 
 def print_shares_comparison(model_name, actual_shares, before_shares, after_shares):
     """Print a comparison of market shares before and after calibration."""
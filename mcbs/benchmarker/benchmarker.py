@@ -3,63 +3,93 @@ Module for systematic comparison of discrete choice models.
 Handles running multiple models and collecting their performance metrics.
 """
 
-from typing import Dict, List, Type, Optional
+from concurrent.futures import Executor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Dict, List, Type, Optional
+import os
+import tempfile
+import time
 import pandas as pd
 from ..models.base import BaseDiscreteChoiceModel
 from ..datasets.dataset_loader import DatasetLoader
+from .preprocessing import PreprocessingCache
 
 class ModelBenchmarker:
     """Class to handle systematic model comparison and benchmarking."""
     
-    def __init__(self):
-        """Initialize the benchmarker."""
+    def __init__(self, cache_dir: Optional[str] = None):
+        """
+        Initialize the benchmarker.
+
+        Args:
+            cache_dir: Optional directory where the data prepared for each
+                model family is cached across runs
+        """
         self.results = {}
         self.metrics_df = None
+        self.cv_results = None
+        self.preprocessing_cache = PreprocessingCache(cache_dir)
         
     def run_benchmark(self, 
                      data: pd.DataFrame,
                      models: List[Type[BaseDiscreteChoiceModel]],
-                     dataset_name: Optional[str] = None) -> pd.DataFrame:
+                     dataset_name: Optional[str] = None,
+                     n_jobs: int = 1,
+                     timeout: Optional[float] = None,
+                     executor: Optional[Executor] = None,
+                     work_dir: Optional[str] = None,
+                     parameter_file: str = 'biogeme.toml') -> pd.DataFrame:
         """
         Run benchmark comparison of multiple models on a dataset.
         
+        The data is prepared once per model family and shared by all the
+        models of the family, so each model only costs its estimation.
+        
         Args:
             data: DataFrame containing the choice data
             models: List of model classes to benchmark
             dataset_name: Name of the dataset (for reporting)
+            n_jobs: Number of worker processes; 1 estimates the models one
+                after another in the current process
+            timeout: Maximum estimation time per model in seconds (parallel
+                runs only); see _run_parallel for what happens to the task
+            executor: Optional executor to submit the estimations to instead
+                of creating a process pool; timed-out estimations are not
+                stopped and keep their worker busy until they end
+            work_dir: Directory under which each model run gets its own
+                scratch directory for Biogeme files. Parallel runs default to
+                a new temporary directory; sequential runs default to the
+                current directory.
+            parameter_file: Biogeme parameter file copied into each scratch directory
             
         Returns:
             DataFrame containing comparison metrics
         """
-        results = []
+        parallel = executor is not None or n_jobs != 1
+        if work_dir is None and parallel:
+            work_dir = tempfile.mkdtemp(prefix='mcbs_')
+            print(f"Biogeme output files are written to {work_dir}")
+        run_options = {'dataset_name': dataset_name, 'work_dir': work_dir,
+                       'parameter_file': parameter_file}
+        datasets = self._prepare_datasets(data, models)
         
-        for model_class in models:
+        if not parallel:
+            outcomes = [self._run_model(model_class, model_data, **run_options)
+                        for model_class, model_data in zip(models, datasets)]
+        else:
+            outcomes = self._run_parallel(datasets, models, n_jobs, timeout, executor, run_options)
+        
+        # Collect in the order the models were given, whichever finished first
+        results = []
+        for model_class, outcome in zip(models, outcomes):
             model_name = model_class.__name__
-            print(f"\nEstimating {model_name}...")
-            
-            try:
-                # Initialize and estimate model
-                model = model_class(data)
-                estimation_results = model.estimate()
-                
-                # Get metrics
-                metrics = model.get_metrics()
-                metrics['model_name'] = model_name
+            if 'error' in outcome:
+                print(f"Error estimating {model_name}: {outcome['error']}")
+                metrics = {'model_name': model_name, 'error': outcome['error']}
                 if dataset_name:
                     metrics['dataset'] = dataset_name
-                    
-                # Store full results
-                self.results[model_name] = {
-                    'model': model,
-                    'estimation_results': estimation_results,
-                    'metrics': metrics
-                }
-                
-                results.append(metrics)
-                
-            except Exception as e:
-                print(f"Error estimating {model_name}: {str(e)}")
-                continue
+                outcome['metrics'] = metrics
+            self.results[model_name] = outcome
+            results.append(outcome['metrics'])
         
         # Create comparison DataFrame
         self.metrics_df = pd.DataFrame(results)
@@ -68,6 +98,227 @@ class ModelBenchmarker:
         
         return self.metrics_df
     
+    def _prepare_datasets(self,
+                          data: pd.DataFrame,
+                          models: List[Type[BaseDiscreteChoiceModel]]) -> List[pd.DataFrame]:
+        """
+        Prepare the data once per model family.
+        
+        Returns:
+            List of the data to give each model, in the order of models; the
+            raw data if its preparation fails, so that the error is reported
+            by the model's run
+        """
+        prepared = {}
+        datasets = []
+        for model_class in models:
+            key = model_class.preprocessing_key()
+            if key not in prepared:
+                try:
+                    prepared[key] = self.preprocessing_cache.prepare(model_class, data)
+                except Exception:
+                    prepared[key] = data
+            datasets.append(prepared[key])
+        return datasets
+    
+    @staticmethod
+    def _run_model(model_class: Type[BaseDiscreteChoiceModel],
+                   data: pd.DataFrame,
+                   dataset_name: Optional[str] = None,
+                   work_dir: Optional[str] = None,
+                   parameter_file: str = 'biogeme.toml') -> Dict[str, Any]:
+        """
+        Estimate a single model and collect its metrics.
+        
+        Runs in a worker process for parallel benchmarks, so errors are
+        returned rather than raised.
+        
+        Args:
+            model_class: Model class to estimate
+            data: DataFrame containing the choice data
+            dataset_name: Name of the dataset (for reporting)
+            work_dir: Directory in which to create the scratch directory of
+                this run (None to run in the current directory)
+            parameter_file: Biogeme parameter file copied into the scratch directory
+            
+        Returns:
+            Dict with the model, estimation results, metrics and working
+            directory, or with the error message
+        """
+        model_name = model_class.__name__
+        print(f"\nEstimating {model_name}...")
+        
+        try:
+            # Initialize and estimate model
+            model = model_class(data)
+            if work_dir is not None:
+                os.makedirs(work_dir, exist_ok=True)
+                model.work_dir = tempfile.mkdtemp(prefix=f'{model_name}_', dir=work_dir)
+                model.parameter_file = parameter_file
+            with model.working_directory() as run_dir:
+                estimation_results = model.estimate()
+            
+            # Get metrics
+            metrics = model.get_metrics()
+            metrics['model_name'] = model_name
+            if dataset_name:
+                metrics['dataset'] = dataset_name
+                
+            return {
+                'model': model,
+                'estimation_results': estimation_results,
+                'metrics': metrics,
+                'work_dir': run_dir
+            }
+            
+        except Exception as e:
+            return {'error': str(e)}
+    
+    def _run_parallel(self,
+                      datasets: List[pd.DataFrame],
+                      models: List[Type[BaseDiscreteChoiceModel]],
+                      n_jobs: int,
+                      timeout: Optional[float],
+                      executor: Optional[Executor],
+                      run_options: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Estimate the models concurrently.
+        
+        The models are submitted one per free worker, so that a submitted
+        estimation starts right away instead of waiting in the executor's
+        queue, and the timeout of each model counts from the moment its
+        future is running.
+        
+        Limitations: a running task cannot be stopped. With the benchmark's
+        own process pool, the workers of timed-out models are terminated
+        once the other models are done. With a caller's executor they keep
+        running, and hold their worker, until the estimation ends; the
+        error of these models says so. When every worker is held that way,
+        the next model waits in the executor's queue, where a process pool
+        may already report it as running, so part of the wait can count
+        towards its timeout.
+        
+        Returns:
+            List of outcomes (see _run_model), in the order of models
+        """
+        own_executor = executor is None
+        if own_executor:
+            n_workers = None if n_jobs is None or n_jobs < 1 else n_jobs
+            executor = ProcessPoolExecutor(max_workers=n_workers)
+        # Number of tasks the executor runs at once
+        capacity = getattr(executor, '_max_workers', None) or (
+            n_jobs if n_jobs is not None and n_jobs > 0 else os.cpu_count() or 1)
+        
+        queued = list(range(len(models)))
+        outcomes = [None] * len(models)
+        pending = {}
+        started = {}
+        # Futures of timed-out models, which may still hold a worker
+        abandoned = []
+        
+        try:
+            while queued or pending:
+                busy = sum(not future.done() for future in abandoned)
+                while queued and len(pending) < max(1, capacity - busy):
+                    i = queued.pop(0)
+                    pending[i] = executor.submit(self._run_model, models[i], datasets[i], **run_options)
+                wait(list(pending.values()), timeout=0.5 if timeout or abandoned else None,
+                     return_when=FIRST_COMPLETED)
+                now = time.monotonic()
+                for i, future in list(pending.items()):
+                    if future.done():
+                        try:
+                            outcomes[i] = future.result()
+                        except Exception as e:
+                            # e.g. a worker process died or the outcome could not be pickled
+                            outcomes[i] = {'error': f"{type(e).__name__}: {e}"}
+                        del pending[i]
+                    elif timeout is not None and future.running():
+                        started.setdefault(i, now)
+                        if now - started[i] > timeout:
+                            future.cancel()
+                            error = f"Timed out after {timeout} seconds"
+                            if not own_executor:
+                                error += "; the estimation keeps running in the executor"
+                            outcomes[i] = {'error': error}
+                            del pending[i]
+                            abandoned.append(future)
+        finally:
+            if own_executor:
+                if abandoned:
+                    # Running tasks cannot be cancelled, so stop their workers
+                    for process in list(getattr(executor, '_processes', {}).values()):
+                        process.terminate()
+                executor.shutdown(wait=not abandoned, cancel_futures=True)
+        
+        return outcomes
+    
+    def run_cross_validation(self,
+                             data: pd.DataFrame,
+                             models: List[Type[BaseDiscreteChoiceModel]],
+                             n_folds: int = 5,
+                             group_by: Optional[Any] = None,
+                             time_column: Optional[str] = None,
+                             seed: Optional[int] = None,
+                             n_jobs: int = 1,
+                             dataset_name: Optional[str] = None,
+                             work_dir: Optional[str] = None,
+                             parameter_file: str = 'biogeme.toml') -> pd.DataFrame:
+        """
+        Cross-validate models on a dataset.
+
+        Each model is estimated on the full sample, then on each fold's
+        estimation rows starting from the full-sample estimates, and
+        evaluated on the fold's held-out rows.
+
+        Args:
+            data: DataFrame containing the choice data
+            models: List of model classes to cross-validate
+            n_folds: Number of folds of k-fold and grouped splits
+            group_by: Column, or list of columns, of the groups kept whole in
+                a fold, e.g. 'household_id' for LTDS or 'ID' for Swissmetro
+                (None for k-fold splits of the observations)
+            time_column: Column of the periods of out-of-time splits, e.g.
+                'survey_year' for LTDS
+            seed: Seed of the fold assignment
+            n_jobs: Number of worker processes running the folds of a model
+            dataset_name: Name of the dataset (for reporting)
+            work_dir: Directory under which the estimations get their scratch
+                directories (defaults to a new temporary directory)
+            parameter_file: Biogeme parameter file copied into each scratch directory
+
+        Returns:
+            DataFrame with one row per model and fold: out-of-sample log
+            likelihood, choice accuracy and market share accuracy
+        """
+        from .cross_validation import cross_validate, model_folds
+
+        if work_dir is None:
+            work_dir = tempfile.mkdtemp(prefix='mcbs_cv_')
+            print(f"Biogeme output files are written to {work_dir}")
+
+        results = []
+        for model_class, model_data in zip(models, self._prepare_datasets(data, models)):
+            model_name = model_class.__name__
+            outcome = self._run_model(model_class, model_data, dataset_name=dataset_name,
+                                      work_dir=work_dir, parameter_file=parameter_file)
+            if 'error' in outcome:
+                print(f"Error estimating {model_name}: {outcome['error']}")
+                folds = pd.DataFrame([{'error': outcome['error']}])
+            else:
+                model = outcome['model']
+                print(f"\nCross-validating {model_name}...")
+                folds = cross_validate(model,
+                                       model_folds(model, n_folds, group_by, time_column, seed),
+                                       n_jobs=n_jobs, work_dir=outcome['work_dir'])
+            folds.insert(0, 'model_name', model_name)
+            if dataset_name:
+                folds.insert(1, 'dataset', dataset_name)
+            results.append(folds)
+
+        self.cv_results = pd.concat(results, ignore_index=True)
+        return self.cv_results
+
     def _sort_metrics(self):
         """Sort metrics by rho squared bar and final log likelihood."""
         if 'rho_squared_bar' in self.metrics_df.columns:
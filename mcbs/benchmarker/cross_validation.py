@@ -0,0 +1,201 @@
+"""
+Cross-validation of discrete choice models.
+
+Folds are pairs of row positions in the model's data: k random folds, folds
+of whole groups (households, respondents) so that no group is both estimated
+and predicted, or out-of-time splits that predict each period from the
+previous ones. Each fold is estimated from the full-sample estimates and
+evaluated on its held-out rows.
+"""
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import copy
+import os
+import shutil
+import tempfile
+from typing import Any, Dict, List, Optional, Sequence, Union
+import numpy as np
+import pandas as pd
+
+# A fold: its name and the positions of its estimation and held-out rows
+Fold = namedtuple('Fold', ['name', 'train', 'test'])
+
+# Model whose folds are run by this process
+_template = None
+
+
+def kfold_splits(n_rows: int, n_folds: int = 5, seed: Optional[int] = None) -> List[Fold]:
+    """
+    Split rows into k random folds of (almost) equal size.
+
+    Args:
+        n_rows: Number of rows
+        n_folds: Number of folds
+        seed: Seed of the shuffle
+
+    Returns:
+        List of Fold, each holding out one fold
+    """
+    return group_kfold_splits(np.arange(n_rows), n_folds, seed)
+
+
+def group_kfold_splits(groups: np.ndarray, n_folds: int = 5, seed: Optional[int] = None) -> List[Fold]:
+    """
+    Split rows into k folds of whole groups.
+
+    Args:
+        groups: Group number (0..G-1) of each row
+        n_folds: Number of folds
+        seed: Seed of the shuffle of the groups
+
+    Returns:
+        List of Fold, each holding out the rows of one fold of groups
+    """
+    groups = np.asarray(groups)
+    n_groups = int(groups.max()) + 1
+    if n_folds < 2 or n_folds > n_groups:
+        raise ValueError(f"n_folds must be between 2 and the number of groups ({n_groups})")
+    fold_of_group = np.empty(n_groups, dtype=np.intp)
+    fold_of_group[np.random.default_rng(seed).permutation(n_groups)] = np.arange(n_groups) % n_folds
+    fold_of_row = fold_of_group[groups]
+    return [Fold(f'fold_{k}', np.flatnonzero(fold_of_row != k), np.flatnonzero(fold_of_row == k))
+            for k in range(n_folds)]
+
+
+def time_splits(times: np.ndarray) -> List[Fold]:
+    """
+    Split rows into out-of-time folds.
+
+    Each period after the first is held out and predicted from all the
+    periods before it.
+
+    Args:
+        times: Period of each row (e.g. survey year)
+
+    Returns:
+        List of Fold, one per held-out period
+    """
+    times = np.asarray(times)
+    periods = np.unique(times)
+    if len(periods) < 2:
+        raise ValueError("Out-of-time splits require at least two periods")
+    return [Fold(f'{period}', np.flatnonzero(times < period), np.flatnonzero(times == period))
+            for period in periods[1:]]
+
+
+def model_folds(model,
+                n_folds: int = 5,
+                group_by: Optional[Union[str, Sequence[str]]] = None,
+                time_column: Optional[str] = None,
+                seed: Optional[int] = None) -> List[Fold]:
+    """
+    Split the data of a model into folds.
+
+    Args:
+        model: BaseDiscreteChoiceModel
+        n_folds: Number of folds (k-fold and grouped splits)
+        group_by: Column, or list of columns, of the groups kept whole,
+            e.g. 'household_id' for LTDS or 'ID' for Swissmetro
+        time_column: Column of the periods of out-of-time splits, e.g.
+            'survey_year'; takes precedence over group_by
+        seed: Seed of the shuffle
+
+    Returns:
+        List of Fold
+    """
+    data = model.database.data
+    if time_column is not None:
+        return time_splits(data[time_column].to_numpy())
+    if group_by is None:
+        return kfold_splits(len(data), n_folds, seed)
+    if model.frequencies is not None:
+        raise ValueError("Collapsed data can only be split by rows, since its rows "
+                         "may merge several groups")
+    columns = [group_by] if isinstance(group_by, str) else list(group_by)
+    return group_kfold_splits(data.groupby(columns, sort=False).ngroup().to_numpy(),
+                              n_folds, seed)
+
+
+def _initialize(template):
+    """Set the model whose folds are run by this process."""
+    global _template
+    _template = template
+
+
+def _run_fold(fold: Fold, work_dir: str) -> Dict[str, Any]:
+    """
+    Estimate a fold of the template model and evaluate it on its held-out rows.
+
+    Runs in a worker process for parallel cross-validations, so errors are
+    returned rather than raised.
+
+    Args:
+        fold: Fold to run
+        work_dir: Directory in which to create the scratch directory of the fold
+
+    Returns:
+        Dict of the fold metrics, or with the error message
+    """
+    frequencies = _template.frequencies
+    train = _template._subset(fold.train, None if frequencies is None else frequencies[fold.train])
+    test = _template._subset(fold.test, None if frequencies is None else frequencies[fold.test])
+    train.work_dir = tempfile.mkdtemp(prefix=f'{fold.name}_', dir=work_dir)
+    outcome = {'fold': fold.name, 'n_train': len(fold.train), 'n_test': len(fold.test)}
+    try:
+        with train.working_directory():
+            train.estimate()
+        outcome['train_ll'] = train.final_ll
+        outcome.update(test.evaluate(train.results.get_beta_values()))
+    except Exception as e:
+        outcome['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        shutil.rmtree(train.work_dir, ignore_errors=True)
+    return outcome
+
+
+def cross_validate(model, folds: Sequence[Fold], n_jobs: int = 1,
+                   work_dir: Optional[str] = None) -> pd.DataFrame:
+    """
+    Cross-validate an estimated model.
+
+    Each fold is a shallow copy of the model on its estimation rows,
+    warm-started from the full-sample estimates, so the data is only
+    pickled once per worker process.
+
+    Args:
+        model: Estimated BaseDiscreteChoiceModel
+        folds: Folds to run (see model_folds)
+        n_jobs: Number of worker processes; 1 runs the folds one after
+            another in the current process
+        work_dir: Directory in which the folds get their scratch directories
+            (defaults to a new temporary directory)
+
+    Returns:
+        DataFrame with one row per fold: estimation and held-out sizes,
+        estimation log likelihood, out-of-sample log likelihood, choice
+        accuracy and market share accuracy
+    """
+    if model.results is None:
+        raise RuntimeError("Model must be estimated before cross-validation")
+
+    template = copy.copy(model)
+    template.parameter_file = os.path.abspath(model.parameter_file)
+    template.start_values = model.results.get_beta_values()
+    own_work_dir = work_dir is None
+    if own_work_dir:
+        work_dir = tempfile.mkdtemp(prefix='mcbs_cv_')
+    os.makedirs(work_dir, exist_ok=True)
+
+    try:
+        if n_jobs == 1:
+            _initialize(template)
+            outcomes = [_run_fold(fold, work_dir) for fold in folds]
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=_initialize,
+                                     initargs=(template,)) as pool:
+                outcomes = list(pool.map(_run_fold, folds, [work_dir] * len(folds)))
+    finally:
+        if own_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return pd.DataFrame(outcomes)
@@ -0,0 +1,106 @@
+"""
+Cache of data prepared for the model families of a benchmark.
+
+Every model class of a family (e.g. all Swissmetro models) prepares raw
+data the same way (see BaseDiscreteChoiceModel.prepare_data), so a benchmark
+prepares each dataset once per family and hands the result to all of its
+models. Prepared data is cached in memory and, optionally, on disk, keyed by
+the family's preprocessing key (which includes its preprocessing_version)
+and a hash of the raw data.
+"""
+
+import hashlib
+import os
+import tempfile
+from typing import Optional, Type
+import pandas as pd
+from ..datasets.memory_cache import DatasetCache
+from ..models.base import PREPARED_ATTRIBUTE, BaseDiscreteChoiceModel
+
+
+def data_digest(data: pd.DataFrame) -> str:
+    """
+    Get a SHA-256 digest of the content of a DataFrame.
+
+    Args:
+        data: DataFrame to hash
+
+    Returns:
+        str: Hex digest of the column names, dtypes, index and values
+    """
+    sha = hashlib.sha256()
+    sha.update(repr([(str(name), str(dtype)) for name, dtype in data.dtypes.items()]).encode())
+    sha.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    return sha.hexdigest()
+
+
+class PreprocessingCache:
+    """
+    Prepared data of model families, cached in memory and optionally on disk.
+
+    Cached DataFrames are read-only and handed out as shallow copies, as in
+    the dataset loader's cache.
+
+    Args:
+        cache_dir: Optional directory of the on-disk cache (pickle files)
+        maxsize: Maximum number of prepared DataFrames kept in memory
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, maxsize: int = 8):
+        self.cache_dir = cache_dir
+        self._memory = DatasetCache(maxsize)
+
+    def prepare(self, model_class: Type[BaseDiscreteChoiceModel], data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Get the data prepared for a model class, preparing it on a cache miss.
+
+        Args:
+            model_class: Model class whose family preparation to apply
+            data: Raw data
+
+        Returns:
+            pd.DataFrame: Prepared data, which model_class and the other
+            classes of its family accept without preparing it again
+        """
+        key = model_class.preprocessing_key()
+        if data.attrs.get(PREPARED_ATTRIBUTE) == key:
+            return data
+        entry = (key, data_digest(data))
+
+        prepared = self._memory.get(entry)
+        if prepared is not None:
+            return prepared
+
+        path = self._path(entry)
+        if path is not None and os.path.exists(path):
+            prepared = pd.read_pickle(path)
+        else:
+            prepared = model_class.prepare_data(data)
+            if path is not None:
+                self._save(prepared, path)
+        return self._memory.put(entry, prepared)
+
+    def clear(self) -> None:
+        """Remove the prepared data cached in memory (the disk cache is kept)."""
+        self._memory.clear()
+
+    def _path(self, entry) -> Optional[str]:
+        """Get the disk cache file of an entry (None without a cache directory)."""
+        if self.cache_dir is None:
+            return None
+        key, digest = entry
+        family = hashlib.sha256(key.encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f'{family}_{digest}.pkl')
+
+    def _save(self, prepared: pd.DataFrame, path: str) -> None:
+        """Write prepared data to the disk cache, atomically so that readers never see partial files."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            prepared.to_pickle(temporary)
+            os.replace(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
@@ -1,9 +1,11 @@
 from .dataset_loader import DatasetLoader
-from typing import Optional, Tuple, Union
+from typing import Any, List, Optional, Tuple, Union
 import pandas as pd
 
 def fetch_data(dataset_name: str, return_X_y: bool = False, 
-              local_cache_dir: Optional[str] = None, dropna: bool = True) -> Union[pd.DataFrame, Tuple]:
+              local_cache_dir: Optional[str] = None, dropna: bool = True,
+              columns: Optional[List[str]] = None,
+              filters: Optional[List[Tuple[str, str, Any]]] = None) -> Union[pd.DataFrame, Tuple]:
     """Download a dataset from the MCBS repository, optionally store it locally, and return it.
     
     Parameters
@@ -15,7 +17,12 @@ def fetch_data(dataset_name: str, return_X_y: bool = False,
     local_cache_dir : str, optional
         Directory to use for caching datasets. If None, uses ~/.mcbs/datasets
     dropna : bool, default=True
-        Whether to drop rows with NA values.
+        Whether to drop rows with NA values (in the loaded columns).
+    columns : list of str, optional
+        Columns to load. If None, loads all columns.
+    filters : list of tuples, optional
+        Row predicates ``(column, op, value)`` that must all hold, e.g.
+        ``[('PURPOSE', 'in', [1, 3]), ('CHOICE', '!=', 0)]``.
         
     Returns
     -------
@@ -25,6 +32,7 @@ def fetch_data(dataset_name: str, return_X_y: bool = False,
     """
     loader = DatasetLoader(use_local_cache=(local_cache_dir is not None), 
                           local_cache_dir=local_cache_dir)
-    return loader.fetch_data(dataset_name, return_X_y=return_X_y, dropna=dropna)
+    return loader.fetch_data(dataset_name, return_X_y=return_X_y, dropna=dropna,
+                             columns=columns, filters=filters)
 
 __all__ = ['DatasetLoader', 'fetch_data']
\ No newline at end of file
@@ -1,13 +1,18 @@
 # mcbs/datasets/dataset_loader.py
 
+import numpy as np
 import pandas as pd
 from typing import Dict, Any, List, Optional, Tuple
+import operator
 import os
 import json
 import logging
 import gzip
+import hashlib
+import tempfile
 import requests
 from pathlib import Path
+from .memory_cache import DATASET_CACHE
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -16,8 +21,29 @@ logger = logging.getLogger(__name__)
 GITHUB_URL = 'https://raw.githubusercontent.com/carlosguirado/mcbs-datasets/main/datasets'
 DEFAULT_CACHE_DIR = os.path.join(str(Path.home()), '.mcbs', 'datasets')
 
+# Row predicates accepted by fetch_data, as (column, op, value) tuples
+FILTER_OPERATORS = {
+    '=': operator.eq,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    'in': lambda series, value: series.isin(value),
+    'not in': lambda series, value: ~series.isin(value),
+}
+
+# The columnar cache needs pyarrow; without it the loader keeps caching CSV files
+try:
+    import pyarrow  # noqa: F401
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
 class DatasetLoader:
-    def __init__(self, use_local_cache: bool = True, local_cache_dir: Optional[str] = None):
+    def __init__(self, use_local_cache: bool = True, local_cache_dir: Optional[str] = None,
+                 use_memory_cache: bool = True):
         """Initialize the DatasetLoader.
         
         Parameters
@@ -26,12 +52,17 @@ class DatasetLoader:
             Whether to use local cache for datasets
         local_cache_dir : str, optional
             Directory to use for caching datasets. If None, uses ~/.mcbs/datasets
+        use_memory_cache : bool, default=True
+            Whether to share loaded datasets through the process-wide
+            in-memory cache. Cached DataFrames are read-only; call ``.copy()``
+            before modifying values in place.
         """
         self.datasets_path = os.path.dirname(__file__)
         self.metadata_path = os.path.join(self.datasets_path, 'metadata.json')
         self.datasets_metadata = self._load_metadata()
         self.use_local_cache = use_local_cache
         self.local_cache_dir = local_cache_dir if local_cache_dir else DEFAULT_CACHE_DIR
+        self.memory_cache = DATASET_CACHE if use_memory_cache else None
 
         # Create cache directory if it doesn't exist and caching is enabled
         if self.use_local_cache and not os.path.exists(self.local_cache_dir):
@@ -48,7 +79,9 @@ class DatasetLoader:
         except FileNotFoundError:
             raise FileNotFoundError(f"Metadata file not found at {self.metadata_path}")
 
-    def fetch_data(self, dataset_name: str, return_X_y: bool = False, dropna: bool = True) -> pd.DataFrame:
+    def fetch_data(self, dataset_name: str, return_X_y: bool = False, dropna: bool = True,
+                   columns: Optional[List[str]] = None,
+                   filters: Optional[List[Tuple[str, str, Any]]] = None) -> pd.DataFrame:
         """Download a dataset, optionally store it locally, and return it.
         
         Parameters
@@ -58,7 +91,15 @@ class DatasetLoader:
         return_X_y : bool, default=False
             Whether to return the data split into features and target.
         dropna : bool, default=True
-            Whether to drop rows with NA values.
+            Whether to drop rows with NA values (in the loaded columns).
+        columns : list of str, optional
+            Columns to load. If None, loads all columns. The target is added
+            when return_X_y is True.
+        filters : list of tuples, optional
+            Row predicates ``(column, op, value)`` that must all hold, with op
+            one of ``=``, ``==``, ``!=``, ``<``, ``<=``, ``>``, ``>=``, ``in``
+            and ``not in``. Filter columns do not need to be in ``columns``.
+            When the columnar cache is used they are applied while reading.
             
         Returns
         -------
@@ -76,6 +117,13 @@ class DatasetLoader:
         
         filename = dataset_info['filename']
         
+        if columns is not None:
+            columns = list(columns)
+            target_col = dataset_info.get('target')
+            if return_X_y and target_col and target_col not in columns:
+                columns.append(target_col)
+        filters = self._validate_filters(filters)
+        
         # Check if using local cache and if file exists in cache
         if self.use_local_cache:
             cache_path = os.path.join(self.local_cache_dir, filename)
@@ -85,22 +133,61 @@ class DatasetLoader:
             if not os.path.exists(cache_dir):
                 os.makedirs(cache_dir, exist_ok=True)
             
-            # Use cached file if it exists
-            if os.path.exists(cache_path):
-                logger.info(f"Loading dataset from local cache: {cache_path}")
-                df = self._load_file(cache_path)
-            else:
+            columnar_path = self._get_columnar_cache_path(dataset_name, cache_path)
+            if not os.path.exists(cache_path) and not (columnar_path and os.path.exists(columnar_path)):
                 # Download and cache the file
                 logger.info(f"Dataset not found in cache. Downloading from remote source.")
                 df = self._download_and_cache_dataset(dataset_name, filename, cache_path)
+                if columnar_path is not None:
+                    logger.info(f"Saving dataset to columnar cache: {columnar_path}")
+                    self._save_to_cache(df, columnar_path)
+            
+            if columnar_path is not None and os.path.exists(columnar_path):
+                source_path = columnar_path
+                
+                def read_source():
+                    logger.info(f"Loading dataset from columnar cache: {columnar_path}")
+                    return self._read_columnar(columnar_path, columns, filters)
+            else:
+                source_path = cache_path
+                
+                def read_source():
+                    logger.info(f"Loading dataset from local cache: {cache_path}")
+                    df = self._apply_schema(dataset_name, self._load_file(cache_path))
+                    if columnar_path is not None:
+                        logger.info(f"Saving dataset to columnar cache: {columnar_path}")
+                        self._save_to_cache(df, columnar_path)
+                    return self._select(df, columns, filters)
+            source_key = None
         else:
-            # Directly download without caching
-            logger.info(f"Local cache disabled. Downloading dataset from remote source.")
+            # Directly download without caching. The memory cache is keyed on
+            # the URL, so the download only happens on a miss.
             dataset_url = self._get_dataset_url(filename)
-            df = self._download_dataset(dataset_url, filename)
+            source_path = None
+            source_key = dataset_url
+            
+            def read_source():
+                logger.info(f"Local cache disabled. Downloading dataset from remote source.")
+                df = self._download_dataset(dataset_url, filename)
+                return self._select(self._apply_schema(dataset_name, df), columns, filters)
         
-        if dropna:
-            df = df.dropna()
+        if self.memory_cache is None:
+            df = read_source()
+            if dropna:
+                df = df.dropna()
+        else:
+            if source_key is None:
+                source_key = self.memory_cache.file_digest(source_path)
+            key = (dataset_name, self._get_metadata_fingerprint(dataset_name), source_key,
+                   None if columns is None else tuple(columns), repr(filters), dropna)
+            df = self.memory_cache.get(key)
+            if df is not None:
+                logger.info(f"Loading dataset '{dataset_name}' from memory cache")
+            else:
+                df = read_source()
+                if dropna:
+                    df = df.dropna()
+                df = self.memory_cache.put(key, df)
             
         logger.info(f"Successfully loaded dataset '{dataset_name}' with shape {df.shape}")
         
@@ -115,43 +202,168 @@ class DatasetLoader:
         else:
             return df
             
+    def _validate_filters(self, filters: Optional[List[Tuple[str, str, Any]]]) -> Optional[List[Tuple[str, str, Any]]]:
+        """Check that row predicates are (column, op, value) tuples with a supported op."""
+        if not filters:
+            return None
+        
+        validated = []
+        for predicate in filters:
+            if len(predicate) != 3:
+                raise ValueError(f"Filters must be (column, op, value) tuples, got {predicate!r}")
+            column, op, value = predicate
+            if op not in FILTER_OPERATORS:
+                raise ValueError(f"Unsupported filter operator '{op}'. Supported: {', '.join(FILTER_OPERATORS)}")
+            validated.append((column, op, value))
+        return validated
+    
+    def _read_columnar(self, path: str, columns: Optional[List[str]],
+                       filters: Optional[List[Tuple[str, str, Any]]]) -> pd.DataFrame:
+        """Read the Parquet cache, pushing the projection and predicates down to the reader."""
+        import pyarrow.parquet as pq
+        
+        available = pq.read_schema(path).names
+        requested = list(columns or []) + [col for col, _, _ in filters or []]
+        missing = [col for col in requested if col not in available]
+        if missing:
+            raise ValueError(f"Unknown columns requested: {missing}")
+        if filters:
+            # pyarrow uses '==' for equality and needs list-like 'in' values
+            filters = [(col, '==' if op == '=' else op,
+                        list(value) if op in ('in', 'not in') else value)
+                       for col, op, value in filters]
+        return pd.read_parquet(path, columns=columns, filters=filters)
+    
+    def _select(self, df: pd.DataFrame, columns: Optional[List[str]],
+                filters: Optional[List[Tuple[str, str, Any]]]) -> pd.DataFrame:
+        """Apply row predicates and column projection to a loaded DataFrame."""
+        requested = list(columns or []) + [col for col, _, _ in filters or []]
+        missing = [col for col in requested if col not in df.columns]
+        if missing:
+            raise ValueError(f"Unknown columns requested: {missing}")
+        
+        if filters:
+            mask = pd.Series(True, index=df.index)
+            for column, op, value in filters:
+                mask &= FILTER_OPERATORS[op](df[column], value)
+            # Renumber rows like the columnar reader does
+            df = df[mask].reset_index(drop=True)
+        
+        if columns is not None:
+            df = df[columns]
+        return df
+    
+    def _get_columnar_cache_path(self, dataset_name: str, cache_path: str) -> Optional[str]:
+        """Get the path of the Parquet cache of a dataset (None if Parquet is unavailable).
+        
+        The file name includes a fingerprint of the dataset metadata, so a
+        change in the schema never serves a stale cache.
+        """
+        if not PARQUET_AVAILABLE:
+            return None
+        
+        fingerprint = self._get_metadata_fingerprint(dataset_name)
+        stem = os.path.basename(cache_path).split('.')[0]
+        return os.path.join(os.path.dirname(cache_path), f"{stem}.{fingerprint}.parquet")
+    
+    def _get_metadata_fingerprint(self, dataset_name: str) -> str:
+        """Get a short hash of a dataset's metadata entry."""
+        dataset_info = json.dumps(self.datasets_metadata[dataset_name], sort_keys=True)
+        return hashlib.sha1(dataset_info.encode('utf-8')).hexdigest()[:12]
+    
+    def _apply_schema(self, dataset_name: str, df: pd.DataFrame) -> pd.DataFrame:
+        """Check a freshly parsed dataset against its metadata and apply its dtype schema.
+        
+        The optional ``dtypes`` entry of the metadata maps columns to either a
+        NumPy dtype name (e.g. ``"int8"`` or ``"float32"``) or to
+        ``{"categories": [...]}`` for a pandas categorical whose codes follow
+        the listed order.
+        """
+        dataset_info = self.datasets_metadata[dataset_name]
+        expected = list(dataset_info.get('features', []))
+        if dataset_info.get('target'):
+            expected.append(dataset_info['target'])
+        
+        missing = [col for col in expected if col not in df.columns]
+        if missing:
+            raise ValueError(f"Dataset '{dataset_name}' is missing columns declared in metadata: {missing}")
+        
+        dtypes = dataset_info.get('dtypes', {})
+        if not dtypes:
+            return df
+        
+        typed = {}
+        for col, spec in dtypes.items():
+            if col not in df.columns:
+                raise ValueError(f"Dataset '{dataset_name}' has a dtype for unknown column '{col}'")
+            typed[col] = self._convert_column(dataset_name, df[col], spec)
+        
+        return df.assign(**typed)
+    
+    def _convert_column(self, dataset_name: str, series: pd.Series, spec: Any) -> pd.Series:
+        """Convert a column to the dtype given by its schema entry without losing values."""
+        if isinstance(spec, dict):
+            converted = pd.Categorical(series, categories=spec['categories'])
+            unknown = series[pd.isna(converted) & series.notna()].unique()
+            if len(unknown):
+                raise ValueError(f"Dataset '{dataset_name}' column '{series.name}' has values "
+                                 f"missing from its categories: {list(unknown)}")
+            return pd.Series(converted, index=series.index, name=series.name)
+        
+        dtype = np.dtype(spec)
+        if dtype.kind in 'iu':
+            if series.isna().any():
+                raise ValueError(f"Dataset '{dataset_name}' column '{series.name}' has missing "
+                                 f"values and cannot be stored as {dtype}")
+            info = np.iinfo(dtype)
+            if series.min() < info.min or series.max() > info.max or (series % 1 != 0).any():
+                raise ValueError(f"Dataset '{dataset_name}' column '{series.name}' does not fit in {dtype}")
+        return series.astype(dtype)
+            
     def _get_dataset_url(self, filename: str) -> str:
         """Construct the URL for a dataset file."""
         return f"{GITHUB_URL}/{filename}"
             
     def _download_dataset(self, dataset_url: str, filename: str) -> pd.DataFrame:
         """Download a dataset from a URL."""
-        logger.info(f"Downloading dataset from: {dataset_url}")
-        
         try:
-            response = requests.get(dataset_url)
-            response.raise_for_status()  # Raise an exception for HTTP errors
-            
-            _, file_extension = os.path.splitext(filename)
-            
-            # Handle different file types
-            if file_extension.lower() == '.gz':
-                import io
-                with gzip.open(io.BytesIO(response.content), 'rt') as f:
-                    return pd.read_csv(f)
-            elif file_extension.lower() == '.csv':
-                import io
-                return pd.read_csv(io.StringIO(response.text))
-            elif file_extension.lower() == '.parquet':
-                import io
-                return pd.read_parquet(io.BytesIO(response.content))
-            else:
-                raise ValueError(f"Unsupported file format: {file_extension}")
-                
+            return self._read_content(self._download_content(dataset_url), filename)
         except requests.exceptions.RequestException as e:
             # If download fails, try to load from local package directory as fallback
-            logger.warning(f"Error downloading dataset: {str(e)}. Trying local fallback...")
-            local_path = os.path.join(self.datasets_path, filename)
-            if os.path.exists(local_path):
-                logger.info(f"Using local fallback file: {local_path}")
-                return self._load_file(local_path)
-            else:
-                raise ConnectionError(f"Error downloading dataset: {str(e)}")
+            return self._load_file(self._get_fallback_path(filename, e))
+    
+    def _download_content(self, dataset_url: str) -> bytes:
+        """Download the raw content of a dataset file."""
+        logger.info(f"Downloading dataset from: {dataset_url}")
+        response = requests.get(dataset_url)
+        response.raise_for_status()  # Raise an exception for HTTP errors
+        return response.content
+    
+    def _read_content(self, content: bytes, filename: str) -> pd.DataFrame:
+        """Parse the raw content of a downloaded dataset file."""
+        import io
+        _, file_extension = os.path.splitext(filename)
+        
+        # Handle different file types
+        if file_extension.lower() == '.gz':
+            with gzip.open(io.BytesIO(content), 'rt') as f:
+                return pd.read_csv(f)
+        elif file_extension.lower() == '.csv':
+            return pd.read_csv(io.BytesIO(content))
+        elif file_extension.lower() == '.parquet':
+            return pd.read_parquet(io.BytesIO(content))
+        else:
+            raise ValueError(f"Unsupported file format: {file_extension}")
+    
+    def _get_fallback_path(self, filename: str, error: Exception) -> str:
+        """Get the copy of a dataset shipped with the package after a failed download."""
+        logger.warning(f"Error downloading dataset: {str(error)}. Trying local fallback...")
+        local_path = os.path.join(self.datasets_path, filename)
+        if os.path.exists(local_path):
+            logger.info(f"Using local fallback file: {local_path}")
+            return local_path
+        else:
+            raise ConnectionError(f"Error downloading dataset: {str(error)}")
             
     def _download_and_cache_dataset(self, dataset_name: str, filename: str, cache_path: str) -> pd.DataFrame:
         """Download a dataset and save it to the cache directory."""
@@ -161,9 +373,12 @@ class DatasetLoader:
             # Download the dataset
             df = self._download_dataset(dataset_url, filename)
             
-            # Save to cache
-            logger.info(f"Saving dataset to cache: {cache_path}")
-            self._save_to_cache(df, cache_path)
+            df = self._apply_schema(dataset_name, df)
+            
+            # Save the raw file to cache when there is no columnar cache to serve later loads
+            if not PARQUET_AVAILABLE:
+                logger.info(f"Saving dataset to cache: {cache_path}")
+                self._save_to_cache(df, cache_path)
             
             return df
             
@@ -188,7 +403,15 @@ class DatasetLoader:
         elif file_extension.lower() == '.csv':
             df.to_csv(cache_path, index=False)
         elif file_extension.lower() == '.parquet':
-            df.to_parquet(cache_path, index=False)
+            # Write to a temporary file first so concurrent readers never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            os.close(fd)
+            try:
+                df.to_parquet(tmp_path, index=False)
+                os.replace(tmp_path, cache_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
         else:
             raise ValueError(f"Unsupported file format for caching: {file_extension}")
             
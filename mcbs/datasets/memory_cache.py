@@ -0,0 +1,128 @@
+# mcbs/datasets/memory_cache.py
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+
+import pandas as pd
+
+
+def freeze_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Return a DataFrame whose column arrays are read-only.
+
+    Columns are kept as separate blocks so that locking a column's array
+    locks the data pandas actually writes to. In-place writes into the
+    returned frame (e.g. ``df.loc[mask, col] = value``) raise ``ValueError``,
+    while adding, replacing or dropping columns and rows works as usual.
+
+    Parameters
+    ----------
+    df : DataFrame
+        The DataFrame to freeze. It is not modified.
+
+    Returns
+    -------
+    frozen : DataFrame
+        A DataFrame holding read-only copies of the columns of ``df``.
+    """
+    columns = {}
+    for position, name in enumerate(df.columns):
+        column = df.iloc[:, position]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            codes = column.cat.codes.to_numpy(copy=True)
+            codes.flags.writeable = False
+            columns[position] = pd.Categorical.from_codes(codes, dtype=column.dtype)
+        elif isinstance(column.dtype, pd.api.extensions.ExtensionDtype):
+            # Extension arrays have no generic read-only flag
+            columns[position] = column.array.copy()
+        else:
+            values = column.to_numpy(copy=True)
+            values.flags.writeable = False
+            columns[position] = values
+
+    frozen = pd.DataFrame(columns, index=df.index, copy=False)
+    frozen.columns = df.columns
+    frozen.attrs = dict(df.attrs)
+    return frozen
+
+
+class DatasetCache:
+    """Thread-safe LRU cache of loaded datasets shared by all DatasetLoader instances.
+
+    Entries are stored read-only and handed out as shallow copies, so a hit
+    costs no parsing or copying and no caller can modify the data seen by
+    another one. Callers that need to modify values in place should take a
+    ``.copy()`` first.
+
+    Parameters
+    ----------
+    maxsize : int, default=8
+        Maximum number of DataFrames kept in memory. The least recently used
+        entry is evicted first.
+    """
+
+    def __init__(self, maxsize: int = 8):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Hashable, pd.DataFrame]" = OrderedDict()
+        self._digests: Dict[str, Tuple[Tuple[int, int], str]] = {}
+        self._lock = threading.RLock()
+
+    def file_digest(self, path: str) -> str:
+        """Get the SHA-256 digest of a file's content.
+
+        The digest is recomputed only when the size or modification time of
+        the file changes.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        signature = (stat.st_size, stat.st_mtime_ns)
+
+        with self._lock:
+            known = self._digests.get(path)
+            if known is not None and known[0] == signature:
+                return known[1]
+
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+
+        with self._lock:
+            self._digests[path] = (signature, digest)
+        return digest
+
+    def get(self, key: Hashable) -> Optional[pd.DataFrame]:
+        """Get a read-only view of a cached DataFrame, or None if it is not cached."""
+        with self._lock:
+            df = self._entries.get(key)
+            if df is None:
+                return None
+            self._entries.move_to_end(key)
+            return df.copy(deep=False)
+
+    def put(self, key: Hashable, df: pd.DataFrame) -> pd.DataFrame:
+        """Store a DataFrame and return a read-only view of the stored copy."""
+        frozen = freeze_frame(df)
+        with self._lock:
+            self._entries[key] = frozen
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            return frozen.copy(deep=False)
+
+    def clear(self) -> None:
+        """Remove all cached DataFrames."""
+        with self._lock:
+            self._entries.clear()
+            self._digests.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+# Cache shared by every DatasetLoader in the process
+DATASET_CACHE = DatasetCache()
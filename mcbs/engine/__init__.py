@@ -0,0 +1,32 @@
+"""
+MCBS Engine Module
+Native NumPy routines for choice probabilities, simulation draws,
+quadrature and estimation used alongside Biogeme.
+"""
+
+from .probabilities import (logsumexp, logit_probabilities, nested_logit_probabilities,
+                            nests_from_biogeme)
+from .draws import DRAW_TYPES, normal_draws, biogeme_draws
+from .integration import gauss_hermite_normal, normal_expectation, biogeme_normal_expectation
+from .estimation import EstimationResults, maximize_loglikelihood
+from .mnl import MNLDesign, estimate_mnl
+from .nested import NestParameter, NestedLogitDesign, estimate_nested_logit
+from .mixed import RandomCoefficient, MixedLogitDesign, estimate_mixed_logit
+from .collapse import collapse_duplicates
+from .elasticities import (logit_elasticities, nested_logit_elasticities,
+                           mixed_logit_elasticities, aggregate_elasticities)
+from .calibration import Calibration, calibrate_constants
+from .scenarios import Modification, Scenario, AttributeTerm, attribute_term, scenario_shares
+from .posterior import COEFFICIENT_DISTRIBUTIONS, Posterior, individual_posteriors
+
+__all__ = ['logsumexp', 'logit_probabilities', 'nested_logit_probabilities',
+           'nests_from_biogeme', 'DRAW_TYPES', 'normal_draws', 'biogeme_draws',
+           'gauss_hermite_normal', 'normal_expectation', 'biogeme_normal_expectation',
+           'EstimationResults', 'maximize_loglikelihood', 'MNLDesign', 'estimate_mnl',
+           'NestParameter', 'NestedLogitDesign', 'estimate_nested_logit',
+           'RandomCoefficient', 'MixedLogitDesign', 'estimate_mixed_logit',
+           'collapse_duplicates', 'Modification', 'Scenario',
+           'AttributeTerm', 'attribute_term', 'scenario_shares', 'logit_elasticities',
+           'nested_logit_elasticities', 'mixed_logit_elasticities', 'aggregate_elasticities',
+           'Calibration', 'calibrate_constants', 'COEFFICIENT_DISTRIBUTIONS', 'Posterior',
+           'individual_posteriors']
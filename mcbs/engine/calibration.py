@@ -0,0 +1,199 @@
+"""Calibration of alternative specific constants to target market shares.
+
+The utilities without the calibrated constants are computed once, and the
+constants c solve the share equations log S_j(c) = log T_j of the
+alternatives that have one by Newton's method with the analytic Jacobian
+
+    logit:        dP_i/dc_k = P_i (1[i = k] - P_k)
+    nested logit: dP_i/dc_k = P_i (mu_m 1[i = k] + (1 - mu_m) P(k|m) 1[k in m] - P_k)
+
+where m is the nest of i. Mixed logit shares and Jacobians are averaged
+over a fixed set of draws of the utilities. The shares and Jacobian are
+sums over the observations, so they are accumulated over blocks of rows
+sized to a memory budget, and the shifted (kernel) utilities of a single
+block exist at a time. Each iteration is a few array operations, and
+convergence is quadratic, so a handful of iterations reach the 1e-10
+tolerance of the default settings.
+"""
+
+from collections import namedtuple
+from typing import Optional, Sequence, Tuple
+import numpy as np
+from .mixed import DEFAULT_MEMORY_BUDGET, kernel_utilities
+from .probabilities import Nest, logit_probabilities, nested_logit_log_components
+
+# Result of a calibration: the calibrated constants, the shares they
+# predict, the number of Newton iterations and whether the tolerance was met
+Calibration = namedtuple('Calibration', ['constants', 'shares', 'iterations', 'converged'])
+
+
+def _shares_and_jacobian(utilities: np.ndarray,
+                         availability: Optional[np.ndarray],
+                         nests: Optional[Sequence[Nest]],
+                         weights: np.ndarray,
+                         draw_weights: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calculate the market shares and their derivatives with respect to the constants.
+
+    Args:
+        utilities: N x J utilities, or N x R x J utilities of R draws
+        availability: Optional N x J array of 0/1 availabilities
+        nests: Optional list of (mu, column indices) tuples for nested logit
+        weights: Normalized weights of the N observations
+        draw_weights: Normalized weights of the R draws (None without draws)
+
+    Returns:
+        Tuple of (J shares, J x J derivatives of share i with respect to the
+        constant of alternative k)
+    """
+    n_alternatives = utilities.shape[-1]
+    if draw_weights is not None:
+        availability = None if availability is None else np.asarray(availability)[:, np.newaxis]
+        weights = np.outer(weights, draw_weights)
+    # Observations (and draws) flattened to rows
+    weights = weights.reshape(-1)
+    if nests is None:
+        probabilities = logit_probabilities(utilities, availability).reshape(-1, n_alternatives)
+        direct = probabilities
+        jacobian = np.zeros((n_alternatives, n_alternatives))
+    else:
+        components = nested_logit_log_components(utilities, nests, availability)
+        nest_of = components['nest_of']
+        with np.errstate(invalid='ignore'):
+            conditional = np.nan_to_num(np.exp(components['log_conditional']), nan=0.0)
+        probabilities = conditional * np.exp(components['log_nest'][..., nest_of])
+        conditional = conditional.reshape(-1, n_alternatives)
+        probabilities = probabilities.reshape(-1, n_alternatives)
+        mu = np.array([nest_mu for nest_mu, _ in components['nests']])[nest_of]
+        direct = mu * probabilities
+        # (1 - mu_m) P_i P(k|m) for the alternatives i and k of each nest m
+        jacobian = np.zeros((n_alternatives, n_alternatives))
+        for _, members in components['nests']:
+            jacobian[np.ix_(members, members)] += np.einsum(
+                'ni,nk,n->ik', (1 - mu[members]) * probabilities[:, members],
+                conditional[:, members], weights)
+
+    shares = weights @ probabilities
+    jacobian += np.diag(weights @ direct)
+    jacobian -= np.einsum('ni,nk,n->ik', probabilities, probabilities, weights)
+    return shares, jacobian
+
+
+def calibrate_constants(utilities: np.ndarray,
+                        target_shares: np.ndarray,
+                        columns: Sequence[int],
+                        constants: Optional[np.ndarray] = None,
+                        availability: Optional[np.ndarray] = None,
+                        nests: Optional[Sequence[Nest]] = None,
+                        weights: Optional[np.ndarray] = None,
+                        draw_weights: Optional[np.ndarray] = None,
+                        random_attributes: Optional[np.ndarray] = None,
+                        spreads: Optional[np.ndarray] = None,
+                        draws: Optional[np.ndarray] = None,
+                        tolerance: float = 1e-10,
+                        max_iter: int = 50,
+                        memory_budget: int = DEFAULT_MEMORY_BUDGET) -> Calibration:
+    """
+    Calibrate alternative specific constants to reproduce target market shares.
+
+    The constants of the given alternatives are added to the utilities, and
+    found by Newton's method on the log shares of these alternatives, with
+    step halving when a step does not reduce the share error. When every
+    alternative has a constant, the constants are only identified up to a
+    common shift, and the minimum-norm Newton steps are taken.
+
+    Mixed logit utilities are given either as N x R x J utilities of the
+    draws, or as N x J mean utilities with the random attributes, spreads
+    and draws, from which the kernel utilities are built block by block.
+
+    Args:
+        utilities: N x J utilities without the calibrated constants, or
+            N x R x J utilities of R fixed draws for mixed logit
+        target_shares: J target market shares
+        columns: Alternatives (column indices) whose constant is calibrated
+        constants: Starting values of the constants (zero by default)
+        availability: Optional N x J array of 0/1 availabilities
+        nests: Optional list of (mu, column indices) tuples for nested logit
+        weights: Optional number of observations each row stands for
+        draw_weights: Optional weights of the R draws (equal by default);
+            only used with draws
+        random_attributes: Optional L x N x J attributes multiplied by the
+            random coefficients of a mixed logit model
+        spreads: Standard deviations of the L random coefficients
+        draws: N x R x L standard normal draws of each observation
+        tolerance: Largest absolute share error at convergence
+        max_iter: Maximum number of Newton iterations
+        memory_budget: Approximate peak memory of the arrays of a block of
+            observations, in bytes
+
+    Returns:
+        Calibration with the calibrated constants, in the order of columns
+    """
+    utilities = np.asarray(utilities, dtype=float)
+    target_shares = np.asarray(target_shares, dtype=float)
+    columns = np.asarray(columns, dtype=np.intp)
+    if np.any(target_shares[columns] <= 0):
+        raise ValueError("Calibrated alternatives must have positive target shares")
+
+    n_obs, n_alternatives = utilities.shape[0], utilities.shape[-1]
+    weights = np.ones(n_obs) if weights is None else np.asarray(weights, dtype=float)
+    weights = weights / weights.sum()
+    availability = None if availability is None else np.asarray(availability)
+    if random_attributes is not None:
+        random_attributes = np.asarray(random_attributes, dtype=float)
+        spreads = np.asarray(spreads, dtype=float)
+        draws = np.asarray(draws, dtype=float)
+        n_draws = draws.shape[1]
+    else:
+        n_draws = utilities.shape[1] if utilities.ndim == 3 else 1
+    if random_attributes is not None or utilities.ndim == 3:
+        draw_weights = (np.full(n_draws, 1.0 / n_draws) if draw_weights is None
+                        else np.asarray(draw_weights, dtype=float) / np.sum(draw_weights))
+    else:
+        draw_weights = None
+    # Shifted utilities, probabilities and their temporaries of a block stay within the budget
+    bytes_per_row = 8 * n_draws * n_alternatives * 6
+    block = max(1, memory_budget // bytes_per_row)
+
+    constants = np.zeros(len(columns)) if constants is None else np.array(constants, dtype=float)
+    log_target = np.log(target_shares[columns])
+
+    def evaluate(values):
+        shift = np.zeros(n_alternatives)
+        shift[columns] = values
+        shares = np.zeros(n_alternatives)
+        jacobian = np.zeros((n_alternatives, n_alternatives))
+        for first in range(0, n_obs, block):
+            rows = slice(first, first + block)
+            if random_attributes is None:
+                shifted = utilities[rows] + shift
+            else:
+                shifted = kernel_utilities(utilities[rows], random_attributes[:, rows], spreads, draws[rows])
+                shifted += shift
+            block_shares, block_jacobian = _shares_and_jacobian(
+                shifted, None if availability is None else availability[rows], nests,
+                weights[rows], draw_weights)
+            shares += block_shares
+            jacobian += block_jacobian
+        return shares, jacobian
+
+    shares, jacobian = evaluate(constants)
+    error = np.abs(shares - target_shares).max()
+    for iteration in range(max_iter):
+        if error < tolerance:
+            return Calibration(constants, shares, iteration, True)
+        residual = np.log(shares[columns]) - log_target
+        # d log S_i / d c_k
+        log_jacobian = jacobian[np.ix_(columns, columns)] / shares[columns, np.newaxis]
+        step = np.linalg.lstsq(log_jacobian, -residual, rcond=None)[0]
+
+        for _ in range(30):
+            candidate = constants + step
+            new_shares, new_jacobian = evaluate(candidate)
+            new_error = np.abs(new_shares - target_shares).max()
+            if new_error < error or new_error < tolerance:
+                break
+            step /= 2
+        constants, shares, jacobian, error = candidate, new_shares, new_jacobian, new_error
+
+    return Calibration(constants, shares, max_iter, error < tolerance)
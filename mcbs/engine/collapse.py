@@ -0,0 +1,51 @@
+"""Collapse of duplicate observations into weighted unique rows.
+
+Survey rows that are identical on every column the model uses contribute
+identical terms to the log likelihood of closed-form models (MNL, nested
+logit), so each group can be estimated once with a frequency weight.
+"""
+
+from typing import Sequence, Tuple
+import numpy as np
+import pandas as pd
+
+
+def collapse_duplicates(data: pd.DataFrame, columns: Sequence[str]) -> Tuple[pd.DataFrame, np.ndarray]:
+    """
+    Collapse the rows that are identical on the given columns.
+
+    Rows are grouped by a hash of the columns, and the groups are checked
+    against their first row so that a hash collision can never merge
+    different rows.
+
+    Args:
+        data: Data to collapse
+        columns: Columns on which rows must be identical
+
+    Returns:
+        Tuple of (first row of each group, in order of first appearance,
+        with a fresh index; number of rows in each group)
+    """
+    columns = list(dict.fromkeys(columns))
+    keys = pd.util.hash_pandas_object(data[columns], index=False).to_numpy()
+    first, inverse, counts = _groups(keys)
+
+    values = data[columns].to_numpy()
+    representatives = values[first[inverse]]
+    same = (values == representatives) | (pd.isna(values) & pd.isna(representatives))
+    if not same.all():
+        # Hash collision: group on the values themselves
+        keys = data.groupby(columns, sort=False, dropna=False).ngroup().to_numpy()
+        first, inverse, counts = _groups(keys)
+
+    return data.iloc[first].reset_index(drop=True), counts
+
+
+def _groups(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Get the first row, group number and size of each group of equal keys, in order of appearance."""
+    _, first, inverse, counts = np.unique(keys, return_index=True, return_inverse=True,
+                                          return_counts=True)
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return first[order], rank[inverse], counts[order]
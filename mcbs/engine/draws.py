@@ -0,0 +1,181 @@
+"""Quasi-random draws for simulated (mixed logit) likelihoods.
+
+Quasi-random sequences cover the unit interval more evenly than pseudo-random
+numbers, so the simulated log likelihood reaches a given precision with far
+fewer draws per observation. The generators return sample_size x
+number_of_draws arrays of standard normal draws and can be registered with a
+Biogeme database, or used directly by the NumPy engines.
+"""
+
+from functools import partial
+from typing import Callable, Dict, Optional, Tuple
+import warnings
+import numpy as np
+from scipy.stats import norm, qmc
+
+# Friendly names for the draw types accepted by the mixed logit models, and
+# the Biogeme draw type each one maps to. Other Biogeme draw names (e.g.
+# 'NORMAL_ANTI') can be used as they are.
+DRAW_TYPES = {
+    'pseudo': 'NORMAL',
+    'halton': 'MCBS_NORMAL_HALTON',
+    'sobol': 'MCBS_NORMAL_SOBOL',
+    'mlhs': 'MCBS_NORMAL_MLHS',
+}
+
+# Keep the inverse normal finite at the ends of the unit interval
+_EPSILON = 1e-12
+
+
+def _to_normal(uniform: np.ndarray) -> np.ndarray:
+    """Transform U(0, 1) draws to N(0, 1) draws."""
+    return norm.ppf(np.clip(uniform, _EPSILON, 1 - _EPSILON))
+
+
+def scrambled_halton_normal_draws(sample_size: int, number_of_draws: int,
+                                  seed: Optional[int] = None) -> np.ndarray:
+    """
+    Generate normal draws from a scrambled Halton sequence.
+
+    Consecutive blocks of one long sequence are given to successive
+    observations, so the draws of each observation are spread over the
+    whole interval and different observations get different points.
+
+    Args:
+        sample_size: Number of observations
+        number_of_draws: Number of draws per observation
+        seed: Seed of the scrambling
+
+    Returns:
+        np.ndarray: sample_size x number_of_draws array of N(0, 1) draws
+    """
+    sampler = qmc.Halton(d=1, scramble=True, seed=seed)
+    uniform = sampler.random(sample_size * number_of_draws)
+    return _to_normal(uniform.reshape(sample_size, number_of_draws))
+
+
+def sobol_normal_draws(sample_size: int, number_of_draws: int,
+                       seed: Optional[int] = None) -> np.ndarray:
+    """
+    Generate normal draws from a randomized Sobol sequence.
+
+    Every observation uses the same scrambled Sobol points with its own
+    random shift modulo one, which keeps the low discrepancy of the points
+    within each observation. Sobol points are best balanced when
+    number_of_draws is a power of two.
+
+    Args:
+        sample_size: Number of observations
+        number_of_draws: Number of draws per observation
+        seed: Seed of the scrambling and shifts
+
+    Returns:
+        np.ndarray: sample_size x number_of_draws array of N(0, 1) draws
+    """
+    rng = np.random.default_rng(seed)
+    sampler = qmc.Sobol(d=1, scramble=True, seed=rng)
+    with warnings.catch_warnings():
+        # Balance warning for draw counts that are not powers of two
+        warnings.simplefilter('ignore', UserWarning)
+        points = sampler.random(number_of_draws)[:, 0]
+    shifts = rng.random((sample_size, 1))
+    return _to_normal((points[np.newaxis, :] + shifts) % 1.0)
+
+
+def mlhs_normal_draws(sample_size: int, number_of_draws: int,
+                      seed: Optional[int] = None) -> np.ndarray:
+    """
+    Generate normal draws by modified Latin hypercube sampling (MLHS).
+
+    Each observation gets the equally spaced points r / R, r = 0..R-1,
+    shifted by one random U(0, 1/R) offset and shuffled.
+
+    Args:
+        sample_size: Number of observations
+        number_of_draws: Number of draws per observation
+        seed: Seed of the shifts and shuffles
+
+    Returns:
+        np.ndarray: sample_size x number_of_draws array of N(0, 1) draws
+    """
+    rng = np.random.default_rng(seed)
+    grid = np.arange(number_of_draws) / number_of_draws
+    shifts = rng.random((sample_size, 1)) / number_of_draws
+    uniform = rng.permuted(grid[np.newaxis, :] + shifts, axis=1)
+    return _to_normal(uniform)
+
+
+def pseudo_normal_draws(sample_size: int, number_of_draws: int,
+                        seed: Optional[int] = None) -> np.ndarray:
+    """Generate pseudo-random N(0, 1) draws (sample_size x number_of_draws)."""
+    return np.random.default_rng(seed).standard_normal((sample_size, number_of_draws))
+
+
+# Generators used outside Biogeme, by friendly name
+GENERATORS: Dict[str, Callable[..., np.ndarray]] = {
+    'pseudo': pseudo_normal_draws,
+    'halton': scrambled_halton_normal_draws,
+    'sobol': sobol_normal_draws,
+    'mlhs': mlhs_normal_draws,
+}
+
+
+def normal_draws(draw_type: str, sample_size: int, number_of_draws: int,
+                 seed: Optional[int] = None) -> np.ndarray:
+    """
+    Generate standard normal draws of the given type.
+
+    Args:
+        draw_type: One of 'pseudo', 'halton', 'sobol' or 'mlhs'
+        sample_size: Number of observations
+        number_of_draws: Number of draws per observation
+        seed: Random seed
+
+    Returns:
+        np.ndarray: sample_size x number_of_draws array of N(0, 1) draws
+    """
+    if draw_type not in GENERATORS:
+        raise ValueError(f"Unknown draw type '{draw_type}'. Available: {', '.join(GENERATORS)}")
+    return GENERATORS[draw_type](sample_size, number_of_draws, seed=seed)
+
+
+def biogeme_generators(seed: Optional[int] = None) -> Dict[str, Tuple[Callable, str]]:
+    """
+    Get the quasi-random draw generators to register with a Biogeme database.
+
+    Args:
+        seed: Random seed passed to the generators
+
+    Returns:
+        Dict suitable for Database.set_random_number_generators
+    """
+    return {
+        'MCBS_NORMAL_HALTON': (partial(scrambled_halton_normal_draws, seed=seed),
+                               'Normal draws from a scrambled Halton sequence'),
+        'MCBS_NORMAL_SOBOL': (partial(sobol_normal_draws, seed=seed),
+                              'Normal draws from a randomized Sobol sequence'),
+        'MCBS_NORMAL_MLHS': (partial(mlhs_normal_draws, seed=seed),
+                             'Normal draws from modified Latin hypercube sampling'),
+    }
+
+
+def biogeme_draws(database, name: str, draw_type: str = 'pseudo', seed: Optional[int] = None):
+    """
+    Create a Biogeme bioDraws expression of the requested type.
+
+    The quasi-random generators are registered with the database first.
+
+    Args:
+        database: Biogeme database of the model
+        name: Name of the random variable
+        draw_type: Friendly name ('pseudo', 'halton', 'sobol', 'mlhs') or a
+            Biogeme draw type
+        seed: Random seed of the registered generators
+
+    Returns:
+        bioDraws expression
+    """
+    from biogeme.expressions import bioDraws
+
+    database.set_random_number_generators(biogeme_generators(seed))
+    return bioDraws(name, DRAW_TYPES.get(draw_type, draw_type))
@@ -0,0 +1,175 @@
+"""Analytic elasticities of logit, nested logit and mixed logit probabilities.
+
+The point elasticity of P_ni with respect to an attribute x_nk is
+E_nik = dP_ni/dx_nk * x_nk / P_ni = x_nk * d log P_ni / dx_nk, with
+
+    MNL:    d log P_i = g_i - sum_j P_j g_j
+    NL:     d log P_i = mu_m g_i + (1 - mu_m) sum_{j in m} P(j|m) g_j - sum_j P_j g_j
+    Mixed:  dP_i = sum_r w_r L_ir (g_ir - sum_j L_jr g_jr)
+
+where g_j = dV_j/dx_k is the derivative of the utilities with respect to
+the attribute (non-zero for the alternative it belongs to, for direct and
+cross elasticities alike) and m is the nest of i, in the normalization of
+nested_logit_log_components. All functions work on K attributes at once,
+so a full J x J table is one pass over the observations.
+"""
+
+from typing import Optional, Sequence, Tuple
+import numpy as np
+from .mixed import DEFAULT_MEMORY_BUDGET
+from .probabilities import Nest, logit_probabilities, nested_logit_log_components
+
+
+def logit_elasticities(probabilities: np.ndarray,
+                       gradients: np.ndarray,
+                       values: np.ndarray) -> np.ndarray:
+    """
+    Calculate disaggregate multinomial logit elasticities.
+
+    Args:
+        probabilities: N x J choice probabilities
+        gradients: N x J x K derivatives of the utilities with respect to the attributes
+        values: N x K values of the attributes
+
+    Returns:
+        np.ndarray: N x J x K elasticities of the probabilities (NaN for
+        unavailable alternatives)
+    """
+    mean = np.einsum('nj,njk->nk', probabilities, gradients)
+    elasticities = (gradients - mean[:, np.newaxis]) * values[:, np.newaxis]
+    elasticities[probabilities <= 0] = np.nan
+    return elasticities
+
+
+def nested_logit_elasticities(utilities: np.ndarray,
+                              nests: Sequence[Nest],
+                              gradients: np.ndarray,
+                              values: np.ndarray,
+                              availability: Optional[np.ndarray] = None
+                              ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calculate disaggregate nested logit elasticities.
+
+    Args:
+        utilities: N x J utilities
+        nests: List of (mu, column indices) tuples; alternatives that are not
+            listed form their own degenerate nest
+        gradients: N x J x K derivatives of the utilities with respect to the attributes
+        values: N x K values of the attributes
+        availability: Optional N x J array of 0/1 availabilities
+
+    Returns:
+        Tuple of (N x J choice probabilities, N x J x K elasticities, NaN
+        for unavailable alternatives)
+    """
+    components = nested_logit_log_components(utilities, nests, availability)
+    nest_of = components['nest_of']
+    with np.errstate(invalid='ignore'):
+        conditional = np.nan_to_num(np.exp(components['log_conditional']), nan=0.0)
+    probabilities = conditional * np.exp(components['log_nest'][:, nest_of])
+    mu = np.array([nest_mu for nest_mu, _ in components['nests']])[nest_of]
+
+    # Mean derivative within the nest of each alternative
+    within = np.empty_like(gradients)
+    for _, members in components['nests']:
+        mean = np.einsum('nj,njk->nk', conditional[:, members], gradients[:, members])
+        within[:, members] = mean[:, np.newaxis]
+    mean = np.einsum('nj,njk->nk', probabilities, gradients)
+
+    derivatives = (mu[:, np.newaxis] * gradients + (1 - mu)[:, np.newaxis] * within -
+                   mean[:, np.newaxis])
+    elasticities = derivatives * values[:, np.newaxis]
+    elasticities[probabilities <= 0] = np.nan
+    return probabilities, elasticities
+
+
+def mixed_logit_elasticities(utilities: np.ndarray,
+                             gradients: np.ndarray,
+                             values: np.ndarray,
+                             random_attributes: np.ndarray,
+                             random_gradients: np.ndarray,
+                             spreads: np.ndarray,
+                             draws: np.ndarray,
+                             draw_weights: Optional[np.ndarray] = None,
+                             availability: Optional[np.ndarray] = None,
+                             memory_budget: int = DEFAULT_MEMORY_BUDGET
+                             ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calculate disaggregate mixed logit elasticities by simulation.
+
+    The logit kernel and its derivatives are averaged over the draws,
+    in blocks of observations sized to the memory budget.
+
+    Args:
+        utilities: N x J utilities at the mean coefficients
+        gradients: N x J x K derivatives of the utilities with respect to the
+            attributes, at the mean coefficients
+        values: N x K values of the attributes
+        random_attributes: L x N x J attributes multiplied by the random coefficients
+        random_gradients: L x N x J x K derivatives of the random attributes
+            with respect to the attributes
+        spreads: Standard deviations of the L random coefficients
+        draws: N x R x L standard normal draws of each observation
+        draw_weights: Optional weights of the R draws (equal by default)
+        availability: Optional N x J array of 0/1 availabilities
+        memory_budget: Approximate peak memory of the simulation arrays, in bytes
+
+    Returns:
+        Tuple of (N x J simulated choice probabilities, N x J x K
+        elasticities, NaN for unavailable alternatives)
+    """
+    n_obs, n_alternatives, n_attributes = gradients.shape
+    n_draws = draws.shape[1]
+    draw_weights = (np.full(n_draws, 1.0 / n_draws) if draw_weights is None
+                    else np.asarray(draw_weights, dtype=float) / np.sum(draw_weights))
+    available = (np.ones((n_obs, n_alternatives), dtype=bool) if availability is None
+                 else np.asarray(availability) != 0)
+
+    probabilities = np.empty((n_obs, n_alternatives))
+    derivatives = np.empty((n_obs, n_alternatives, n_attributes))
+
+    # Kernel, draw gradients and their products of a block stay within the budget
+    bytes_per_row = 8 * n_draws * n_alternatives * (3 + 2 * n_attributes)
+    block = max(1, memory_budget // bytes_per_row)
+    for start in range(0, n_obs, block):
+        rows = slice(start, min(start + block, n_obs))
+        # Coefficient deviations of each draw: rows x R x L
+        deviations = draws[rows] * spreads
+        kernel_utilities = (utilities[rows, np.newaxis] +
+                            np.einsum('nrl,lnj->nrj', deviations, random_attributes[:, rows]))
+        kernel = logit_probabilities(kernel_utilities, available[rows, np.newaxis])
+        draw_gradients = (gradients[rows, np.newaxis] +
+                          np.einsum('nrl,lnjk->nrjk', deviations, random_gradients[:, rows]))
+        mean = np.einsum('nrj,nrjk->nrk', kernel, draw_gradients)
+        weighted = kernel * draw_weights[:, np.newaxis]
+        probabilities[rows] = weighted.sum(axis=1)
+        derivatives[rows] = np.einsum('nrj,nrjk->njk', weighted, draw_gradients - mean[:, :, np.newaxis])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        elasticities = derivatives * values[:, np.newaxis] / probabilities[..., np.newaxis]
+    elasticities[probabilities <= 0] = np.nan
+    return probabilities, elasticities
+
+
+def aggregate_elasticities(probabilities: np.ndarray,
+                           elasticities: np.ndarray,
+                           weights: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Aggregate disaggregate elasticities, weighted by the choice probabilities.
+
+    The aggregate elasticity of the predicted share of alternative i is
+    sum_n w_n P_ni E_nik / sum_n w_n P_ni.
+
+    Args:
+        probabilities: N x J choice probabilities
+        elasticities: N x J x K disaggregate elasticities
+        weights: Optional number of observations each row stands for
+
+    Returns:
+        np.ndarray: J x K aggregate elasticities
+    """
+    weights = np.ones(len(probabilities)) if weights is None else np.asarray(weights, dtype=float)
+    weighted = probabilities * weights[:, np.newaxis]
+    total = np.einsum('nj,njk->jk', weighted, np.nan_to_num(elasticities, nan=0.0))
+    with np.errstate(invalid='ignore'):
+        return total / weighted.sum(axis=0)[:, np.newaxis]
@@ -0,0 +1,285 @@
+"""Maximum likelihood estimation and Biogeme-compatible results for the NumPy engines.
+
+The native estimators maximize a log likelihood with an analytic gradient
+(and Hessian where available) using SciPy, and report the estimates through
+EstimationResults, which answers the calls the models and utilities make on
+Biogeme results (get_beta_values, getGeneralStatistics, data.betaValues,
+...), so the rest of the package does not need to know which backend ran.
+"""
+
+from collections import namedtuple
+from typing import Callable, Dict, Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd
+from scipy import optimize
+from scipy.stats import norm
+
+# Same layout as Biogeme's general statistics: value and display format
+GeneralStatistic = namedtuple('GeneralStatistic', ['value', 'format'])
+
+# Returns the log likelihood, its gradient and its Hessian (or None)
+LogLikelihood = Callable[[np.ndarray], Tuple[float, np.ndarray, Optional[np.ndarray]]]
+
+# SciPy methods that use the Hessian
+SECOND_ORDER_METHODS = ('trust-exact', 'trust-ncg', 'trust-krylov', 'Newton-CG', 'trust-constr')
+
+
+def maximize_loglikelihood(loglikelihood: LogLikelihood,
+                           beta0: np.ndarray,
+                           method: str = 'trust-exact',
+                           bounds: Optional[Sequence[Tuple[Optional[float], Optional[float]]]] = None,
+                           tolerance: float = 1e-8,
+                           max_iterations: int = 1000,
+                           preconditioner: Optional[np.ndarray] = None) -> optimize.OptimizeResult:
+    """
+    Maximize a log likelihood with SciPy.
+
+    Args:
+        loglikelihood: Function of the parameters returning the log likelihood,
+            its gradient and its Hessian (the Hessian is only needed by the
+            second-order methods)
+        beta0: Starting values
+        method: SciPy method, e.g. 'trust-exact' (uses the Hessian), 'BFGS' or
+            'L-BFGS-B' (required when there are bounds)
+        bounds: Optional (lower, upper) bounds for each parameter
+        tolerance: Gradient tolerance
+        max_iterations: Maximum number of iterations
+        preconditioner: Optional K x K matrix T; the optimizer works on z with
+            beta = beta0 + T z. With T close to the inverse Cholesky factor
+            of minus the Hessian, quasi-Newton methods converge in a few
+            iterations even when the parameters have very different scales.
+            Bounded parameters must only depend on their own z.
+
+    Returns:
+        scipy.optimize.OptimizeResult of the minimization of minus the log
+        likelihood, with x in the original parameters
+    """
+    beta0 = np.asarray(beta0, dtype=float)
+    T = np.eye(len(beta0)) if preconditioner is None else np.asarray(preconditioner, dtype=float)
+    cache = {}
+
+    def evaluate(z):
+        key = z.tobytes()
+        if key not in cache:
+            cache.clear()
+            ll, gradient, hessian = loglikelihood(beta0 + T @ z)
+            if hessian is not None:
+                hessian = T.T @ hessian @ T
+            cache[key] = (ll, T.T @ gradient, hessian)
+        return cache[key]
+
+    def fun(z):
+        ll, gradient, _ = evaluate(z)
+        return -ll, -gradient
+
+    def hess(z):
+        return -evaluate(z)[2]
+
+    extra = {'hess': hess} if method in SECOND_ORDER_METHODS else {}
+    if bounds is not None:
+        z_bounds = []
+        for k, (lower, upper) in enumerate(bounds):
+            if lower is None and upper is None:
+                z_bounds.append((None, None))
+                continue
+            if np.count_nonzero(T[k]) != 1 or T[k, k] <= 0:
+                raise ValueError("Bounded parameters must only be scaled by the preconditioner")
+            z_bounds.append(tuple(None if bound is None else (bound - beta0[k]) / T[k, k]
+                                  for bound in (lower, upper)))
+        extra['bounds'] = z_bounds
+    options = {'maxiter': max_iterations}
+    if method != 'Newton-CG':
+        options['gtol'] = tolerance
+    if method == 'L-BFGS-B':
+        # Stop on the gradient rather than on the relative decrease of large
+        # log likelihoods
+        options['ftol'] = 1e-14
+
+    solution = optimize.minimize(fun, np.zeros(len(beta0)), jac=True,
+                                 method=method, options=options, **extra)
+    solution.x = beta0 + T @ solution.x
+    return solution
+
+
+def numerical_hessian(gradient: Callable[[np.ndarray], np.ndarray],
+                      theta: np.ndarray,
+                      step: float = 1e-6) -> np.ndarray:
+    """
+    Calculate a Hessian by central differences of an analytic gradient.
+
+    Args:
+        gradient: Function of the parameters returning the gradient
+        theta: Point at which to calculate the Hessian
+        step: Relative finite difference step
+
+    Returns:
+        np.ndarray: Symmetric K x K Hessian
+    """
+    theta = np.asarray(theta, dtype=float)
+    hessian = np.empty((len(theta), len(theta)))
+    for k in range(len(theta)):
+        h = step * max(1.0, abs(theta[k]))
+        shift = np.zeros_like(theta)
+        shift[k] = h
+        hessian[:, k] = (gradient(theta + shift) - gradient(theta - shift)) / (2 * h)
+    return (hessian + hessian.T) / 2
+
+
+def frequency_weights(frequencies: Optional[np.ndarray], weights: Optional[np.ndarray],
+                      n_obs: int) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Combine row frequencies with observation weights.
+
+    A row standing for f identical observations enters the log likelihood
+    and its gradient with weight f, and the BHHH matrix with weight f
+    rather than f squared, which is what scores.T @ (scores / f) gives for
+    scores already multiplied by the combined weight.
+
+    Args:
+        frequencies: Optional number of observations each row stands for
+        weights: Optional observation weights
+        n_obs: Number of rows
+
+    Returns:
+        Tuple of (frequencies, weights to pass to the design)
+    """
+    if frequencies is None:
+        return np.ones(n_obs), weights
+    frequencies = np.asarray(frequencies, dtype=float)
+    return frequencies, frequencies if weights is None else frequencies * np.asarray(weights, dtype=float)
+
+
+class RawEstimationResults:
+    """Estimation outputs, named as in Biogeme's RawResults."""
+
+    def __init__(self, model_name: str, beta_names: Sequence[str], beta_values: np.ndarray,
+                 init_loglike: float, null_loglike: float, loglike: float,
+                 gradient: np.ndarray, hessian: np.ndarray, bhhh: np.ndarray,
+                 sample_size: int, number_of_observations: Optional[int] = None,
+                 optimization_messages: Optional[Dict[str, object]] = None,
+                 convergence: bool = True):
+        self.modelName = model_name
+        self.betaNames = list(beta_names)
+        self.betaValues = np.asarray(beta_values, dtype=float)
+        self.nparam = len(self.betaNames)
+        self.initLogLike = float(init_loglike)
+        self.nullLogLike = float(null_loglike)
+        self.logLike = float(loglike)
+        self.g = np.asarray(gradient, dtype=float)
+        self.H = np.asarray(hessian, dtype=float)
+        self.bhhh = np.asarray(bhhh, dtype=float)
+        self.sampleSize = int(sample_size)
+        self.numberOfObservations = int(sample_size if number_of_observations is None
+                                        else number_of_observations)
+        self.excludedData = 0
+        self.monte_carlo = False
+        self.numberOfDraws = 0
+        self.numberOfThreads = 1
+        self.gradientNorm = float(np.linalg.norm(self.g))
+        self.optimizationMessages = optimization_messages or {}
+        self.convergence = convergence
+
+        # Variance-covariance matrices: inverse of minus the Hessian, and the
+        # robust (sandwich) estimator
+        try:
+            self.varCovar = np.linalg.inv(-self.H)
+        except np.linalg.LinAlgError:
+            self.varCovar = np.linalg.pinv(-self.H)
+        self.robust_varCovar = self.varCovar @ self.bhhh @ self.varCovar
+
+        # Goodness of fit, with Biogeme's definitions
+        self.likelihoodRatioTestNull = -2.0 * (self.nullLogLike - self.logLike)
+        self.rhoSquareNull = 1.0 - self.logLike / self.nullLogLike
+        self.rhoBarSquareNull = 1.0 - (self.logLike - self.nparam) / self.nullLogLike
+        self.likelihoodRatioTest = -2.0 * (self.initLogLike - self.logLike)
+        self.rhoSquare = 1.0 - self.logLike / self.initLogLike
+        self.rhoBarSquare = 1.0 - (self.logLike - self.nparam) / self.initLogLike
+        self.akaike = 2.0 * self.nparam - 2.0 * self.logLike
+        self.bayesian = -2.0 * self.logLike + self.nparam * np.log(self.sampleSize)
+
+
+class EstimationResults:
+    """
+    Results of a native estimation, with the interface of Biogeme's bioResults.
+
+    Args:
+        raw_results: RawEstimationResults of the estimation
+    """
+
+    def __init__(self, raw_results: RawEstimationResults):
+        self.data = raw_results
+
+    def get_beta_values(self, my_betas: Optional[Sequence[str]] = None) -> Dict[str, float]:
+        """
+        Get the estimated parameter values.
+
+        Args:
+            my_betas: Optional names of the parameters to return (all by default)
+
+        Returns:
+            Dict mapping parameter names to values
+        """
+        values = dict(zip(self.data.betaNames, self.data.betaValues))
+        if my_betas is None:
+            return values
+        missing = [name for name in my_betas if name not in values]
+        if missing:
+            raise ValueError(f"Unknown parameters: {missing}")
+        return {name: values[name] for name in my_betas}
+
+    getBetaValues = get_beta_values
+
+    def get_general_statistics(self) -> Dict[str, GeneralStatistic]:
+        """
+        Get the general statistics of the estimation, as reported by Biogeme.
+
+        Returns:
+            Dict mapping statistic names to (value, format) tuples
+        """
+        d = self.data
+        return {
+            'Number of estimated parameters': GeneralStatistic(d.nparam, ''),
+            'Sample size': GeneralStatistic(d.sampleSize, ''),
+            'Excluded observations': GeneralStatistic(d.excludedData, ''),
+            'Null log likelihood': GeneralStatistic(d.nullLogLike, '.7g'),
+            'Init log likelihood': GeneralStatistic(d.initLogLike, '.7g'),
+            'Final log likelihood': GeneralStatistic(d.logLike, '.7g'),
+            'Likelihood ratio test for the null model': GeneralStatistic(d.likelihoodRatioTestNull, '.7g'),
+            'Rho-square for the null model': GeneralStatistic(d.rhoSquareNull, '.3g'),
+            'Rho-square-bar for the null model': GeneralStatistic(d.rhoBarSquareNull, '.3g'),
+            'Likelihood ratio test for the init. model': GeneralStatistic(d.likelihoodRatioTest, '.7g'),
+            'Rho-square for the init. model': GeneralStatistic(d.rhoSquare, '.3g'),
+            'Rho-square-bar for the init. model': GeneralStatistic(d.rhoBarSquare, '.3g'),
+            'Akaike Information Criterion': GeneralStatistic(d.akaike, '.7g'),
+            'Bayesian Information Criterion': GeneralStatistic(d.bayesian, '.7g'),
+            'Final gradient norm': GeneralStatistic(d.gradientNorm, '.4E'),
+            'Nbr of threads': GeneralStatistic(d.numberOfThreads, ''),
+        }
+
+    getGeneralStatistics = get_general_statistics
+
+    def get_estimated_parameters(self) -> pd.DataFrame:
+        """
+        Get the estimates with robust standard errors, t-tests and p-values.
+
+        Returns:
+            DataFrame indexed by parameter name
+        """
+        values = self.data.betaValues
+        std_errors = np.sqrt(np.maximum(np.diag(self.data.robust_varCovar), 0.0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t_tests = values / std_errors
+        p_values = 2.0 * norm.sf(np.abs(t_tests))
+        return pd.DataFrame({
+            'Value': values,
+            'Rob. Std err': std_errors,
+            'Rob. t-test': t_tests,
+            'Rob. p-value': p_values,
+        }, index=self.data.betaNames)
+
+    getEstimatedParameters = get_estimated_parameters
+
+    def __str__(self) -> str:
+        return (f"Results for model {self.data.modelName}\n"
+                f"Final log likelihood: {self.data.logLike:.7g}\n"
+                f"{self.get_estimated_parameters()}")
@@ -0,0 +1,80 @@
+"""Gauss-Hermite quadrature for low-dimensional random coefficients.
+
+When a mixed logit model has a single normal random coefficient, integrating
+the conditional choice probability over a fixed set of Gauss-Hermite nodes
+is near exact with 10-20 nodes, whereas Monte Carlo integration needs
+hundreds of draws per observation for a comparable accuracy.
+"""
+
+from functools import lru_cache
+from typing import Callable, Tuple
+import numpy as np
+
+# Number of nodes used when none is given
+DEFAULT_NODES = 15
+
+
+@lru_cache(maxsize=None)
+def _hermite_e_rule(n_nodes: int) -> Tuple[Tuple[float, ...], Tuple[float, ...]]:
+    nodes, weights = np.polynomial.hermite_e.hermegauss(n_nodes)
+    weights = weights / weights.sum()
+    return tuple(nodes.tolist()), tuple(weights.tolist())
+
+
+def gauss_hermite_normal(n_nodes: int = DEFAULT_NODES) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Get the Gauss-Hermite rule for expectations over a standard normal.
+
+    E[f(X)] with X ~ N(0, 1) is approximated by sum(weights * f(nodes)).
+    The rule is exact for polynomials of degree up to 2 * n_nodes - 1.
+
+    Args:
+        n_nodes: Number of quadrature nodes
+
+    Returns:
+        Tuple of (nodes, weights) arrays of length n_nodes; the weights sum to one
+    """
+    if n_nodes < 1:
+        raise ValueError("n_nodes must be a positive integer")
+    nodes, weights = _hermite_e_rule(int(n_nodes))
+    return np.array(nodes), np.array(weights)
+
+
+def normal_expectation(kernel: Callable[[np.ndarray], np.ndarray],
+                       n_nodes: int = DEFAULT_NODES) -> np.ndarray:
+    """
+    Integrate a NumPy kernel over a standard normal variable.
+
+    Args:
+        kernel: Function of a node value returning an array (e.g. the
+            conditional choice probabilities of every observation)
+        n_nodes: Number of quadrature nodes
+
+    Returns:
+        np.ndarray: Weighted sum of the kernel over the nodes
+    """
+    nodes, weights = gauss_hermite_normal(n_nodes)
+    return sum(weight * kernel(node) for node, weight in zip(nodes, weights))
+
+
+def biogeme_normal_expectation(kernel: Callable, n_nodes: int = DEFAULT_NODES):
+    """
+    Build the Biogeme expression integrating a kernel over a standard normal.
+
+    This replaces MonteCarlo(kernel(bioDraws(name, 'NORMAL'))) for a single
+    normal random variable.
+
+    Args:
+        kernel: Function of a Biogeme expression standing for the N(0, 1)
+            variable, returning the conditional probability expression
+        n_nodes: Number of quadrature nodes
+
+    Returns:
+        bioMultSum expression of the weighted kernel values
+    """
+    from biogeme.expressions import Numeric, bioMultSum
+
+    nodes, weights = gauss_hermite_normal(n_nodes)
+    terms = [Numeric(float(weight)) * kernel(Numeric(float(node)))
+             for node, weight in zip(nodes, weights)]
+    return terms[0] if len(terms) == 1 else bioMultSum(terms)
@@ -0,0 +1,359 @@
+"""Native mixed logit estimation by simulated maximum likelihood.
+
+Some utility parameters are normally distributed across observations,
+beta_k + sigma_l xi_l with xi_l ~ N(0, 1), and the choice probability is the
+average of the logit kernel over a fixed matrix of draws:
+
+    log P_n = log(sum_r w_r L_nr),    L_nr = logit probability of the choice
+
+With panel data the draws are per individual and the kernel is the product
+of the logit probabilities of all the individual's choices.
+
+The N x R x J kernel is evaluated in blocks of whole individuals sized to a
+memory budget, so that the peak memory does not grow with the sample size,
+and the log likelihood and its analytic gradient are accumulated block by
+block. The Hessian used for the standard errors is obtained from the
+gradient by finite differences.
+"""
+
+from collections import namedtuple
+from typing import Optional, Sequence, Tuple
+import numpy as np
+from .draws import normal_draws
+from .estimation import (EstimationResults, RawEstimationResults, maximize_loglikelihood,
+                         numerical_hessian)
+from .mnl import MNLDesign
+
+# Normally distributed coefficient: the name of the utility parameter holding
+# its mean, the name of its standard deviation and the starting value of the
+# standard deviation
+RandomCoefficient = namedtuple('RandomCoefficient', ['mean', 'spread', 'init'])
+
+# Peak memory of the simulation arrays used when no budget is given (bytes)
+DEFAULT_MEMORY_BUDGET = 256 * 2**20
+
+
+
+def kernel_utilities(utilities: np.ndarray,
+                     random_attributes: np.ndarray,
+                     spreads: np.ndarray,
+                     draws: np.ndarray) -> np.ndarray:
+    """
+    Calculate the utilities of the logit kernel at each draw.
+
+    Args:
+        utilities: ... x N x J utilities at the mean coefficients
+        random_attributes: L x ... x N x J attributes multiplied by the random coefficients
+        spreads: Standard deviations of the L random coefficients
+        draws: N x R x L standard normal draws of each observation
+
+    Returns:
+        np.ndarray: ... x N x R x J utilities
+    """
+    return (np.asarray(utilities, dtype=float)[..., np.newaxis, :] +
+            np.einsum('nrl,l...nj->...nrj', draws * spreads, random_attributes))
+
+class MixedLogitDesign(MNLDesign):
+    """
+    Attributes and draws of a mixed logit model with normal coefficients.
+
+    With panel data, the draws are shared by all the observations of an
+    individual and the kernel is the product of the logit probabilities of
+    the individual's choices. The observations are sorted by individual and
+    indexed CSR-style: rows offsets[p]:offsets[p + 1] belong to individual p.
+
+    Args:
+        X: N x J x K attributes
+        choices: Column index (0..J-1) of the chosen alternative of each observation
+        random_columns: Column of X of each of the L random coefficients
+        draws: P x R x L standard normal draws, one row per individual (per
+            observation without panel, in increasing panel id order with
+            it), reused at every evaluation
+        availability: Optional N x J array of 0/1 availabilities
+        offset: Optional N x J utility terms that do not depend on beta
+        weights: Optional observation weights; with panel data, the weight
+            of an individual is the weight of their first observation
+        draw_weights: Optional weights of the R draws, e.g. quadrature
+            weights (equal weights by default)
+        memory_budget: Approximate peak memory of the simulation arrays, in bytes
+        panel: Optional N array identifying the individual of each observation
+    """
+
+    def __init__(self, X: np.ndarray, choices: np.ndarray,
+                 random_columns: Sequence[int], draws: np.ndarray,
+                 availability: Optional[np.ndarray] = None,
+                 offset: Optional[np.ndarray] = None,
+                 weights: Optional[np.ndarray] = None,
+                 draw_weights: Optional[np.ndarray] = None,
+                 memory_budget: int = DEFAULT_MEMORY_BUDGET,
+                 panel: Optional[np.ndarray] = None):
+        X = np.asarray(X, dtype=float)
+        self.is_panel = panel is not None
+        if self.is_panel:
+            # Make the observations of each individual consecutive
+            panel = np.asarray(panel)
+            self.order = np.argsort(panel, kind='stable')
+            X = X[self.order]
+            choices = np.asarray(choices)[self.order]
+            availability, offset, weights = (None if a is None else np.asarray(a)[self.order]
+                                             for a in (availability, offset, weights))
+            ids = panel[self.order]
+            starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+        else:
+            self.order = None
+            starts = np.arange(len(X))
+        super().__init__(X, choices, availability, offset, weights)
+
+        self.offsets = np.append(starts, self.n_obs)
+        self.counts = np.diff(self.offsets)
+        self.n_individuals = len(starts)
+        self.individual_weights = self.weights[starts]
+
+        self.random_columns = np.asarray(random_columns, dtype=np.intp)
+        self.n_random = len(self.random_columns)
+
+        draws = np.asarray(draws, dtype=float)
+        if draws.ndim == 2:
+            draws = draws[..., np.newaxis]
+        if draws.shape[0] != self.n_individuals or draws.shape[2] != self.n_random:
+            raise ValueError(f"draws must have shape ({self.n_individuals}, R, {self.n_random}), "
+                             f"not {draws.shape}")
+        self.n_draws = draws.shape[1]
+        # L x P x R, so that each block of individuals is a contiguous slice
+        self.draws = np.moveaxis(draws, 2, 0)
+        if draw_weights is None:
+            self.draw_weights = np.full(self.n_draws, 1.0 / self.n_draws)
+        else:
+            draw_weights = np.asarray(draw_weights, dtype=float)
+            self.draw_weights = draw_weights / draw_weights.sum()
+
+        # L x J x N attributes multiplied by the random coefficients
+        self.random_attributes = np.stack([
+            np.where(self.available, X[:, :, k].T, 0.0) for k in self.random_columns
+        ]) if self.n_random else np.zeros((0, self.n_alternatives, self.n_obs))
+
+        # Blocks of whole individuals whose J x rows x R arrays fit in the
+        # budget (two of them, plus the rows x R arrays)
+        bytes_per_row = 8 * self.n_draws * (2 * self.n_alternatives + 4 + self.n_random)
+        rows_per_chunk = max(1, memory_budget // bytes_per_row)
+        self.chunks = []
+        first = 0
+        while first < self.n_individuals:
+            last = np.searchsorted(self.offsets, self.offsets[first] + rows_per_chunk, side='right') - 1
+            last = max(int(last), first + 1)
+            self.chunks.append((slice(first, last), slice(self.offsets[first], self.offsets[last])))
+            first = last
+
+    def _simulate(self, rows: slice, utilities: np.ndarray, spreads: np.ndarray,
+                  draws: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Evaluate the logit kernel for a block of rows.
+
+        Args:
+            rows: Block of rows
+            utilities: J x N utilities at the mean coefficients
+            spreads: Standard deviations of the random coefficients
+            draws: L x C x R draws of the rows
+
+        Returns:
+            Tuple of (J x C x R kernel probabilities, C x R log kernel
+            probabilities of the chosen alternatives)
+        """
+        kernel = np.repeat(utilities[:, rows, np.newaxis], self.n_draws, axis=2)
+        for l in range(self.n_random):
+            kernel += (spreads[l] * self.random_attributes[l, :, rows])[..., np.newaxis] * draws[l]
+        kernel[~self.available[:, rows]] = -np.inf
+
+        block = np.arange(rows.stop - rows.start)
+        chosen = kernel[self.choices[rows], block]
+        vmax = kernel.max(axis=0)
+        kernel -= vmax
+        np.exp(kernel, out=kernel)
+        total = kernel.sum(axis=0)
+        kernel /= total
+        return kernel, chosen - vmax - np.log(total)
+
+    def loglikelihood(self, theta: np.ndarray, hessian: bool = False
+                      ) -> Tuple[float, np.ndarray, None, np.ndarray]:
+        """
+        Calculate the simulated log likelihood with its analytic gradient.
+
+        Args:
+            theta: Utility parameters followed by the standard deviations of
+                the random coefficients
+            hessian: Ignored; the simulated Hessian is not calculated
+
+        Returns:
+            Tuple of (log likelihood, gradient, None, P x (K + L) matrix of
+            weighted individual scores)
+        """
+        theta = np.asarray(theta, dtype=float)
+        utilities = self.utilities(theta[:self.n_parameters])
+        spreads = theta[self.n_parameters:]
+
+        loglike_p = np.empty(self.n_individuals)
+        # Kernel probabilities averaged with the posterior weights of the draws,
+        # plain and multiplied by each draw, and the posterior mean of each draw
+        mean_probabilities = np.empty((self.n_alternatives, self.n_obs))
+        draw_probabilities = np.empty((self.n_random, self.n_alternatives, self.n_obs))
+        mean_draws = np.empty((self.n_random, self.n_individuals))
+
+        for individuals, rows in self.chunks:
+            draws = self.draws[:, individuals]
+            if self.is_panel:
+                counts = self.counts[individuals]
+                row_draws = np.repeat(draws, counts, axis=1)
+            else:
+                row_draws = draws
+            probabilities, log_kernel = self._simulate(rows, utilities, spreads, row_draws)
+            if self.is_panel:
+                # Product of the kernels over the observations of each individual
+                log_kernel = np.add.reduceat(log_kernel, self.offsets[individuals] - rows.start, axis=0)
+
+            lmax = log_kernel.max(axis=1, keepdims=True)
+            posterior = np.exp(log_kernel - lmax) * self.draw_weights
+            simulated = posterior.sum(axis=1)
+            loglike_p[individuals] = np.log(simulated) + lmax[:, 0]
+            posterior /= simulated[:, np.newaxis]
+
+            probabilities *= np.repeat(posterior, counts, axis=0) if self.is_panel else posterior
+            mean_probabilities[:, rows] = probabilities.sum(axis=2)
+            for l in range(self.n_random):
+                draw_probabilities[l][:, rows] = np.einsum('jcr,cr->jc', probabilities, row_draws[l])
+                mean_draws[l, individuals] = np.einsum('pr,pr->p', posterior, draws[l])
+
+        # d log P / d beta = x_i - sum_r h_r sum_j P_rj x_j
+        beta_scores = self.chosen - self.expectation(mean_probabilities)
+        # d log P / d sigma_l = sum_r h_r xi_rl (x_il - sum_j P_rj x_jl)
+        if self.is_panel:
+            mean_draws = np.repeat(mean_draws, self.counts, axis=1)
+        spread_scores = np.array([
+            self.chosen[k] * mean_draws[l] - (draw_probabilities[l] * self.random_attributes[l]).sum(axis=0)
+            for l, k in enumerate(self.random_columns)
+        ]).reshape(self.n_random, self.n_obs)
+
+        scores = np.vstack([beta_scores, spread_scores])
+        if self.is_panel:
+            scores = np.add.reduceat(scores, self.offsets[:-1], axis=1)
+        scores *= self.individual_weights
+        return float(self.individual_weights @ loglike_p), scores.sum(axis=1), None, scores.T
+
+
+def estimate_mixed_logit(X: np.ndarray,
+                         choices: np.ndarray,
+                         random_coefficients: Sequence[RandomCoefficient],
+                         availability: Optional[np.ndarray] = None,
+                         names: Optional[Sequence[str]] = None,
+                         offset: Optional[np.ndarray] = None,
+                         weights: Optional[np.ndarray] = None,
+                         number_of_draws: int = 100,
+                         draw_type: str = 'pseudo',
+                         seed: Optional[int] = None,
+                         draws: Optional[np.ndarray] = None,
+                         draw_weights: Optional[np.ndarray] = None,
+                         memory_budget: int = DEFAULT_MEMORY_BUDGET,
+                         panel: Optional[np.ndarray] = None,
+                         beta0: Optional[np.ndarray] = None,
+                         model_name: str = 'mixed_logit',
+                         method: str = 'L-BFGS-B') -> EstimationResults:
+    """
+    Estimate a mixed logit model with normal coefficients by simulated maximum likelihood.
+
+    The simulated likelihood can have several local maxima. Unless starting
+    values are given, the optimization is run from where Biogeme starts
+    (zero utility parameters and the initial standard deviations) and from
+    the MNL estimates, and the best of the two solutions is kept.
+
+    Args:
+        X: N x J x K attributes
+        choices: Column index (0..J-1) of the chosen alternative of each observation
+        random_coefficients: RandomCoefficient of each normal coefficient
+        availability: Optional N x J array of 0/1 availabilities
+        names: Utility parameter names (defaults to beta_0..beta_K-1)
+        offset: Optional N x J utility terms that do not depend on beta
+        weights: Optional observation weights
+        number_of_draws: Number of draws per individual
+        draw_type: Type of draws: 'pseudo', 'halton', 'sobol' or 'mlhs'
+        seed: Random seed of the draws
+        draws: Optional P x R x L draws replacing the generated ones
+        draw_weights: Optional weights of the R draws
+        memory_budget: Approximate peak memory of the simulation arrays, in bytes
+        panel: Optional N array identifying the individual of each
+            observation, for a panel mixed logit model
+        beta0: Starting values of the utility parameters followed by the standard deviations
+        model_name: Name reported in the results
+        method: SciPy optimization method
+
+    Returns:
+        EstimationResults with the Biogeme results interface; the utility
+        parameters come first, followed by the (non-negative) standard
+        deviations. The sample size is the number of individuals.
+    """
+    X = np.asarray(X, dtype=float)
+    n_obs, _, n_params = X.shape
+    n_individuals = n_obs if panel is None else len(np.unique(panel))
+    names = list(names) if names is not None else [f'beta_{k}' for k in range(n_params)]
+    unknown = [rc.mean for rc in random_coefficients if rc.mean not in names]
+    if unknown:
+        raise ValueError(f"Unknown mean parameters: {unknown}")
+    random_columns = [names.index(rc.mean) for rc in random_coefficients]
+
+    if draws is None:
+        # One independent sequence per random coefficient
+        draws = np.stack([
+            normal_draws(draw_type, n_individuals, number_of_draws, None if seed is None else seed + l)
+            for l in range(len(random_coefficients))
+        ], axis=2)
+    design = MixedLogitDesign(X, choices, random_columns, draws, availability, offset,
+                              weights, draw_weights, memory_budget, panel)
+
+    spread_init = np.array([rc.init for rc in random_coefficients], dtype=float)
+    init = np.concatenate([np.zeros(n_params), spread_init])
+    if beta0 is None:
+        mnl = maximize_loglikelihood(lambda beta: MNLDesign.loglikelihood(design, beta)[:3],
+                                     np.zeros(n_params))
+        starts = [init, np.concatenate([mnl.x, spread_init])]
+    else:
+        starts = [np.asarray(beta0, dtype=float)]
+
+    solution = None
+    for start in starts:
+        # Precondition with the MNL Hessian for the utility parameters and the
+        # BHHH approximation for the standard deviations
+        hess_mnl = MNLDesign.loglikelihood(design, start[:n_params])[2]
+        scores = design.loglikelihood(start)[3]
+        preconditioner = np.zeros((len(start), len(start)))
+        preconditioner[:n_params, :n_params] = np.linalg.inv(np.linalg.cholesky(-hess_mnl)).T
+        spread_information = np.einsum('pl,pl->l', scores[:, n_params:], scores[:, n_params:])
+        preconditioner[n_params:, n_params:] = np.diag(1.0 / np.sqrt(np.maximum(spread_information, 1e-12)))
+
+        candidate = maximize_loglikelihood(lambda theta: design.loglikelihood(theta)[:3],
+                                           start, method=method, preconditioner=preconditioner)
+        if solution is None or candidate.fun < solution.fun:
+            solution = candidate
+
+    theta = solution.x
+    ll, gradient, _, scores = design.loglikelihood(theta)
+    hess = numerical_hessian(lambda t: design.loglikelihood(t)[1], theta)
+
+    # A standard deviation only enters as sigma * xi, so a negative one is
+    # reported as |sigma| with the signs of its derivatives flipped
+    signs = np.ones(len(theta))
+    signs[n_params:] = np.where(theta[n_params:] < 0, -1.0, 1.0)
+    theta, gradient, scores = signs * theta, signs * gradient, scores * signs
+    hess = hess * np.outer(signs, signs)
+
+    raw = RawEstimationResults(
+        model_name, names + [rc.spread for rc in random_coefficients], theta,
+        init_loglike=design.loglikelihood(init)[0],
+        null_loglike=design.null_loglikelihood(),
+        loglike=ll, gradient=gradient, hessian=hess,
+        bhhh=scores.T @ scores, sample_size=design.n_individuals,
+        number_of_observations=design.n_obs,
+        optimization_messages={'Algorithm': f'scipy {method}',
+                               'Number of iterations': solution.get('nit'),
+                               'Cause of termination': solution.message},
+        convergence=bool(solution.success))
+    raw.monte_carlo = True
+    raw.numberOfDraws = design.n_draws
+    return EstimationResults(raw)
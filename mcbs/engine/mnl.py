@@ -0,0 +1,215 @@
+"""Native multinomial logit estimation.
+
+The utilities are linear in the parameters, V = offset + X beta, with X a
+dense N x J x K attribute tensor. The log likelihood is globally concave and
+its gradient and Hessian have closed forms, so a trust-region Newton method
+converges in a handful of iterations.
+"""
+
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+from .estimation import (SECOND_ORDER_METHODS, EstimationResults, RawEstimationResults,
+                         frequency_weights, maximize_loglikelihood)
+
+
+class MNLDesign:
+    """
+    Attributes of a multinomial logit model, prepared for repeated evaluation.
+
+    Most parameters enter the utility of only some alternatives (alternative
+    specific constants and attributes), so the tensor is stored as one
+    K_j x N block per alternative with only the K_j parameters that appear in
+    its utility. This divides the work per iteration by the sparsity of X.
+
+    Args:
+        X: N x J x K attributes
+        choices: Column index (0..J-1) of the chosen alternative of each observation
+        availability: Optional N x J array of 0/1 availabilities
+        offset: Optional N x J utility terms that do not depend on beta
+        weights: Optional observation weights
+    """
+
+    def __init__(self, X: np.ndarray, choices: np.ndarray,
+                 availability: Optional[np.ndarray] = None,
+                 offset: Optional[np.ndarray] = None,
+                 weights: Optional[np.ndarray] = None):
+        X = np.asarray(X, dtype=float)
+        self.n_obs, self.n_alternatives, self.n_parameters = X.shape
+        self.choices = np.asarray(choices, dtype=np.intp)
+        rows = np.arange(self.n_obs)
+
+        if availability is None:
+            self.availability = np.ones((self.n_obs, self.n_alternatives), dtype=bool)
+        else:
+            self.availability = np.asarray(availability) != 0
+        if not self.availability[rows, self.choices].all():
+            raise ValueError("Some observations chose an unavailable alternative")
+
+        # Attributes of unavailable alternatives must not leak into the sums
+        X = np.where(self.availability[..., np.newaxis], X, 0.0)
+        self.offset = None if offset is None else np.where(self.availability, offset, 0.0)
+        self.weights = (np.ones(self.n_obs) if weights is None
+                        else np.asarray(weights, dtype=float))
+
+        # Arrays are stored with the observations on the last axis, which
+        # keeps the per-parameter rows contiguous in the loops below
+        self.available = np.ascontiguousarray(self.availability.T)
+        self.blocks: List[Tuple[np.ndarray, np.ndarray]] = []
+        for j in range(self.n_alternatives):
+            columns = np.flatnonzero(np.any(X[:, j, :] != 0, axis=0))
+            self.blocks.append((columns, np.ascontiguousarray(X[:, j, columns].T)))
+
+        # Attributes of the chosen alternatives do not depend on beta
+        self.chosen = np.ascontiguousarray(X[rows, self.choices].T)
+
+    def utilities(self, beta: np.ndarray) -> np.ndarray:
+        """Calculate the J x N utilities for the parameters beta."""
+        beta = np.asarray(beta, dtype=float)
+        utilities = np.zeros((self.n_alternatives, self.n_obs))
+        for j, (columns, block) in enumerate(self.blocks):
+            if len(columns):
+                utilities[j] = beta[columns] @ block
+        if self.offset is not None:
+            utilities += self.offset.T
+        return utilities
+
+    def expectation(self, weights: np.ndarray) -> np.ndarray:
+        """Calculate the K x N weighted sums over alternatives of the attributes.
+
+        Args:
+            weights: J x N weight of each alternative, e.g. its probability
+        """
+        expected = np.zeros((self.n_parameters, self.n_obs))
+        for j, (columns, block) in enumerate(self.blocks):
+            expected[columns] += weights[j] * block
+        return expected
+
+    def loglikelihood(self, beta: np.ndarray, hessian: bool = True
+                      ) -> Tuple[float, np.ndarray, Optional[np.ndarray], np.ndarray]:
+        """
+        Calculate the log likelihood with its analytic derivatives.
+
+        Args:
+            beta: Parameter vector of length K
+            hessian: Whether to calculate the Hessian
+
+        Returns:
+            Tuple of (log likelihood, gradient, Hessian or None, N x K matrix
+            of weighted individual scores)
+        """
+        utilities = self.utilities(beta)
+
+        # Log-sum-exp over the available alternatives
+        masked = np.where(self.available, utilities, -np.inf)
+        vmax = masked.max(axis=0)
+        exponentials = np.exp(masked - vmax)
+        denominator = exponentials.sum(axis=0)
+        probabilities = exponentials / denominator
+        log_denominator = np.log(denominator) + vmax
+
+        chosen_utilities = utilities[self.choices, np.arange(self.n_obs)]
+        loglike = float(self.weights @ (chosen_utilities - log_denominator))
+
+        # Score of each observation: chosen attributes minus their expected value
+        expected = self.expectation(probabilities)
+        scores = (self.chosen - expected) * self.weights
+        gradient = scores.sum(axis=1)
+
+        if not hessian:
+            return loglike, gradient, None, scores.T
+
+        # -sum_n w_n sum_j P_nj (x_nj - xbar_n)(x_nj - xbar_n)'
+        hess = expected @ (expected * self.weights).T
+        for j, (columns, block) in enumerate(self.blocks):
+            hess[np.ix_(columns, columns)] -= (block * (probabilities[j] * self.weights)) @ block.T
+        return loglike, gradient, hess, scores.T
+
+    def null_loglikelihood(self) -> float:
+        """Log likelihood of equal probabilities for the available alternatives."""
+        return float(-self.weights @ np.log(self.availability.sum(axis=1)))
+
+
+def mnl_loglikelihood(beta: np.ndarray,
+                      X: np.ndarray,
+                      choices: np.ndarray,
+                      availability: Optional[np.ndarray] = None,
+                      offset: Optional[np.ndarray] = None,
+                      weights: Optional[np.ndarray] = None,
+                      hessian: bool = True) -> Tuple[float, np.ndarray, Optional[np.ndarray], np.ndarray]:
+    """
+    Calculate the MNL log likelihood with its analytic derivatives.
+
+    Use MNLDesign directly to evaluate the same data repeatedly.
+
+    Args:
+        beta: Parameter vector of length K
+        X: N x J x K attributes
+        choices: Column index (0..J-1) of the chosen alternative of each observation
+        availability: Optional N x J array of 0/1 availabilities
+        offset: Optional N x J utility terms that do not depend on beta
+        weights: Optional observation weights
+        hessian: Whether to calculate the Hessian
+
+    Returns:
+        Tuple of (log likelihood, gradient, Hessian or None, N x K matrix of
+        weighted individual scores)
+    """
+    return MNLDesign(X, choices, availability, offset, weights).loglikelihood(beta, hessian)
+
+
+def estimate_mnl(X: np.ndarray,
+                 choices: np.ndarray,
+                 availability: Optional[np.ndarray] = None,
+                 names: Optional[Sequence[str]] = None,
+                 offset: Optional[np.ndarray] = None,
+                 weights: Optional[np.ndarray] = None,
+                 frequencies: Optional[np.ndarray] = None,
+                 beta0: Optional[np.ndarray] = None,
+                 model_name: str = 'mnl',
+                 method: str = 'trust-exact') -> EstimationResults:
+    """
+    Estimate a multinomial logit model by maximum likelihood.
+
+    Args:
+        X: N x J x K attributes
+        choices: Column index (0..J-1) of the chosen alternative of each observation
+        availability: Optional N x J array of 0/1 availabilities
+        names: Parameter names (defaults to beta_0..beta_K-1)
+        offset: Optional N x J utility terms that do not depend on beta
+        weights: Optional observation weights
+        frequencies: Optional number of identical observations each row
+            stands for (see collapse.collapse_duplicates); the results are
+            those of the estimation on the expanded data
+        beta0: Starting values (defaults to zero)
+        model_name: Name reported in the results
+        method: SciPy optimization method ('trust-exact', 'BFGS', ...)
+
+    Returns:
+        EstimationResults with the Biogeme results interface
+    """
+    frequencies, weights = frequency_weights(frequencies, weights, len(choices))
+    design = MNLDesign(X, choices, availability, offset, weights)
+    n_params = design.n_parameters
+    names = list(names) if names is not None else [f'beta_{k}' for k in range(n_params)]
+    beta0 = np.zeros(n_params) if beta0 is None else np.asarray(beta0, dtype=float)
+    second_order = method in SECOND_ORDER_METHODS
+
+    def loglikelihood(beta):
+        return design.loglikelihood(beta, hessian=second_order)[:3]
+
+    solution = maximize_loglikelihood(loglikelihood, beta0, method=method)
+    beta = solution.x
+    ll, gradient, hess, scores = design.loglikelihood(beta)
+
+    raw = RawEstimationResults(
+        model_name, names, beta,
+        init_loglike=design.loglikelihood(beta0, hessian=False)[0],
+        null_loglike=design.null_loglikelihood(),
+        loglike=ll, gradient=gradient, hessian=hess,
+        bhhh=scores.T @ (scores / frequencies[:, np.newaxis]),
+        sample_size=int(frequencies.sum()),
+        optimization_messages={'Algorithm': f'scipy {method}',
+                               'Number of iterations': solution.get('nit'),
+                               'Cause of termination': solution.message},
+        convergence=bool(solution.success))
+    return EstimationResults(raw)
@@ -0,0 +1,295 @@
+"""Native two-level nested logit estimation.
+
+The normalization is the one of Biogeme's models.lognested (see
+probabilities.nested_logit_log_components): the upper level has scale one
+and nest m has a parameter mu_m >= 1, so that for alternative i in nest m
+
+    log P(i) = mu_m V_i - A_m + I_m - log(sum_l exp(I_l)),
+
+with A_m = log(sum_{j in m} exp(mu_m V_j)) and I_m = A_m / mu_m. The
+gradient with respect to the utility parameters and the nest parameters is
+analytic; the Hessian used for the standard errors is obtained from it by
+finite differences.
+"""
+
+from collections import namedtuple
+from typing import Any, List, Optional, Sequence, Tuple, Union
+import numpy as np
+from .estimation import (EstimationResults, RawEstimationResults, frequency_weights,
+                         maximize_loglikelihood, numerical_hessian)
+from .mnl import MNLDesign
+
+# Estimated nest parameter, with its starting value and bounds
+NestParameter = namedtuple('NestParameter', ['name', 'init', 'lower', 'upper'])
+
+# A nest: its parameter (NestParameter, or a number if fixed) and the column
+# indices of its alternatives
+NestSpecification = Tuple[Union[float, NestParameter], List[int]]
+
+
+def nest_specification_from_biogeme(nests: Any, alternatives: Sequence[int]) -> List[NestSpecification]:
+    """
+    Convert a Biogeme NestsForNestedLogit object to nest specifications.
+
+    Args:
+        nests: Biogeme NestsForNestedLogit (or a list of (nest parameter,
+            alternative ids) tuples)
+        alternatives: Alternative ids, in the column order of the utility matrix
+
+    Returns:
+        List of (NestParameter or fixed mu, column indices) tuples
+    """
+    column = {alt: j for j, alt in enumerate(alternatives)}
+    tuple_of_nests = getattr(nests, 'tuple_of_nests', nests)
+
+    specification = []
+    for nest in tuple_of_nests:
+        if isinstance(nest, tuple):
+            nest_param, members = nest[0], nest[1]
+        else:
+            nest_param, members = nest.nest_param, nest.list_of_alternatives
+
+        if isinstance(nest_param, (int, float, np.number)):
+            mu = float(nest_param)
+        elif getattr(nest_param, 'status', 0) != 0:
+            mu = float(nest_param.initValue)
+        else:
+            mu = NestParameter(nest_param.name, float(nest_param.initValue),
+                               nest_param.lb, nest_param.ub)
+        specification.append((mu, [column[alt] for alt in members]))
+
+    return specification
+
+
+class NestedLogitDesign(MNLDesign):
+    """
+    Attributes and nesting structure of a two-level nested logit model.
+
+    Args:
+        X: N x J x K attributes
+        choices: Column index (0..J-1) of the chosen alternative of each observation
+        nests: List of (NestParameter or fixed mu, column indices) tuples;
+            alternatives that are not listed form their own degenerate nest.
+            Several nests may share a NestParameter name.
+        availability: Optional N x J array of 0/1 availabilities
+        offset: Optional N x J utility terms that do not depend on beta
+        weights: Optional observation weights
+    """
+
+    def __init__(self, X: np.ndarray, choices: np.ndarray,
+                 nests: Sequence[NestSpecification],
+                 availability: Optional[np.ndarray] = None,
+                 offset: Optional[np.ndarray] = None,
+                 weights: Optional[np.ndarray] = None):
+        super().__init__(X, choices, availability, offset, weights)
+
+        nested = set()
+        self.nest_members: List[np.ndarray] = []
+        self.nest_parameter: List[int] = []     # Index of the nest parameter, -1 if fixed
+        self.fixed_mu: List[float] = []
+        self.parameters: List[NestParameter] = []
+        for mu, members in nests:
+            overlap = nested.intersection(members)
+            if overlap:
+                raise ValueError(f"Alternatives {sorted(overlap)} belong to more than one nest")
+            nested.update(members)
+            self.nest_members.append(np.asarray(members, dtype=np.intp))
+            if isinstance(mu, NestParameter):
+                names = [p.name for p in self.parameters]
+                if mu.name not in names:
+                    self.parameters.append(mu)
+                    names.append(mu.name)
+                self.nest_parameter.append(names.index(mu.name))
+                self.fixed_mu.append(np.nan)
+            else:
+                self.nest_parameter.append(-1)
+                self.fixed_mu.append(float(mu))
+        for j in range(self.n_alternatives):
+            if j not in nested:
+                self.nest_members.append(np.array([j], dtype=np.intp))
+                self.nest_parameter.append(-1)
+                self.fixed_mu.append(1.0)
+
+        self.nest_of = np.empty(self.n_alternatives, dtype=np.intp)
+        for g, members in enumerate(self.nest_members):
+            self.nest_of[members] = g
+        self.chosen_nest = self.nest_of[self.choices]
+        # J x N indicator of the alternatives in the chosen nest
+        self.in_chosen_nest = self.nest_of[:, np.newaxis] == self.chosen_nest[np.newaxis, :]
+
+    @property
+    def parameter_names(self) -> List[str]:
+        """Names of the estimated nest parameters."""
+        return [p.name for p in self.parameters]
+
+    def _mu(self, theta: np.ndarray) -> np.ndarray:
+        """Get the mu of each nest from the full parameter vector."""
+        mu_parameters = theta[self.n_parameters:]
+        return np.array([mu_parameters[p] if p >= 0 else fixed
+                         for p, fixed in zip(self.nest_parameter, self.fixed_mu)])
+
+    def components(self, theta: np.ndarray):
+        """
+        Calculate the nest-level quantities of the model.
+
+        Args:
+            theta: Utility parameters followed by the nest parameters
+
+        Returns:
+            Tuple of (J x N utilities, nest mu values, J x N conditional
+            probabilities within the nests, G x N log-sum A_m, G x N
+            inclusive values I_m, G x N log nest probabilities)
+        """
+        theta = np.asarray(theta, dtype=float)
+        utilities = self.utilities(theta[:self.n_parameters])
+        mu = self._mu(theta)
+
+        n_nests = len(self.nest_members)
+        conditional = np.zeros_like(utilities)
+        log_sum = np.empty((n_nests, self.n_obs))
+        for g, members in enumerate(self.nest_members):
+            scaled = np.where(self.available[members], mu[g] * utilities[members], -np.inf)
+            vmax = scaled.max(axis=0)
+            finite_max = np.where(np.isfinite(vmax), vmax, 0.0)
+            exponentials = np.exp(scaled - finite_max)
+            total = exponentials.sum(axis=0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                log_sum[g] = np.log(total) + finite_max
+                conditional[members] = np.nan_to_num(exponentials / total)
+
+        inclusive = log_sum / mu[:, np.newaxis]
+        vmax = inclusive.max(axis=0)
+        log_nest = inclusive - (np.log(np.exp(inclusive - vmax).sum(axis=0)) + vmax)
+        return utilities, mu, conditional, log_sum, inclusive, log_nest
+
+    def probabilities(self, theta: np.ndarray) -> np.ndarray:
+        """Calculate the J x N choice probabilities."""
+        _, _, conditional, _, _, log_nest = self.components(theta)
+        return conditional * np.exp(log_nest)[self.nest_of]
+
+    def loglikelihood(self, theta: np.ndarray, hessian: bool = False
+                      ) -> Tuple[float, np.ndarray, None, np.ndarray]:
+        """
+        Calculate the log likelihood with its analytic gradient.
+
+        Args:
+            theta: Utility parameters followed by the nest parameters
+            hessian: Ignored; the nested logit Hessian is not calculated
+
+        Returns:
+            Tuple of (log likelihood, gradient, None, N x (K + M) matrix of
+            weighted individual scores)
+        """
+        utilities, mu, conditional, log_sum, inclusive, log_nest = self.components(theta)
+        rows = np.arange(self.n_obs)
+        nest_probabilities = np.exp(log_nest)
+        chosen_mu = mu[self.chosen_nest]
+        chosen_utilities = utilities[self.choices, rows]
+
+        loglike_n = (chosen_mu * chosen_utilities - log_sum[self.chosen_nest, rows] +
+                     log_nest[self.chosen_nest, rows])
+        loglike = float(self.weights @ loglike_n)
+
+        # d log P / d beta = mu_m x_i - (mu_m - 1) xbar_m - sum_j P_j x_j
+        chosen_nest_mean = self.expectation(conditional * self.in_chosen_nest)
+        expected = self.expectation(conditional * nest_probabilities[self.nest_of])
+        beta_scores = (chosen_mu * self.chosen - (chosen_mu - 1.0) * chosen_nest_mean - expected)
+
+        # d log P / d mu_m = [i in m] (V_i - vbar_m + dI_m) - P(m) dI_m,
+        # with dI_m = (vbar_m - I_m) / mu_m
+        mu_scores = np.zeros((len(self.parameters), self.n_obs))
+        for g, members in enumerate(self.nest_members):
+            p = self.nest_parameter[g]
+            if p < 0:
+                continue
+            mean_utility = (conditional[members] * utilities[members]).sum(axis=0)
+            d_inclusive = np.where(np.isfinite(inclusive[g]),
+                                   (mean_utility - inclusive[g]) / mu[g], 0.0)
+            in_nest = self.chosen_nest == g
+            mu_scores[p] += (np.where(in_nest, chosen_utilities - mean_utility + d_inclusive, 0.0) -
+                             nest_probabilities[g] * d_inclusive)
+
+        scores = np.vstack([beta_scores, mu_scores]) * self.weights
+        return loglike, scores.sum(axis=1), None, scores.T
+
+
+def estimate_nested_logit(X: np.ndarray,
+                          choices: np.ndarray,
+                          nests: Sequence[NestSpecification],
+                          availability: Optional[np.ndarray] = None,
+                          names: Optional[Sequence[str]] = None,
+                          offset: Optional[np.ndarray] = None,
+                          weights: Optional[np.ndarray] = None,
+                          frequencies: Optional[np.ndarray] = None,
+                          beta0: Optional[np.ndarray] = None,
+                          model_name: str = 'nested_logit',
+                          method: str = 'L-BFGS-B') -> EstimationResults:
+    """
+    Estimate a two-level nested logit model by maximum likelihood.
+
+    Unless starting values are given, the optimization starts from the MNL
+    estimates, which is the nested logit model with all mu equal to one, and
+    the nest parameters at their initial values.
+
+    Args:
+        X: N x J x K attributes
+        choices: Column index (0..J-1) of the chosen alternative of each observation
+        nests: List of (NestParameter or fixed mu, column indices) tuples
+        availability: Optional N x J array of 0/1 availabilities
+        names: Utility parameter names (defaults to beta_0..beta_K-1)
+        offset: Optional N x J utility terms that do not depend on beta
+        weights: Optional observation weights
+        frequencies: Optional number of identical observations each row
+            stands for (see collapse.collapse_duplicates); the results are
+            those of the estimation on the expanded data
+        beta0: Starting values of the utility parameters followed by the nest parameters
+        model_name: Name reported in the results
+        method: SciPy optimization method supporting bounds
+
+    Returns:
+        EstimationResults with the Biogeme results interface; the utility
+        parameters come first, followed by the nest parameters
+    """
+    frequencies, weights = frequency_weights(frequencies, weights, len(choices))
+    design = NestedLogitDesign(X, choices, nests, availability, offset, weights)
+    n_params = design.n_parameters
+    names = list(names) if names is not None else [f'beta_{k}' for k in range(n_params)]
+    names += design.parameter_names
+
+    mu_init = np.array([p.init for p in design.parameters])
+    init = np.concatenate([np.zeros(n_params), mu_init])
+    if beta0 is None:
+        mnl = maximize_loglikelihood(lambda beta: MNLDesign.loglikelihood(design, beta)[:3],
+                                     np.zeros(n_params))
+        beta0 = np.concatenate([mnl.x, mu_init])
+    beta0 = np.asarray(beta0, dtype=float)
+    bounds = [(None, None)] * n_params + [(p.lower, p.upper) for p in design.parameters]
+
+    # Precondition with the MNL Hessian for the utility parameters, and the
+    # BHHH approximation for the nest parameters, which are only bounded
+    hess_mnl = MNLDesign.loglikelihood(design, beta0[:n_params])[2]
+    scores = design.loglikelihood(beta0)[3]
+    preconditioner = np.zeros((len(beta0), len(beta0)))
+    preconditioner[:n_params, :n_params] = np.linalg.inv(np.linalg.cholesky(-hess_mnl)).T
+    mu_information = np.einsum('nm,nm->m', scores[:, n_params:], scores[:, n_params:])
+    preconditioner[n_params:, n_params:] = np.diag(1.0 / np.sqrt(np.maximum(mu_information, 1e-12)))
+
+    solution = maximize_loglikelihood(lambda theta: design.loglikelihood(theta)[:3],
+                                      beta0, method=method, bounds=bounds,
+                                      preconditioner=preconditioner)
+    theta = solution.x
+    ll, gradient, _, scores = design.loglikelihood(theta)
+    hess = numerical_hessian(lambda t: design.loglikelihood(t)[1], theta)
+
+    raw = RawEstimationResults(
+        model_name, names, theta,
+        init_loglike=design.loglikelihood(init)[0],
+        null_loglike=design.null_loglikelihood(),
+        loglike=ll, gradient=gradient, hessian=hess,
+        bhhh=scores.T @ (scores / frequencies[:, np.newaxis]),
+        sample_size=int(frequencies.sum()),
+        optimization_messages={'Algorithm': f'scipy {method}',
+                               'Number of iterations': solution.get('nit'),
+                               'Cause of termination': solution.message},
+        convergence=bool(solution.success))
+    return EstimationResults(raw)
@@ -0,0 +1,151 @@
+"""Individual-level posterior distributions of a random coefficient.
+
+Conditional on the choices y_n of individual n, the density of a random
+coefficient beta is proportional to its population density times the
+probability of the choices (Bayes' theorem), so with draws beta_r from
+the population distribution
+
+    E[g(beta) | y_n] = sum_r w_nr g(beta_r),    w_nr = L_nr / sum_s L_ns
+
+where L_nr is the logit probability of the choices of n at beta_r (the
+product over the individual's observations with panel data). The utilities
+are affine in the coefficient, V_nrj = U_nj + beta_r A_nj, so a single
+J x N x R array evaluated in blocks of whole individuals gives the weights
+of every draw at once. Each block is reduced to the posterior mean,
+standard deviation and weighted quantiles before the next is evaluated,
+so the peak memory stays within the budget whatever the sample size.
+"""
+
+from collections import namedtuple
+from typing import Optional, Sequence
+import numpy as np
+from .mixed import DEFAULT_MEMORY_BUDGET
+
+# Posterior distribution of the coefficient of each individual: its mean,
+# standard deviation and quantiles (one column per requested level)
+Posterior = namedtuple('Posterior', ['mean', 'std', 'quantiles'])
+
+# Population distributions of the coefficient, as functions of the mean and
+# spread parameters and of standard normal draws
+COEFFICIENT_DISTRIBUTIONS = {
+    'normal': lambda mean, spread, draws: mean + spread * draws,
+    'lognormal': lambda mean, spread, draws: np.exp(mean + spread * draws),
+    'negative_lognormal': lambda mean, spread, draws: -np.exp(mean + spread * draws),
+}
+
+
+def individual_posteriors(utilities: np.ndarray,
+                          random_attributes: np.ndarray,
+                          choices: np.ndarray,
+                          draws: np.ndarray,
+                          mean: float,
+                          spread: float,
+                          distribution: str = 'normal',
+                          availability: Optional[np.ndarray] = None,
+                          panel: Optional[np.ndarray] = None,
+                          quantiles: Sequence[float] = (0.05, 0.5, 0.95),
+                          memory_budget: int = DEFAULT_MEMORY_BUDGET) -> Posterior:
+    """
+    Calculate the posterior distribution of a random coefficient for each individual.
+
+    Args:
+        utilities: N x J utilities without the random coefficient term
+        random_attributes: N x J attributes multiplied by the random coefficient
+        choices: N column indices of the chosen alternatives
+        draws: R standard normal draws shared by all individuals, or P x R
+            draws of each individual
+        mean: Mean parameter of the coefficient distribution
+        spread: Spread parameter of the coefficient distribution
+        distribution: One of COEFFICIENT_DISTRIBUTIONS
+        availability: Optional N x J array of 0/1 availabilities
+        panel: Optional N identifiers of the individual of each observation;
+            every observation is its own individual by default
+        quantiles: Levels of the posterior quantiles
+        memory_budget: Approximate peak memory of the simulation arrays, in bytes
+
+    Returns:
+        Posterior with P means, P standard deviations and P x Q quantiles,
+        individuals in sorted order of their identifiers
+    """
+    if distribution not in COEFFICIENT_DISTRIBUTIONS:
+        raise ValueError(f"Unknown coefficient distribution: {distribution}. "
+                         f"Available distributions: {list(COEFFICIENT_DISTRIBUTIONS)}")
+    utilities = np.asarray(utilities, dtype=float)
+    random_attributes = np.asarray(random_attributes, dtype=float)
+    choices = np.asarray(choices, dtype=np.intp)
+    levels = np.asarray(quantiles, dtype=float)
+    n_obs, n_alternatives = utilities.shape
+    available = None if availability is None else np.asarray(availability) != 0
+
+    # Alternatives first, so that the reductions over them are elementwise
+    utilities, random_attributes = utilities.T, random_attributes.T
+    available = None if available is None else available.T
+
+    # Observations sorted so that each individual's rows are contiguous
+    if panel is None:
+        n_individuals = n_obs
+        offsets = np.arange(n_obs + 1)
+    else:
+        _, individual_of, counts = np.unique(panel, return_inverse=True, return_counts=True)
+        order = np.argsort(individual_of, kind='stable')
+        utilities, random_attributes = utilities[:, order], random_attributes[:, order]
+        choices = choices[order]
+        available = None if available is None else available[:, order]
+        n_individuals = len(counts)
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    # Coefficient values of the draws, sorted for the quantiles
+    coefficients = COEFFICIENT_DISTRIBUTIONS[distribution](mean, spread, np.asarray(draws, dtype=float))
+    shared = coefficients.ndim == 1
+    coefficients = np.sort(coefficients, axis=-1)
+    n_draws = coefficients.shape[-1]
+
+    posterior_mean = np.empty(n_individuals)
+    posterior_std = np.empty(n_individuals)
+    posterior_quantiles = np.empty((n_individuals, len(levels)))
+
+    # Kernel utilities of a block and their exponentials stay within the budget
+    rows_per_block = max(1, memory_budget // (8 * n_draws * (2 * n_alternatives + 2 + len(levels))))
+    first = 0
+    while first < n_individuals:
+        last = np.searchsorted(offsets, offsets[first] + rows_per_block, side='right') - 1
+        last = max(int(last), first + 1)
+        people = slice(first, last)
+        rows = slice(offsets[first], offsets[last])
+        block_coefficients = coefficients if shared else coefficients[people]
+        if shared:
+            row_coefficients = block_coefficients
+        else:
+            row_coefficients = np.repeat(block_coefficients, np.diff(offsets[first:last + 1]), axis=0)
+
+        # J x C x R kernel utilities
+        kernel = (utilities[:, rows, np.newaxis] +
+                  random_attributes[:, rows, np.newaxis] * row_coefficients)
+        if available is not None:
+            kernel[~available[:, rows]] = -np.inf
+        block = np.arange(rows.stop - rows.start)
+        chosen = kernel[choices[rows], block]
+        vmax = kernel.max(axis=0)
+        kernel -= vmax
+        np.exp(kernel, out=kernel)
+        log_kernel = chosen - vmax - np.log(kernel.sum(axis=0))
+        del kernel
+        # Log probability of all the choices of each individual
+        log_kernel = np.add.reduceat(log_kernel, offsets[first:last] - offsets[first], axis=0)
+
+        weights = np.exp(log_kernel - log_kernel.max(axis=1, keepdims=True))
+        weights /= weights.sum(axis=1, keepdims=True)
+        first_moment = (weights * block_coefficients).sum(axis=1)
+        second_moment = (weights * block_coefficients ** 2).sum(axis=1)
+        posterior_mean[people] = first_moment
+        posterior_std[people] = np.sqrt(np.maximum(second_moment - first_moment ** 2, 0.0))
+
+        # Smallest sorted coefficient whose cumulative weight reaches each level
+        cumulative = np.cumsum(weights, axis=1)
+        below = (cumulative[..., np.newaxis] < levels - 1e-12).sum(axis=1)
+        below = np.minimum(below, n_draws - 1)
+        posterior_quantiles[people] = (block_coefficients[below] if shared else
+                                       np.take_along_axis(block_coefficients, below, axis=1))
+        first = last
+
+    return Posterior(posterior_mean, posterior_std, posterior_quantiles)
@@ -0,0 +1,193 @@
+"""Vectorized choice probabilities for logit and nested logit models.
+
+All functions work on utility arrays whose last axis indexes the alternatives,
+so the same code handles a single N x J matrix or stacked arrays such as
+S x N x J. Unavailable alternatives get probability zero, and all exponentials
+go through a log-sum-exp so large utilities do not overflow.
+"""
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+Nest = Tuple[float, List[int]]
+
+
+def _availability_mask(utilities: np.ndarray, availability: Optional[np.ndarray]) -> np.ndarray:
+    """Return a boolean mask broadcast to the shape of the utilities."""
+    if availability is None:
+        return np.ones(utilities.shape, dtype=bool)
+    return np.broadcast_to(np.asarray(availability) != 0, utilities.shape)
+
+
+def logsumexp(utilities: np.ndarray,
+              availability: Optional[np.ndarray] = None,
+              axis: int = -1) -> np.ndarray:
+    """
+    Calculate log(sum(exp(V))) over available alternatives.
+
+    Args:
+        utilities: Array of utilities
+        availability: Optional array (broadcastable to utilities) of 0/1 availabilities
+        axis: Axis along which the alternatives are stored
+
+    Returns:
+        np.ndarray: Log-sum-exp with the alternatives axis removed. Rows with no
+        available alternative return -inf.
+    """
+    available = _availability_mask(utilities, availability)
+    masked = np.where(available, utilities, -np.inf)
+    vmax = np.max(masked, axis=axis, keepdims=True)
+    vmax = np.where(np.isfinite(vmax), vmax, 0.0)
+    total = np.sum(np.exp(masked - vmax), axis=axis, keepdims=True)
+    with np.errstate(divide='ignore'):
+        result = np.log(total) + vmax
+    return np.squeeze(result, axis=axis)
+
+
+def logit_probabilities(utilities: np.ndarray,
+                        availability: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Calculate multinomial logit choice probabilities.
+
+    Args:
+        utilities: Array of utilities, alternatives on the last axis
+        availability: Optional array (broadcastable to utilities) of 0/1 availabilities
+
+    Returns:
+        np.ndarray: Choice probabilities with the same shape as the utilities
+    """
+    utilities = np.asarray(utilities, dtype=float)
+    available = _availability_mask(utilities, availability)
+    log_denominator = logsumexp(utilities, available)[..., np.newaxis]
+    with np.errstate(invalid='ignore'):
+        probabilities = np.exp(np.where(available, utilities, -np.inf) - log_denominator)
+    return np.nan_to_num(probabilities, nan=0.0)
+
+
+def _complete_nests(nests: Sequence[Nest], n_alternatives: int) -> List[Nest]:
+    """Add a degenerate nest (mu = 1) for every alternative not in any nest."""
+    nested = set()
+    for _, members in nests:
+        overlap = nested.intersection(members)
+        if overlap:
+            raise ValueError(f"Alternatives {sorted(overlap)} belong to more than one nest")
+        nested.update(members)
+    complete = [(float(mu), list(members)) for mu, members in nests]
+    complete += [(1.0, [j]) for j in range(n_alternatives) if j not in nested]
+    return complete
+
+
+def nested_logit_log_components(utilities: np.ndarray,
+                                nests: Sequence[Nest],
+                                availability: Optional[np.ndarray] = None) -> Dict[str, Any]:
+    """
+    Calculate the building blocks of the two-level nested logit model.
+
+    The normalization is the one used by Biogeme: the upper level has scale one
+    and each nest m has a parameter mu_m >= 1, so that
+    P(i) = P(i|m) * P(m), with
+    P(i|m) = exp(mu_m V_i) / sum_{j in m} exp(mu_m V_j),
+    I_m = log(sum_{j in m} exp(mu_m V_j)) / mu_m and
+    P(m) = exp(I_m) / sum_l exp(I_l).
+
+    Args:
+        utilities: Array of utilities, alternatives on the last axis
+        nests: List of (mu, column indices) tuples; alternatives that are not
+            listed form their own degenerate nest
+        availability: Optional array (broadcastable to utilities) of 0/1 availabilities
+
+    Returns:
+        Dict with the completed nest list ('nests'), the nest of each
+        alternative ('nest_of'), log conditional probabilities
+        ('log_conditional', same shape as utilities), nest inclusive values
+        ('inclusive', shape [..., G]) and log nest probabilities
+        ('log_nest', shape [..., G]).
+    """
+    utilities = np.asarray(utilities, dtype=float)
+    available = _availability_mask(utilities, availability)
+    n_alternatives = utilities.shape[-1]
+    complete = _complete_nests(nests, n_alternatives)
+
+    nest_of = np.empty(n_alternatives, dtype=int)
+    log_conditional = np.full(utilities.shape, -np.inf)
+    inclusive = np.empty(utilities.shape[:-1] + (len(complete),))
+
+    for g, (mu, members) in enumerate(complete):
+        nest_of[members] = g
+        scaled = mu * utilities[..., members]
+        nest_available = available[..., members]
+        log_sum = logsumexp(scaled, nest_available)
+        inclusive[..., g] = log_sum / mu
+        with np.errstate(invalid='ignore'):
+            conditional = np.where(nest_available, scaled - log_sum[..., np.newaxis], -np.inf)
+        log_conditional[..., members] = conditional
+
+    log_nest = inclusive - logsumexp(inclusive)[..., np.newaxis]
+
+    return {
+        'nests': complete,
+        'nest_of': nest_of,
+        'log_conditional': log_conditional,
+        'inclusive': inclusive,
+        'log_nest': log_nest
+    }
+
+
+def nested_logit_probabilities(utilities: np.ndarray,
+                               nests: Sequence[Nest],
+                               availability: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Calculate two-level nested logit choice probabilities.
+
+    Args:
+        utilities: Array of utilities, alternatives on the last axis
+        nests: List of (mu, column indices) tuples; alternatives that are not
+            listed form their own degenerate nest
+        availability: Optional array (broadcastable to utilities) of 0/1 availabilities
+
+    Returns:
+        np.ndarray: Choice probabilities with the same shape as the utilities
+    """
+    components = nested_logit_log_components(utilities, nests, availability)
+    log_probabilities = (components['log_conditional'] +
+                         components['log_nest'][..., components['nest_of']])
+    with np.errstate(invalid='ignore'):
+        probabilities = np.exp(log_probabilities)
+    return np.nan_to_num(probabilities, nan=0.0)
+
+
+def nests_from_biogeme(nests: Any,
+                       alternatives: Sequence[int],
+                       betas: Dict[str, float]) -> List[Nest]:
+    """
+    Convert a Biogeme NestsForNestedLogit object to (mu, column indices) tuples.
+
+    Args:
+        nests: Biogeme NestsForNestedLogit (or a plain list of (mu, alternatives) tuples)
+        alternatives: Alternative ids, in the column order of the utility matrix
+        betas: Estimated parameter values used to evaluate the nest parameters
+
+    Returns:
+        List of (mu, column indices) tuples
+    """
+    column = {alt: j for j, alt in enumerate(alternatives)}
+    tuple_of_nests = getattr(nests, 'tuple_of_nests', nests)
+
+    converted = []
+    for nest in tuple_of_nests:
+        if isinstance(nest, tuple):
+            nest_param, members = nest[0], nest[1]
+        else:
+            nest_param, members = nest.nest_param, nest.list_of_alternatives
+
+        if isinstance(nest_param, (int, float, np.number)):
+            mu = float(nest_param)
+        elif nest_param.name in betas:
+            mu = float(betas[nest_param.name])
+        else:
+            # Fixed parameters are not reported with the estimated betas
+            mu = float(nest_param.initValue)
+
+        converted.append((mu, [column[alt] for alt in members]))
+
+    return converted
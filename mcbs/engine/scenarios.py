@@ -0,0 +1,225 @@
+"""Batched what-if scenarios on the attributes of the alternatives.
+
+A scenario is a list of declarative modifications of attribute columns
+(e.g. bus cost -25%, car time +10 minutes). With utilities that are affine in
+the modified attributes, the utilities of every scenario are
+
+    V_s = V_0 + sum_c dV/dx_c * (x_sc - x_c)
+
+Each column enters the utilities of a few alternatives only (usually one),
+so its term keeps the derivatives of these alternatives, and a scenario is
+applied as a delta on the affected utility columns of the baseline. All
+scenarios are then evaluated in a single pass over a stacked S x N x J
+utility array, instead of one dataset copy and simulation per scenario.
+
+For mixed logit models, the attributes multiplied by the random
+coefficients get their own terms, and the shares of the scenarios are
+simulated over the draws of the estimator, in blocks of observations.
+"""
+
+from collections import namedtuple
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+from .mixed import kernel_utilities
+from .probabilities import Nest, logit_probabilities, nested_logit_probabilities
+
+# Change of an attribute column, e.g. Modification('BUS_COST', multiplier=0.75):
+# the new values are old * multiplier + shift
+Modification = namedtuple('Modification', ['column', 'multiplier', 'shift'], defaults=(1.0, 0.0))
+
+# Named list of modifications applied together (in order)
+Scenario = namedtuple('Scenario', ['name', 'modifications'])
+
+# Utility term of an attribute column: the columns of the alternatives whose
+# utilities it enters, the N x A derivatives of these utilities and the N
+# baseline values of the column
+AttributeTerm = namedtuple('AttributeTerm', ['alternatives', 'gradient', 'values'])
+
+# Peak memory of the stacked scenario arrays used when no budget is given (bytes)
+DEFAULT_MEMORY_BUDGET = 256 * 2**20
+
+
+def scenario_columns(scenarios: Sequence[Scenario]) -> list:
+    """
+    Get the attribute columns modified by a list of scenarios.
+
+    Args:
+        scenarios: Scenarios to evaluate
+
+    Returns:
+        List of column names, in order of first appearance
+    """
+    return list(dict.fromkeys(modification.column
+                              for scenario in scenarios
+                              for modification in scenario.modifications))
+
+
+def attribute_term(gradient: np.ndarray, values: np.ndarray) -> AttributeTerm:
+    """
+    Create the utility term of an attribute column.
+
+    Args:
+        gradient: N x J derivatives of the utilities with respect to the column
+        values: N baseline values of the column
+
+    Returns:
+        AttributeTerm restricted to the alternatives the column enters
+    """
+    gradient = np.asarray(gradient, dtype=float)
+    alternatives = np.flatnonzero(np.any(gradient != 0, axis=0))
+    return AttributeTerm(alternatives, gradient[:, alternatives], np.asarray(values, dtype=float))
+
+
+def scenario_utilities(base_utilities: np.ndarray,
+                       terms: Dict[str, AttributeTerm],
+                       scenarios: Sequence[Scenario]) -> np.ndarray:
+    """
+    Calculate the utilities of stacked scenarios.
+
+    Only the utilities of the alternatives a modified column enters are
+    updated, by the derivative times the change of the column.
+
+    Args:
+        base_utilities: N x J baseline utilities
+        terms: Utility term of each modified column
+        scenarios: Scenarios to evaluate
+
+    Returns:
+        np.ndarray: S x N x J utilities
+    """
+    utilities = np.repeat(np.asarray(base_utilities, dtype=float)[np.newaxis], len(scenarios), axis=0)
+    for s, scenario in enumerate(scenarios):
+        values = {}
+        for modification in scenario.modifications:
+            current = values.get(modification.column, terms[modification.column].values)
+            values[modification.column] = current * modification.multiplier + modification.shift
+        for column, new_values in values.items():
+            term = terms[column]
+            utilities[s][:, term.alternatives] += term.gradient * (new_values - term.values)[:, np.newaxis]
+    return utilities
+
+
+def scenario_shares(base_utilities: np.ndarray,
+                    terms: Dict[str, AttributeTerm],
+                    scenarios: Sequence[Scenario],
+                    availability: Optional[np.ndarray] = None,
+                    nests: Optional[Sequence[Nest]] = None,
+                    weights: Optional[np.ndarray] = None,
+                    random_attributes: Optional[np.ndarray] = None,
+                    random_terms: Optional[List[Dict[str, AttributeTerm]]] = None,
+                    spreads: Optional[np.ndarray] = None,
+                    draws: Optional[np.ndarray] = None,
+                    draw_weights: Optional[np.ndarray] = None,
+                    memory_budget: int = DEFAULT_MEMORY_BUDGET) -> np.ndarray:
+    """
+    Calculate the predicted market shares of each scenario.
+
+    Scenarios are evaluated in blocks sized to the memory budget. With
+    random attributes, the shares are those of a mixed logit model,
+    simulated over the draws.
+
+    Args:
+        base_utilities: N x J baseline utilities
+        terms: Utility term of each modified column
+        scenarios: Scenarios to evaluate
+        availability: Optional N x J array of 0/1 availabilities
+        nests: Optional list of (mu, column indices) tuples for nested logit
+        weights: Optional number of observations each row stands for
+        random_attributes: Optional L x N x J baseline attributes multiplied
+            by the random coefficients of a mixed logit model
+        random_terms: Utility term of each modified column in each of the L
+            random attributes
+        spreads: Standard deviations of the L random coefficients
+        draws: N x R x L standard normal draws of each observation
+        draw_weights: Optional weights of the R draws (equal by default)
+        memory_budget: Approximate peak memory of the stacked arrays, in bytes
+
+    Returns:
+        np.ndarray: S x J market shares
+    """
+    if random_attributes is not None:
+        if nests is not None:
+            raise ValueError("Mixed logit scenarios do not support nests")
+        return _mixed_scenario_shares(base_utilities, terms, scenarios, availability, weights,
+                                      random_attributes, random_terms, spreads, draws,
+                                      draw_weights, memory_budget)
+    base_utilities = np.asarray(base_utilities, dtype=float)
+    n_obs, n_alternatives = base_utilities.shape
+    weights = np.ones(n_obs) if weights is None else np.asarray(weights, dtype=float)
+    weights = weights / weights.sum()
+
+    # Utilities and probabilities of a block (plus the temporaries of the
+    # probabilities) stay within the budget
+    bytes_per_scenario = 8 * n_obs * 4 * n_alternatives
+    block = max(1, memory_budget // bytes_per_scenario)
+
+    shares = np.empty((len(scenarios), n_alternatives))
+    for start in range(0, len(scenarios), block):
+        stop = min(start + block, len(scenarios))
+        utilities = scenario_utilities(base_utilities, terms, scenarios[start:stop])
+        if nests is not None:
+            probabilities = nested_logit_probabilities(utilities, nests, availability)
+        else:
+            probabilities = logit_probabilities(utilities, availability)
+        shares[start:stop] = np.einsum('snj,n->sj', probabilities, weights)
+    return shares
+
+
+
+def _mixed_scenario_shares(base_utilities: np.ndarray,
+                           terms: Dict[str, AttributeTerm],
+                           scenarios: Sequence[Scenario],
+                           availability: Optional[np.ndarray],
+                           weights: Optional[np.ndarray],
+                           random_attributes: np.ndarray,
+                           random_terms: List[Dict[str, AttributeTerm]],
+                           spreads: np.ndarray,
+                           draws: np.ndarray,
+                           draw_weights: Optional[np.ndarray],
+                           memory_budget: int) -> np.ndarray:
+    """
+    Simulate the mixed logit market shares of each scenario.
+
+    The utilities and random attributes of a block of scenarios are stacked
+    once, and the logit kernel is averaged over the draws in blocks of
+    observations sized to the memory budget.
+
+    Args:
+        See scenario_shares
+
+    Returns:
+        np.ndarray: S x J market shares
+    """
+    base_utilities = np.asarray(base_utilities, dtype=float)
+    n_obs, n_alternatives = base_utilities.shape
+    n_random = len(random_attributes)
+    n_draws = draws.shape[1]
+    weights = np.ones(n_obs) if weights is None else np.asarray(weights, dtype=float)
+    weights = weights / weights.sum()
+    draw_weights = (np.full(n_draws, 1.0 / n_draws) if draw_weights is None
+                    else np.asarray(draw_weights, dtype=float) / np.sum(draw_weights))
+    availability = (np.ones((n_obs, n_alternatives)) if availability is None
+                    else np.asarray(availability))
+
+    # Stacked utilities and random attributes of a block stay within the budget
+    bytes_per_scenario = 8 * n_obs * n_alternatives * (2 + n_random)
+    block = max(1, memory_budget // bytes_per_scenario)
+
+    shares = np.zeros((len(scenarios), n_alternatives))
+    for start in range(0, len(scenarios), block):
+        stop = min(start + block, len(scenarios))
+        utilities = scenario_utilities(base_utilities, terms, scenarios[start:stop])
+        attributes = np.stack([scenario_utilities(random_attributes[l], random_terms[l],
+                                                  scenarios[start:stop])
+                               for l in range(n_random)])
+
+        # Kernel utilities and probabilities of a block of rows stay within the budget
+        bytes_per_row = 8 * (stop - start) * n_draws * n_alternatives * 4
+        rows_per_block = max(1, memory_budget // bytes_per_row)
+        for first in range(0, n_obs, rows_per_block):
+            rows = slice(first, min(first + rows_per_block, n_obs))
+            kernel = logit_probabilities(
+                kernel_utilities(utilities[:, rows], attributes[:, :, rows], spreads, draws[rows]),
+                availability[rows, np.newaxis])
+            shares[start:stop] += np.einsum('snrj,r,n->sj', kernel, draw_weights, weights[rows])
+    return shares
\ No newline at end of file
@@ -1,20 +1,132 @@
 """Base class for discrete choice models"""
 
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+import copy
+import os
+import shutil
 import biogeme.biogeme_logging as blog
 from biogeme.database import Database
+from biogeme.expressions import Variable, bioMultSum, log
 import numpy as np
 import pandas as pd
+from ..engine.collapse import collapse_duplicates
+from ..engine.probabilities import logit_probabilities, nested_logit_probabilities, nests_from_biogeme
+
+# Column holding the number of observations each row stands for in collapsed data
+FREQUENCY_COLUMN = 'FREQUENCY'
+
+# Seed of the simulation draws of mixed logit models
+DRAW_SEED = 1223
+
+# DataFrame.attrs entries of prepared data: the preprocessing key of the
+# model family, and the number of rows its filters removed
+PREPARED_ATTRIBUTE = 'mcbs_preprocessing'
+EXCLUDED_ATTRIBUTE = 'mcbs_excluded'
+
+
+class _ParameterRecorder(dict):
+    """Parameter values recording the names they are looked up with (all zero)."""
+
+    def __missing__(self, name):
+        self.setdefault(name, 0.0)
+        return 0.0
+
+
+class _ColumnRecorder:
+    """Wrapper of a DataFrame recording the columns read from it."""
+
+    def __init__(self, data):
+        self.data = data
+        self.columns = []
+
+    def __getitem__(self, column):
+        self.columns.append(column)
+        return self.data[column]
+
 
 class BaseDiscreteChoiceModel(ABC):
     """Base class for all discrete choice models."""
-    
-    def __init__(self, data):
-        """Initialize base model structure."""
+
+    # Alternative ids, in the column order returned by _calculate_utilities
+    alternatives = None
+
+    # Availability column for each alternative (None if all are always available)
+    availability_columns = None
+
+    # Column holding the chosen alternative id
+    choice_column = 'CHOICE'
+
+    # Column, or list of columns, identifying the respondent of each row in
+    # panel data (None if every row is a different respondent)
+    panel_column = None
+
+    # Directory where Biogeme reads its parameters and writes .iter, .html and
+    # .pickle files (None to use the current directory)
+    work_dir = None
+
+    # Biogeme parameter file copied into work_dir
+    parameter_file = 'biogeme.toml'
+
+    # Whether to collapse the rows that are identical on every column of the
+    # specification into weighted unique rows (closed-form models only)
+    collapse_duplicates = False
+
+    # Whether estimate() supports frequency-weighted rows, which collapsed
+    # data and bootstrap replicates use (closed-form models only)
+    frequency_weights = True
+
+    # RandomCoefficient of each normal coefficient of a mixed logit model
+    # (None for closed-form models)
+    random_coefficients = None
+
+    # Starting values of the parameters (None to start from the model's
+    # initial values)
+    start_values = None
+
+    # Version of the family's data preparation (_preprocess_data and
+    # _prepare_database); bump it when they change, so that cached prepared
+    # data is not reused
+    preprocessing_version = 1
+
+    # Estimation backend: 'biogeme', or 'numpy' for the native MNL, nested
+    # logit and mixed logit estimators (utilities must be linear in the
+    # parameters)
+    backend = 'biogeme'
+
+    def __init__(self, data, backend=None, collapse=None, test_data=None):
+        """
+        Initialize base model structure.
+
+        Args:
+            data: DataFrame with choice data, raw or already prepared by
+                prepare_data
+            backend: Estimation backend, 'biogeme' or 'numpy' (defaults to the
+                class attribute)
+            collapse: Whether to collapse duplicate rows once the model's
+                variables are defined (defaults to the class attribute)
+            test_data: Optional holdout DataFrame, in the raw format of data;
+                it is only preprocessed when test_database is first used
+        """
+        if backend is not None:
+            if backend not in ('biogeme', 'numpy'):
+                raise ValueError("backend must be 'biogeme' or 'numpy'")
+            self.backend = backend
+        if collapse is not None:
+            self.collapse_duplicates = collapse
+        # Number of observations each row stands for (None if not collapsed)
+        self.frequencies = None
         self.logger = blog.get_screen_logger(level=blog.INFO)
+        data = self.prepare_data(data)
         self.database = Database('choice_model', data)
-        self.test_database = Database('choice_model', data)
+        self.database.excludedData = data.attrs.get(EXCLUDED_ATTRIBUTE, 0)
+        self.test_data = test_data
+        self._test_database = None
+        # Baseline utilities and utility terms of the last simulated scenarios
+        self._scenario_cache = None
         self.results = None
+        # Statistics of each replicate of the last bootstrap
+        self.bootstrap_replicates = None
         
         # Initialize metrics attributes
         self.final_ll = None
@@ -30,11 +142,902 @@ class BaseDiscreteChoiceModel(ABC):
         self.predicted_shares = None
         self.confusion_matrix = None
     
+    @property
+    def test_database(self):
+        """Database of the holdout data, prepared like the model's data (None without test_data)."""
+        if self._test_database is None and self.test_data is not None:
+            self._test_database = Database('choice_model_test', self.prepare_data(self.test_data))
+        return self._test_database
+
+    @classmethod
+    def preprocessing_key(cls):
+        """
+        Identify the data preparation of the model class.
+
+        Model classes of the same family inherit the same preparation, so
+        they share the key and can share prepared data.
+
+        Returns:
+            str: Qualified names of the preparation hooks and preprocessing_version
+        """
+        hooks = (cls._preprocess_data, cls._prepare_database)
+        names = [f"{hook.__module__}.{hook.__qualname__}" for hook in hooks]
+        return '|'.join(names + [f'v{cls.preprocessing_version}'])
+
+    @classmethod
+    def prepare_data(cls, data):
+        """
+        Prepare raw data for the models of the family.
+
+        The data is converted by _preprocess_data, then filtered and extended
+        with derived variables by _prepare_database. The result is marked as
+        prepared, so passing it to any model of the family skips the
+        preparation; this lets a benchmark prepare each dataset once.
+
+        Args:
+            data: Raw DataFrame, or data already prepared for the family
+
+        Returns:
+            pd.DataFrame: Prepared data
+        """
+        key = cls.preprocessing_key()
+        if data.attrs.get(PREPARED_ATTRIBUTE) == key:
+            return data
+        database = Database('choice_model', cls._preprocess_data(data))
+        cls._prepare_database(database)
+        prepared = database.data
+        prepared.attrs[PREPARED_ATTRIBUTE] = key
+        prepared.attrs[EXCLUDED_ATTRIBUTE] = database.excludedData
+        return prepared
+
+    @classmethod
+    def _preprocess_data(cls, data):
+        """Convert raw data to the format of the family (a shallow copy by default)."""
+        return data.copy(deep=False)
+
+    @classmethod
+    def _prepare_database(cls, database):
+        """Apply the family's row filters and derived variables to a database (none by default)."""
+
     @abstractmethod
     def estimate(self):
         """Estimate model parameters. Must be implemented by subclasses."""
         pass
-    
+
+    @contextmanager
+    def working_directory(self):
+        """
+        Context manager running Biogeme inside the model's work_dir.
+
+        The directory is created if needed and gets its own copy of the
+        parameter file, so that runs in different directories never share
+        iteration files or warm-start from each other.
+
+        Yields:
+            str: The directory Biogeme runs in
+        """
+        if self.work_dir is None:
+            yield os.getcwd()
+            return
+
+        work_dir = os.path.abspath(self.work_dir)
+        os.makedirs(work_dir, exist_ok=True)
+        parameter_file = os.path.abspath(self.parameter_file)
+        target = os.path.join(work_dir, 'biogeme.toml')
+        if os.path.exists(parameter_file) and not os.path.exists(target):
+            shutil.copyfile(parameter_file, target)
+
+        previous_dir = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            yield work_dir
+        finally:
+            os.chdir(previous_dir)
+
+    def _calculate_utilities(self, betas):
+        """Calculate the N x J matrix of utilities. Must be implemented by subclasses."""
+        raise NotImplementedError("Subclasses must implement _calculate_utilities")
+
+    def _linear_utility_design(self):
+        """
+        Express the utilities of _calculate_utilities as offset + X beta.
+
+        The parameters are the names _calculate_utilities looks up, and the
+        columns of X are obtained by switching them on one at a time, so the
+        native estimator uses exactly the specification of the model.
+
+        Returns:
+            Tuple of (parameter names, N x J x K attribute tensor, N x J offset)
+        """
+        recorder = _ParameterRecorder()
+        offset = np.asarray(self._calculate_utilities(recorder), dtype=float)
+        # Biogeme reports the parameters in alphabetical order
+        names = sorted(recorder)
+
+        X = np.empty(offset.shape + (len(names),))
+        for k, name in enumerate(names):
+            unit = dict.fromkeys(names, 0.0)
+            unit[name] = 1.0
+            X[..., k] = np.asarray(self._calculate_utilities(unit), dtype=float) - offset
+
+        # Check linearity at an arbitrary point
+        point = dict(zip(names, np.linspace(-1.0, 1.0, len(names))))
+        expected = offset + X @ np.array(list(point.values()))
+        actual = np.asarray(self._calculate_utilities(point), dtype=float)
+        if not np.allclose(actual, expected, rtol=1e-5, atol=1e-6 * (1 + np.abs(expected).max())):
+            raise ValueError(f"The numpy backend requires utilities that are linear in the "
+                             f"parameters, which is not the case for {type(self).__name__}")
+        return names, X, offset
+
+    def _specification_columns(self):
+        """
+        Get the data columns the specification depends on.
+
+        These are the columns _calculate_utilities reads, which the Biogeme
+        utilities of the model also use, plus the availability and choice
+        columns.
+
+        Returns:
+            List of column names
+        """
+        data = self.database.data
+        recorder = _ColumnRecorder(data)
+        self.database.data = recorder
+        try:
+            self._calculate_utilities(_ParameterRecorder())
+        finally:
+            self.database.data = data
+        return list(dict.fromkeys(recorder.columns + list(self.availability_columns or []) +
+                                  [self.choice_column]))
+
+    def _collapse_duplicates(self):
+        """
+        Replace the data by its unique rows, weighted by their frequencies.
+
+        Rows that are identical on every column of the specification have the
+        same log likelihood, so the estimates, log likelihood and fit
+        statistics are those of the full data. Called by the model families
+        once their variables are defined.
+        """
+        if not self.frequency_weights:
+            raise ValueError(f"{type(self).__name__} does not support collapsed data")
+        n_rows = len(self.database.data)
+        data, self.frequencies = collapse_duplicates(self.database.data,
+                                                     self._specification_columns())
+        data[FREQUENCY_COLUMN] = self.frequencies
+        self.database = Database('choice_model', data)
+        self.logger.info(f"Collapsed {n_rows} observations into {len(data)} unique rows")
+
+    def _subset(self, rows, frequencies=None):
+        """
+        Create a shallow copy of the model on some rows of its data.
+
+        The copy shares the specification and results of the model, and
+        gets its own database, so it can be re-estimated or evaluated
+        without touching the model.
+
+        Args:
+            rows: Positions of the rows to keep
+            frequencies: Number of observations each kept row stands for
+                (None if each row is one observation)
+
+        Returns:
+            BaseDiscreteChoiceModel on the selected rows
+        """
+        model = copy.copy(self)
+        data = self.database.data.iloc[rows].reset_index(drop=True)
+        if frequencies is not None:
+            frequencies = np.asarray(frequencies)
+            data[FREQUENCY_COLUMN] = frequencies
+        model.database = Database('choice_model', data)
+        model.frequencies = frequencies
+        return model
+
+    def _weighted(self, logprob):
+        """Get the Biogeme formulas of logprob, weighted by the row frequencies if collapsed."""
+        if self.frequencies is None:
+            return logprob
+        return {'log_like': logprob, 'weight': Variable(FREQUENCY_COLUMN)}
+
+    def _prepare_biogeme(self, biogeme, av):
+        """
+        Set the starting values and calculate the null log likelihood of a Biogeme model.
+
+        Biogeme ignores the weights in calculate_null_loglikelihood, so the
+        rows of collapsed data are weighted here.
+
+        Args:
+            biogeme: BIOGEME object of the model
+            av: Availability expression of each alternative
+        """
+        if self.start_values is not None:
+            biogeme.change_init_values(self.start_values)
+        if self.frequencies is None:
+            return biogeme.calculate_null_loglikelihood(av)
+        expression = Variable(FREQUENCY_COLUMN) * -log(bioMultSum(av))
+        biogeme.nullLogLike = expression.get_value_c(database=self.database, aggregation=True,
+                                                     prepare_ids=True)
+        return biogeme.nullLogLike
+
+    def _estimate_numpy(self, model_name, nests=None, random_coefficients=None):
+        """
+        Estimate the model with the native NumPy engine.
+
+        Mixed logit models are simulated with the model's number_of_draws and
+        draw_type, or integrated over its n_nodes quadrature nodes when its
+        integration is 'quadrature', with draws per respondent when its
+        panel attribute is set.
+
+        Args:
+            model_name: Name reported in the results
+            nests: Biogeme NestsForNestedLogit of a nested logit model (None
+                for a multinomial logit model)
+            random_coefficients: RandomCoefficient of each normal coefficient
+                of a mixed logit model
+
+        Returns:
+            EstimationResults with the Biogeme results interface
+        """
+        from ..engine.mixed import estimate_mixed_logit
+        from ..engine.mnl import estimate_mnl
+        from ..engine.nested import NestParameter, estimate_nested_logit, nest_specification_from_biogeme
+
+        names, X, offset = self._linear_utility_design()
+        column = {alt: j for j, alt in enumerate(self.alternatives)}
+        choices = self.database.data[self.choice_column].map(column)
+        if choices.isna().any():
+            raise ValueError(f"{self.choice_column} holds values that are not in {self.alternatives}")
+        choices = choices.to_numpy(dtype=int)
+        beta0 = None
+        if self.start_values is not None:
+            beta0 = [self.start_values.get(name, 0.0) for name in names]
+
+        if random_coefficients is not None:
+            if self.frequencies is not None:
+                raise ValueError("Mixed logit models cannot be estimated on collapsed data")
+            panel = self._get_panel_ids() if getattr(self, 'panel', False) else None
+            n_individuals = len(choices) if panel is None else panel.max() + 1
+            draws, draw_weights = self._simulation_draws(n_individuals, len(random_coefficients))
+            if beta0 is not None:
+                beta0 += [self.start_values.get(rc.spread, rc.init) for rc in random_coefficients]
+            return estimate_mixed_logit(X, choices, random_coefficients, self._get_availability(),
+                                        names=names, offset=offset, model_name=model_name,
+                                        draws=draws, draw_weights=draw_weights, panel=panel,
+                                        beta0=beta0)
+        if nests is None:
+            return estimate_mnl(X, choices, self._get_availability(), names=names,
+                                offset=offset, frequencies=self.frequencies,
+                                beta0=beta0, model_name=model_name)
+        nests = nest_specification_from_biogeme(nests, self.alternatives)
+        if beta0 is not None:
+            mus = {mu.name: mu for mu, _ in nests if isinstance(mu, NestParameter)}
+            beta0 += [self.start_values.get(mu.name, mu.init) for mu in mus.values()]
+        return estimate_nested_logit(X, choices, nests, self._get_availability(), names=names,
+                                     offset=offset, frequencies=self.frequencies,
+                                     beta0=beta0, model_name=model_name)
+
+    def _simulation_draws(self, n_individuals, n_random):
+        """
+        Get the draws of the native mixed logit engine.
+
+        Args:
+            n_individuals: Number of individuals (observations without panel)
+            n_random: Number of random coefficients
+
+        Returns:
+            Tuple of (P x R x L standard normal draws, weights of the R draws
+            or None for equal weights): the model's number_of_draws draws of
+            draw_type, or its n_nodes quadrature nodes and weights when its
+            integration is 'quadrature'
+        """
+        from ..engine.draws import normal_draws
+        from ..engine.integration import gauss_hermite_normal
+
+        if getattr(self, 'integration', 'montecarlo') == 'quadrature':
+            if n_random != 1:
+                raise ValueError("Quadrature requires a single random coefficient")
+            nodes, weights = gauss_hermite_normal(self.n_nodes)
+            return np.broadcast_to(nodes[:, np.newaxis], (n_individuals, len(nodes), 1)), weights
+        # One independent sequence per random coefficient
+        draws = np.stack([normal_draws(self.draw_type, n_individuals, self.number_of_draws,
+                                       DRAW_SEED + l)
+                          for l in range(n_random)], axis=2)
+        return draws, None
+
+    def _observation_draws(self):
+        """
+        Get the draws of the native mixed logit engine for each observation.
+
+        Returns:
+            Tuple of (N x R x L draws, shared by the observations of a
+            respondent with panel data; weights of the R draws or None)
+        """
+        panel = self._get_panel_ids() if getattr(self, 'panel', False) else None
+        n_individuals = len(self.database.data) if panel is None else panel.max() + 1
+        draws, draw_weights = self._simulation_draws(n_individuals, len(self.random_coefficients))
+        return (draws if panel is None else draws[panel]), draw_weights
+
+    def _random_attributes(self):
+        """Get the L x N x J attributes multiplied by the random coefficients of a mixed logit model."""
+        zero = _ParameterRecorder()
+        zero_utilities = np.asarray(self._calculate_utilities(zero), dtype=float)
+        return np.stack([
+            np.asarray(self._calculate_utilities(_ParameterRecorder({coefficient.mean: 1.0})),
+                       dtype=float) - zero_utilities
+            for coefficient in self.random_coefficients])
+
+    def _random_gradients(self, columns):
+        """
+        Get the derivatives of the random attributes with respect to data columns.
+
+        The attributes multiplied by each random coefficient are obtained by
+        switching on its mean parameter, and their derivatives by shifting
+        the columns.
+
+        Args:
+            columns: Data columns read by _calculate_utilities
+
+        Returns:
+            np.ndarray: L x N x J x K derivatives
+        """
+        zero = _ParameterRecorder()
+        zero_utilities = np.asarray(self._calculate_utilities(zero), dtype=float)
+        gradients = np.zeros((len(self.random_coefficients),) + zero_utilities.shape + (len(columns),))
+        for l, coefficient in enumerate(self.random_coefficients):
+            unit = _ParameterRecorder({coefficient.mean: 1.0})
+            unit_utilities = np.asarray(self._calculate_utilities(unit), dtype=float)
+            for k, column in enumerate(columns):
+                gradients[l, ..., k] = ((self._shifted_utilities(unit, {column: 1.0}) - unit_utilities) -
+                                        (self._shifted_utilities(zero, {column: 1.0}) - zero_utilities))
+        return gradients
+
+    def _simulated_probabilities(self, betas):
+        """
+        Simulate the mixed logit probabilities over the draws of the native engine.
+
+        The logit kernel is evaluated in blocks of rows sized to the memory
+        budget of the engine.
+
+        Args:
+            betas: Parameter values, including the standard deviations
+
+        Returns:
+            Tuple of (N x J probabilities, N x R log kernel probabilities of
+            the chosen alternatives, normalized weights of the R draws)
+        """
+        from ..engine.mixed import DEFAULT_MEMORY_BUDGET, kernel_utilities
+
+        utilities = np.asarray(self._calculate_utilities(betas), dtype=float)
+        random_attributes = self._random_attributes()
+        availability = self._get_availability()
+        spreads = np.array([betas[coefficient.spread] for coefficient in self.random_coefficients])
+        draws, draw_weights = self._observation_draws()
+        n_obs, n_alternatives = utilities.shape
+        n_draws = draws.shape[1]
+        draw_weights = (np.full(n_draws, 1.0 / n_draws) if draw_weights is None
+                        else np.asarray(draw_weights, dtype=float) / np.sum(draw_weights))
+        column = {alt: j for j, alt in enumerate(self.alternatives)}
+        chosen = np.array([column[choice] for choice in self.database.data[self.choice_column]])
+
+        probabilities = np.empty((n_obs, n_alternatives))
+        log_kernel = np.empty((n_obs, n_draws))
+        block = max(1, DEFAULT_MEMORY_BUDGET // (8 * n_draws * n_alternatives * 4))
+        for start in range(0, n_obs, block):
+            rows = slice(start, min(start + block, n_obs))
+            kernel = logit_probabilities(
+                kernel_utilities(utilities[rows], random_attributes[:, rows], spreads, draws[rows]),
+                availability[rows, np.newaxis])
+            probabilities[rows] = np.einsum('nrj,r->nj', kernel, draw_weights)
+            with np.errstate(divide='ignore'):
+                log_kernel[rows] = np.log(kernel[np.arange(rows.stop - rows.start), :, chosen[rows]])
+        return probabilities, log_kernel, draw_weights
+
+    def _get_panel_ids(self):
+        """Get the respondent number (0..P-1) of each row from panel_column."""
+        if self.panel_column is None:
+            raise ValueError(f"{type(self).__name__} does not define a panel_column")
+        columns = [self.panel_column] if isinstance(self.panel_column, str) else list(self.panel_column)
+        return self.database.data.groupby(columns, sort=False).ngroup().to_numpy()
+
+    def _panel_database(self):
+        """
+        Create a Biogeme database of the model's data declared as panel data.
+
+        The model's own database is left untouched, since Biogeme reorders
+        the rows of panel databases.
+
+        Returns:
+            Database with one PANEL_ID per respondent
+        """
+        data = self.database.data.assign(PANEL_ID=self._get_panel_ids())
+        database = Database('choice_model_panel', data)
+        database.panel('PANEL_ID')
+        return database
+
+    def _get_availability(self):
+        """Get the N x J availability matrix of the alternatives."""
+        n_obs = len(self.database.data)
+        if self.availability_columns is None:
+            return np.ones((n_obs, len(self.alternatives)), dtype=bool)
+        return self.database.data[self.availability_columns].to_numpy() != 0
+
+    def bootstrap(self, n_replicates=None, n_jobs=1, seed=None, output_file=None,
+                  resample_by=None, alpha=0.05):
+        """
+        Bootstrap the parameters, values of time and market shares.
+
+        Each replicate resamples the observations, or the units identified by
+        resample_by, with replacement and is re-estimated from the full-sample
+        estimates. The replicate statistics are kept in bootstrap_replicates.
+
+        Args:
+            n_replicates: Number of replicates (defaults to bootstrap_samples
+                of the parameter file)
+            n_jobs: Number of worker processes
+            seed: Seed of the resampling
+            output_file: Optional CSV file streaming the replicate statistics
+            resample_by: Column, or list of columns, of the resampled units
+                (defaults to panel_column; an empty list resamples the rows)
+            alpha: Significance level of the percentile confidence intervals
+
+        Returns:
+            pd.DataFrame: Full-sample value, bootstrap standard error and
+            confidence interval of each statistic
+        """
+        from ..utils.bootstrap import bootstrap_model
+
+        return bootstrap_model(self, n_replicates=n_replicates, n_jobs=n_jobs, seed=seed,
+                               output_file=output_file, resample_by=resample_by, alpha=alpha)
+
+    def calculate_probabilities(self, betas=None):
+        """
+        Calculate the N x J matrix of choice probabilities.
+
+        The utilities from _calculate_utilities are turned into logit, or nested
+        logit if the model defines nests, probabilities without building a
+        Biogeme simulation.
+
+        Args:
+            betas: Parameter values to use (defaults to the estimated ones)
+
+        Returns:
+            np.ndarray: Choice probabilities, one column per alternative
+        """
+        if betas is None:
+            if self.results is None:
+                raise RuntimeError("Model must be estimated before calculating probabilities")
+            betas = self.results.get_beta_values()
+
+        utilities = self._calculate_utilities(betas)
+        availability = self._get_availability()
+
+        nests = getattr(self, 'nests', None)
+        if nests is not None:
+            return nested_logit_probabilities(
+                utilities, nests_from_biogeme(nests, self.alternatives, betas), availability)
+        return logit_probabilities(utilities, availability)
+
+    def _shifted_utilities(self, betas, shifts):
+        """Calculate the utilities with data columns shifted by the given amounts ({column: shift})."""
+        data = self.database.data
+        self.database.data = data.assign(**{column: data[column] + shift
+                                            for column, shift in shifts.items()})
+        try:
+            return np.asarray(self._calculate_utilities(betas), dtype=float)
+        finally:
+            self.database.data = data
+
+    def _scenario_terms(self, betas, columns):
+        """
+        Get the baseline utilities and the utility terms of data columns.
+
+        The derivative of the utilities with respect to a column is obtained
+        by shifting it, and the terms are cached with the baseline utilities
+        for the parameters and data they were computed on, so repeated
+        scenarios (e.g. elasticity curves) only compute the probabilities.
+        The utilities must be affine in the columns, without interactions
+        between them, which is checked at an arbitrary joint shift.
+
+        Args:
+            betas: Parameter values
+            columns: Data columns read by _calculate_utilities
+
+        Returns:
+            Tuple of (N x J baseline utilities, dict of the AttributeTerm of
+            each column)
+        """
+        from ..engine.scenarios import attribute_term
+
+        data = self.database.data
+        key = tuple(sorted(betas.items()))
+        cache = self._scenario_cache
+        if cache is None or cache['data'] is not data or cache['betas'] != key:
+            cache = self._scenario_cache = {
+                'data': data,
+                'betas': key,
+                'base': np.asarray(self._calculate_utilities(betas), dtype=float),
+                'terms': {},
+            }
+        base, terms = cache['base'], cache['terms']
+
+        missing = [column for column in columns if column not in terms]
+        if missing:
+            recorder = _ColumnRecorder(data)
+            self.database.data = recorder
+            try:
+                self._calculate_utilities(betas)
+            finally:
+                self.database.data = data
+            unused = [column for column in missing if column not in recorder.columns]
+            if unused:
+                raise ValueError(f"Columns {unused} do not enter the utilities of {type(self).__name__}")
+            for column in missing:
+                terms[column] = attribute_term(self._shifted_utilities(betas, {column: 1.0}) - base,
+                                               data[column].to_numpy(dtype=float))
+
+        # Check that the utilities are affine in the columns at an arbitrary shift
+        shifts = np.linspace(0.5, 2.0, len(columns))
+        expected = base.copy()
+        for column, shift in zip(columns, shifts):
+            expected[:, terms[column].alternatives] += shift * terms[column].gradient
+        actual = self._shifted_utilities(betas, dict(zip(columns, shifts)))
+        if not np.allclose(actual, expected, rtol=1e-5, atol=1e-6 * (1 + np.abs(expected).max())):
+            raise ValueError(f"Scenarios require utilities that are affine in the modified "
+                             f"columns, which is not the case for {type(self).__name__}")
+        return base, {column: terms[column] for column in columns}
+
+    def simulate_scenarios(self, scenarios, betas=None):
+        """
+        Predict the market shares of what-if scenarios.
+
+        All scenarios are evaluated in one vectorized pass from the baseline
+        utilities, without copying the data or building Biogeme simulations:
+        each modification updates only the utilities of the alternatives its
+        column enters. Probabilities are logit or nested logit, and mixed
+        logit ones are simulated over the draws of the native engine, as in
+        calibrate_constants.
+
+        Args:
+            scenarios: List of mcbs.engine.Scenario, each a name and a list of
+                Modification(column, multiplier, shift) of the model's data
+            betas: Parameter values to use (defaults to the estimated ones)
+
+        Returns:
+            pd.DataFrame: Market shares, one row per scenario and one column
+            per alternative
+        """
+        from ..engine.scenarios import attribute_term, scenario_columns, scenario_shares
+
+        if betas is None:
+            if self.results is None:
+                raise RuntimeError("Model must be estimated before simulating scenarios")
+            betas = self.results.get_beta_values()
+
+        columns = scenario_columns(scenarios)
+        base, terms = self._scenario_terms(betas, columns)
+        nests = getattr(self, 'nests', None)
+        if nests is not None:
+            nests = nests_from_biogeme(nests, self.alternatives, betas)
+
+        mixing = {}
+        if self.random_coefficients is not None:
+            draws, draw_weights = self._observation_draws()
+            mixing = {
+                'random_attributes': self._random_attributes(),
+                'random_terms': [{column: attribute_term(gradients[..., k], terms[column].values)
+                                  for k, column in enumerate(columns)}
+                                 for gradients in self._random_gradients(columns)],
+                'spreads': np.array([betas[coefficient.spread]
+                                     for coefficient in self.random_coefficients]),
+                'draws': draws,
+                'draw_weights': draw_weights,
+            }
+
+        shares = scenario_shares(base, terms, scenarios, availability=self._get_availability(),
+                                 nests=nests, weights=self.frequencies, **mixing)
+        return pd.DataFrame(shares, index=pd.Index([scenario.name for scenario in scenarios],
+                                                   name='scenario'),
+                            columns=self.alternatives)
+
+    def compute_elasticities(self, attribute, alternative=None, betas=None):
+        """
+        Calculate the elasticities of the choice probabilities with respect to an attribute.
+
+        The elasticities are the closed-form ones of the logit and nested
+        logit models, and are simulated with the draws of the native engine
+        for mixed logit models, for all observations at once.
+
+        Args:
+            attribute: Data column of the attribute, or dict mapping
+                alternatives to their column of the attribute (e.g.
+                {1: 'TRAIN_COST', 2: 'CAR_COST', 3: 'BUS_COST', 4: 'AIR_COST'})
+                for the full J x J table
+            alternative: Alternative a single column belongs to (defaults to
+                the alternative whose utility it enters)
+            betas: Parameter values to use (defaults to the estimated ones)
+
+        Returns:
+            Dict with the N x J x K disaggregate elasticities of the J
+            probabilities with respect to the K columns ('disaggregate', NaN
+            for unavailable alternatives) and the probability-weighted
+            aggregate elasticities ('aggregate', a DataFrame with one row per
+            alternative whose probability changes and one column per
+            alternative whose attribute changes, so that the direct
+            elasticities are where they coincide)
+        """
+        from ..engine.elasticities import (aggregate_elasticities, logit_elasticities,
+                                           nested_logit_elasticities)
+
+        if betas is None:
+            if self.results is None:
+                raise RuntimeError("Model must be estimated before computing elasticities")
+            betas = self.results.get_beta_values()
+
+        if isinstance(attribute, dict):
+            columns = dict(attribute)
+        else:
+            if alternative is None:
+                entered = self._scenario_terms(betas, [attribute])[1][attribute].alternatives
+                if len(entered) != 1:
+                    raise ValueError(f"{attribute} enters the utilities of {len(entered)} "
+                                     f"alternatives; pass the alternative it belongs to")
+                alternative = self.alternatives[entered[0]]
+            columns = {alternative: attribute}
+
+        names = list(columns.values())
+        utilities, terms = self._scenario_terms(betas, names)
+        gradients = np.zeros(utilities.shape + (len(names),))
+        for k, name in enumerate(names):
+            gradients[:, terms[name].alternatives, k] = terms[name].gradient
+        values = np.column_stack([terms[name].values for name in names])
+        availability = self._get_availability()
+
+        nests = getattr(self, 'nests', None)
+        if self.random_coefficients is not None:
+            probabilities, elasticities = self._mixed_elasticities(
+                betas, utilities, gradients, values, names, availability)
+        elif nests is not None:
+            probabilities, elasticities = nested_logit_elasticities(
+                utilities, nests_from_biogeme(nests, self.alternatives, betas),
+                gradients, values, availability)
+        else:
+            probabilities = logit_probabilities(utilities, availability)
+            elasticities = logit_elasticities(probabilities, gradients, values)
+
+        aggregate = aggregate_elasticities(probabilities, elasticities, self.frequencies)
+        return {
+            'disaggregate': elasticities,
+            'aggregate': pd.DataFrame(aggregate,
+                                      index=pd.Index(self.alternatives, name='probability'),
+                                      columns=pd.Index(list(columns), name='attribute')),
+        }
+
+    def _mixed_elasticities(self, betas, utilities, gradients, values, columns, availability):
+        """
+        Simulate the mixed logit probabilities and elasticities.
+
+        The draws are those of the native estimator.
+
+        Args:
+            betas: Parameter values, including the standard deviations
+            utilities: N x J utilities at the mean coefficients
+            gradients: N x J x K derivatives of the utilities with respect to the columns
+            values: N x K values of the columns
+            columns: Names of the K columns
+            availability: N x J availability matrix
+
+        Returns:
+            Tuple of (N x J probabilities, N x J x K elasticities)
+        """
+        from ..engine.elasticities import mixed_logit_elasticities
+
+        draws, draw_weights = self._observation_draws()
+        spreads = np.array([betas[coefficient.spread] for coefficient in self.random_coefficients])
+        return mixed_logit_elasticities(utilities, gradients, values, self._random_attributes(),
+                                        self._random_gradients(columns), spreads, draws,
+                                        draw_weights, availability)
+
+    def _alternative_constants(self):
+        """
+        Find the alternative specific constants of the utilities.
+
+        A constant is a parameter that enters the utility of a single
+        alternative with coefficient one in every row.
+
+        Returns:
+            Dict mapping alternatives to the name of their constant
+        """
+        zero = _ParameterRecorder()
+        zero_utilities = np.asarray(self._calculate_utilities(zero), dtype=float)
+        constants = {}
+        for name in sorted(zero):
+            unit = _ParameterRecorder({name: 1.0})
+            attribute = np.asarray(self._calculate_utilities(unit), dtype=float) - zero_utilities
+            entered = np.flatnonzero(np.any(attribute != 0, axis=0))
+            if len(entered) == 1 and np.allclose(attribute[:, entered[0]], 1.0):
+                constants.setdefault(self.alternatives[entered[0]], name)
+        return constants
+
+    def calibrate_constants(self, target_shares=None, constants=None, betas=None,
+                            tolerance=1e-10, max_iter=50):
+        """
+        Calibrate the alternative specific constants to reproduce market shares.
+
+        The utilities without the constants are computed once, and the
+        constants solve the share equations by Newton's method with the
+        analytic Jacobian of the logit, nested logit or mixed logit (over
+        the fixed draws of the native engine) shares.
+
+        Args:
+            target_shares: Dict mapping alternatives to their target share
+                (defaults to the observed shares of the model's data)
+            constants: Dict mapping alternatives to the name of their
+                constant (defaults to the parameters found in the utilities);
+                one alternative without a constant is enough to identify them
+            betas: Parameter values to start from (defaults to the estimated ones)
+            tolerance: Largest absolute share error at convergence
+            max_iter: Maximum number of Newton iterations
+
+        Returns:
+            Dict of parameter values with the calibrated constants
+        """
+        from ..engine.calibration import calibrate_constants
+
+        if betas is None:
+            if self.results is None:
+                raise RuntimeError("Model must be estimated before calibrating constants")
+            betas = self.results.get_beta_values()
+        betas = dict(betas)
+
+        if target_shares is None:
+            choices = self.database.data[self.choice_column].to_numpy()
+            weights = (np.ones(len(choices)) if self.frequencies is None
+                       else np.asarray(self.frequencies, dtype=float))
+            target_shares = {alt: weights[choices == alt].sum() / weights.sum()
+                             for alt in self.alternatives}
+        if constants is None:
+            constants = self._alternative_constants()
+        column = {alt: j for j, alt in enumerate(self.alternatives)}
+        calibrated = [alt for alt in self.alternatives if alt in constants]
+
+        # Utilities without the calibrated constants
+        fixed = dict(betas, **{constants[alt]: 0.0 for alt in calibrated})
+        utilities = np.asarray(self._calculate_utilities(_ParameterRecorder(fixed)), dtype=float)
+        mixing = {}
+        if self.random_coefficients is not None:
+            draws, draw_weights = self._observation_draws()
+            spreads = np.array([betas[coefficient.spread] for coefficient in self.random_coefficients])
+            mixing = {'random_attributes': self._random_attributes(), 'spreads': spreads,
+                      'draws': draws, 'draw_weights': draw_weights}
+
+        nests = getattr(self, 'nests', None)
+        if nests is not None:
+            nests = nests_from_biogeme(nests, self.alternatives, betas)
+
+        result = calibrate_constants(
+            utilities, np.array([target_shares[alt] for alt in self.alternatives]),
+            [column[alt] for alt in calibrated],
+            constants=[betas.get(constants[alt], 0.0) for alt in calibrated],
+            availability=self._get_availability(), nests=nests, weights=self.frequencies,
+            tolerance=tolerance, max_iter=max_iter, **mixing)
+
+        max_error = max(abs(result.shares[column[alt]] - target_shares[alt]) for alt in self.alternatives)
+        if result.converged:
+            self.logger.info(f"Calibrated {len(calibrated)} constants in {result.iterations} "
+                             f"Newton iterations (max share error {max_error:.1e})")
+        else:
+            self.logger.warning(f"Constants did not converge in {max_iter} Newton iterations "
+                                f"(max share error {max_error:.1e})")
+        betas.update({constants[alt]: float(value) for alt, value in zip(calibrated, result.constants)})
+        return betas
+
+    def evaluate(self, betas=None, holdout=False):
+        """
+        Evaluate parameters on the model's data or on the holdout data.
+
+        Mixed logit models are evaluated with the simulated likelihood they
+        are estimated with, over the draws of the native engine: the
+        probabilities are averaged over the draws, and with panel data the
+        log likelihood is that of each respondent's sequence of choices.
+
+        Args:
+            betas: Parameter values (defaults to the estimated ones)
+            holdout: Whether to evaluate on test_data instead of the
+                estimation data
+
+        Returns:
+            Dict with the log likelihood (test_ll), the log likelihood per
+            observation, the choice accuracy and the market share accuracy
+        """
+        from ..engine.probabilities import logsumexp
+        from ..utils.metrics import calculate_choice_metrics
+
+        if holdout:
+            if self.test_database is None:
+                raise ValueError("No holdout data: pass test_data to the model")
+            model = copy.copy(self)
+            model.database = self.test_database
+            model.frequencies = None
+            return model.evaluate(betas)
+
+        if betas is None:
+            if self.results is None:
+                raise RuntimeError("Model must be estimated before evaluating it")
+            betas = self.results.get_beta_values()
+        choices = self.database.data[self.choice_column].to_numpy()
+        weights = (np.ones(len(choices)) if self.frequencies is None
+                   else np.asarray(self.frequencies, dtype=float))
+
+        if self.random_coefficients is not None:
+            probabilities, log_kernel, draw_weights = self._simulated_probabilities(betas)
+            if getattr(self, 'panel', False):
+                # Product of the kernels of each respondent's choices
+                panel = self._get_panel_ids()
+                respondent_kernel = np.zeros((panel.max() + 1, log_kernel.shape[1]))
+                np.add.at(respondent_kernel, panel, log_kernel)
+                log_kernel = respondent_kernel
+            with np.errstate(divide='ignore'):
+                loglike = float(logsumexp(log_kernel + np.log(draw_weights)).sum())
+        else:
+            probabilities = self.calculate_probabilities(betas)
+            column = {alt: j for j, alt in enumerate(self.alternatives)}
+            chosen = probabilities[np.arange(len(choices)), [column[choice] for choice in choices]]
+            with np.errstate(divide='ignore'):
+                loglike = float(weights @ np.log(chosen))
+
+        metrics = calculate_choice_metrics(probabilities, choices, self.alternatives,
+                                           weights=self.frequencies)
+        return {
+            'test_ll': loglike,
+            'test_ll_per_obs': float(loglike / weights.sum()),
+            'choice_accuracy': float(metrics['choice_accuracy']),
+            'market_share_accuracy': float(metrics['market_share_accuracy']),
+        }
+
+    def calculate_choice_accuracy(self, probabilities=None):
+        """
+        Calculate individual choice prediction accuracy and market shares.
+
+        Args:
+            probabilities: N x J choice probabilities (defaults to calculate_probabilities())
+        """
+        from ..utils.metrics import calculate_choice_metrics
+
+        if self.results is None:
+            raise RuntimeError("Model must be estimated before calculating accuracy")
+
+        if probabilities is None:
+            probabilities = self.calculate_probabilities()
+        choices = self.database.data[self.choice_column].to_numpy()
+        metrics = calculate_choice_metrics(probabilities, choices, self.alternatives,
+                                           weights=self.frequencies)
+
+        self.actual_shares = dict(zip(self.alternatives, metrics['actual_shares'].tolist()))
+        self.predicted_shares = dict(zip(self.alternatives, metrics['predicted_shares'].tolist()))
+        self.market_share_accuracy = float(metrics['market_share_accuracy'])
+
+        print("\nMarket Shares:")
+        print("Mode      Actual    Predicted")
+        print("-" * 30)
+        for i in self.alternatives:
+            print(f"{i:4d}     {self.actual_shares[i]:.3f}     {self.predicted_shares[i]:.3f}")
+        print(f"\nMarket Share Accuracy: {self.market_share_accuracy:.3f}")
+
+        # Every alternative gets a row and a column, even if never chosen or predicted
+        self.confusion_matrix = pd.DataFrame(
+            metrics['confusion_matrix'],
+            index=pd.Index(self.alternatives, name='Actual'),
+            columns=pd.Index(self.alternatives, name='Predicted')
+        )
+        self.choice_accuracy = float(metrics['choice_accuracy'])
+
+        print("\nConfusion Matrix:")
+        print(self.confusion_matrix)
+        print(f"\nChoice Prediction Accuracy: {self.choice_accuracy:.3f}")
+
+    # Nested models share the same calculation; the engine applies the nests
+    calculate_choice_accuracy_nest = calculate_choice_accuracy
+
     def get_metrics(self):
         """Get standard metrics for model comparison."""
         if self.results is None:
@@ -42,7 +1045,8 @@ class BaseDiscreteChoiceModel(ABC):
             
         metrics = {
             'n_parameters': len(self.results.data.betaValues),
-            'n_observations': self.results.data.numberOfObservations,
+            'n_observations': (self.results.data.numberOfObservations if self.frequencies is None
+                               else int(self.frequencies.sum())),
         }
         
         # Add model statistics and VOT metrics
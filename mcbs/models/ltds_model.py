@@ -22,14 +22,27 @@ import pandas as pd
 
 class BaseLTDSModel(BaseDiscreteChoiceModel):
     """Base class for LTDS models with shared initialization."""
+
+    # 1: Walking, 2: Cycling, 3: PT, 4: Driving (all modes always available)
+    alternatives = [1, 2, 3, 4]
+    choice_column = 'travel_mode'
+
+    # Trips of the same person (household_id, person_n) share their tastes
+    panel_column = ['household_id', 'person_n']
     
-    def __init__(self, data):
-        # Encode categorical variables before creating database
-        data = self._encode_categorical_variables(data)
-        super().__init__(data)
+    def __init__(self, data, backend=None, collapse=None, test_data=None):
+        super().__init__(data, backend=backend, collapse=collapse, test_data=test_data)
         self._initialize_variables()
+        if self.collapse_duplicates:
+            self._collapse_duplicates()
+
+    @classmethod
+    def _preprocess_data(cls, data):
+        """Encode the categorical variables of raw data."""
+        return cls._encode_categorical_variables(data)
 
-    def _encode_categorical_variables(self, df):
+    @classmethod
+    def _encode_categorical_variables(cls, df):
         """
         Encode categorical variables according to LTDS dataset specifications.
         
@@ -39,8 +52,9 @@ class BaseLTDSModel(BaseDiscreteChoiceModel):
         Returns:
         pandas.DataFrame: DataFrame with encoded categorical variables
         """
-        # Create a copy to avoid modifying the original
-        df_encoded = df.copy()
+        # Shallow copy: columns are replaced rather than written in place, so
+        # the caller's frame is left untouched without copying its data
+        df_encoded = df.copy(deep=False)
         
         # Travel mode encoding
         mode_mapping = {
@@ -80,18 +94,44 @@ class BaseLTDSModel(BaseDiscreteChoiceModel):
         
         # Apply the mappings
         if 'travel_mode' in df.columns:
-            df_encoded['travel_mode'] = df['travel_mode'].map(mode_mapping)
+            df_encoded['travel_mode'] = cls._encode_column(df['travel_mode'], mode_mapping)
         
         if 'purpose' in df.columns:
-            df_encoded['purpose'] = df['purpose'].map(purpose_mapping)
+            df_encoded['purpose'] = cls._encode_column(df['purpose'], purpose_mapping)
         
         if 'fueltype' in df.columns:
-            df_encoded['fueltype'] = df['fueltype'].map(fueltype_mapping)
+            df_encoded['fueltype'] = cls._encode_column(df['fueltype'], fueltype_mapping)
         
         if 'faretype' in df.columns:
-            df_encoded['faretype'] = df['faretype'].map(faretype_mapping)
+            df_encoded['faretype'] = cls._encode_column(df['faretype'], faretype_mapping)
         
         return df_encoded
+
+    @staticmethod
+    def _encode_column(series, mapping):
+        """
+        Encode a categorical column with a mapping from labels to integer codes.
+
+        Categorical columns (as produced by the dataset loader's dtype schema)
+        are encoded by looking up their codes instead of mapping every row.
+
+        Parameters:
+        series (pandas.Series): Column with labels, as strings or a pandas categorical
+        mapping (dict): Label to code mapping
+
+        Returns:
+        pandas.Series: Encoded column (NaN for labels not in the mapping)
+        """
+        if not isinstance(series.dtype, pd.CategoricalDtype):
+            return series.map(mapping)
+
+        lookup = np.array([mapping.get(label, np.nan) for label in series.cat.categories], dtype=float)
+        codes = series.cat.codes.to_numpy()
+        encoded = np.where(codes >= 0, lookup[codes], np.nan)
+        if np.isnan(encoded).any():
+            return pd.Series(encoded, index=series.index, name=series.name)
+        dtype = np.int8 if np.abs(encoded).max() <= np.iinfo(np.int8).max else np.int64
+        return pd.Series(encoded.astype(dtype), index=series.index, name=series.name)
         
     def _initialize_variables(self):
         """Initialize all variables needed for LTDS models."""
@@ -116,199 +156,6 @@ class BaseLTDSModel(BaseDiscreteChoiceModel):
         print("\nMode choice distribution:")
         print(self.database.data['travel_mode'].value_counts())
 
-    def calculate_choice_accuracy(self):
-        """Calculate individual choice prediction accuracy and market shares."""
-        if not hasattr(self, 'results'):
-            raise RuntimeError("Model must be estimated before calculating accuracy")
-            
-        # Get utility functions for simulation
-        V1 = self._get_utility_function(1)
-        V2 = self._get_utility_function(2)
-        V3 = self._get_utility_function(3)
-        V4 = self._get_utility_function(4)
-        
-        # Associate utility functions with alternatives
-        V = {1: V1, 2: V2, 3: V3, 4: V4}
-        
-        # Associate availability conditions (assuming all modes available)
-        av = {1: 1, 2: 1, 3: 1, 4: 1}
-        
-        # Calculate choice probabilities
-        prob_walk = models.logit(V, av, 1)
-        prob_cycle = models.logit(V, av, 2)
-        prob_pt = models.logit(V, av, 3)
-        prob_drive = models.logit(V, av, 4)
-        
-        # Setup simulation
-        simulate = {
-            'Prob. walk': prob_walk,
-            'Prob. cycle': prob_cycle,
-            'Prob. PT': prob_pt,
-            'Prob. drive': prob_drive
-        }
-        
-        # Run simulation
-        biogeme = bio.BIOGEME(self.database, simulate)
-        biogeme.modelName = "choice_prediction"
-        simulatedValues = biogeme.simulate(self.results.get_beta_values())
-        
-        # Calculate market shares
-        actual_counts = self.database.data['travel_mode'].value_counts()
-        total = len(self.database.data)
-        self.actual_shares = {i: actual_counts.get(i, 0) / total for i in [1, 2, 3, 4]}
-        
-        # Calculate predicted shares (mean probability for each alternative)
-        self.predicted_shares = {
-            1: simulatedValues['Prob. walk'].mean(),
-            2: simulatedValues['Prob. cycle'].mean(),
-            3: simulatedValues['Prob. PT'].mean(),
-            4: simulatedValues['Prob. drive'].mean()
-        }
-        
-        # Calculate market share accuracy
-        total_abs_error = sum(abs(self.actual_shares[i] - self.predicted_shares[i]) 
-                            for i in [1, 2, 3, 4])
-        self.market_share_accuracy = 1 - (total_abs_error / 2)
-        
-        print("\nMarket Shares:")
-        print("Mode      Actual    Predicted")
-        print("-" * 30)
-        for i in [1, 2, 3, 4]:
-            print(f"{i:4d}     {self.actual_shares[i]:.3f}     {self.predicted_shares[i]:.3f}")
-        print(f"\nMarket Share Accuracy: {self.market_share_accuracy:.3f}")
-        
-        # Calculate choice accuracy
-        prob_max = simulatedValues.idxmax(axis=1)
-        prob_max = prob_max.replace({
-            'Prob. walk': 1, 
-            'Prob. cycle': 2, 
-            'Prob. PT': 3, 
-            'Prob. drive': 4
-        })
-        
-        # Create confusion matrix
-        data_sim = {
-            'y_Actual': self.database.data['travel_mode'],
-            'y_Predicted': prob_max
-        }
-        df = pd.DataFrame(data_sim, columns=['y_Actual', 'y_Predicted'])
-        self.confusion_matrix = pd.crosstab(
-            df['y_Actual'], 
-            df['y_Predicted'], 
-            rownames=['Actual'], 
-            colnames=['Predicted']
-        )
-        
-        ### THIS IS A QUICK FIX AND NEED TO DO PROPERLY
-        self.confusion_matrix.insert(1, '2', 0)
-
-
-        # Calculate accuracy
-        self.choice_accuracy = (
-            np.diagonal(self.confusion_matrix.to_numpy()).sum() / 
-            self.confusion_matrix.to_numpy().sum()
-        )
-        
-        print("\nConfusion Matrix:")
-        print(self.confusion_matrix)
-        print(f"\nChoice Prediction Accuracy: {self.choice_accuracy:.3f}")
-
-    def calculate_choice_accuracy_nest(self):
-        """Calculate individual choice prediction accuracy and market shares for nested logit models."""
-        if not hasattr(self, 'results'):
-            raise RuntimeError("Model must be estimated before calculating accuracy")
-            
-        # Get utility functions for simulation
-        V1 = self._get_utility_function(1)
-        V2 = self._get_utility_function(2)
-        V3 = self._get_utility_function(3)
-        V4 = self._get_utility_function(4)
-        
-        # Associate utility functions with alternatives
-        V = {1: V1, 2: V2, 3: V3, 4: V4}
-        
-        # Associate availability conditions
-        av = {1: 1, 2: 1, 3: 1, 4: 1}
-        
-        # Calculate choice probabilities
-        prob_walk = models.nested(V, None, self.nests, 1)
-        prob_cycle = models.nested(V, None, self.nests, 2)
-        prob_pt = models.nested(V, None, self.nests, 3)
-        prob_drive = models.nested(V, None, self.nests, 4)
-        
-        # Setup simulation
-        simulate = {
-            'Prob. walk': prob_walk,
-            'Prob. cycle': prob_cycle,
-            'Prob. PT': prob_pt,
-            'Prob. drive': prob_drive
-        }
-        
-        # Run simulation
-        biogeme = bio.BIOGEME(self.database, simulate)
-        biogeme.modelName = "choice_prediction_nest"
-        simulatedValues = biogeme.simulate(self.results.get_beta_values())
-        
-        # Calculate market shares
-        actual_counts = self.database.data['travel_mode'].value_counts()
-        total = len(self.database.data)
-        self.actual_shares = {i: actual_counts.get(i, 0) / total for i in [1, 2, 3, 4]}
-        
-        # Calculate predicted shares (mean probability for each alternative)
-        self.predicted_shares = {
-            1: simulatedValues['Prob. walk'].mean(),
-            2: simulatedValues['Prob. cycle'].mean(),
-            3: simulatedValues['Prob. PT'].mean(),
-            4: simulatedValues['Prob. drive'].mean()
-        }
-        
-        # Calculate market share accuracy
-        total_abs_error = sum(abs(self.actual_shares[i] - self.predicted_shares[i]) 
-                            for i in [1, 2, 3, 4])
-        self.market_share_accuracy = 1 - (total_abs_error / 2)
-        
-        print("\nMarket Shares:")
-        print("Mode      Actual    Predicted")
-        print("-" * 30)
-        for i in [1, 2, 3, 4]:
-            print(f"{i:4d}     {self.actual_shares[i]:.3f}     {self.predicted_shares[i]:.3f}")
-        print(f"\nMarket Share Accuracy: {self.market_share_accuracy:.3f}")
-        
-        # Calculate choice accuracy
-        prob_max = simulatedValues.idxmax(axis=1)
-        prob_max = prob_max.replace({
-            'Prob. walk': 1, 
-            'Prob. cycle': 2, 
-            'Prob. PT': 3, 
-            'Prob. drive': 4
-        })
-        
-        # Create confusion matrix
-        data_sim = {
-            'y_Actual': self.database.data['travel_mode'],
-            'y_Predicted': prob_max
-        }
-        df = pd.DataFrame(data_sim, columns=['y_Actual', 'y_Predicted'])
-        self.confusion_matrix = pd.crosstab(
-            df['y_Actual'], 
-            df['y_Predicted'], 
-            rownames=['Actual'], 
-            colnames=['Predicted']
-        )
-        
-        ### THIS IS A QUICK FIX AND NEED TO DO PROPERLY
-        self.confusion_matrix.insert(1, '2', 0)
-
-        # Calculate accuracy
-        self.choice_accuracy = (
-            np.diagonal(self.confusion_matrix.to_numpy()).sum() / 
-            self.confusion_matrix.to_numpy().sum()
-        )
-        
-        print("\nConfusion Matrix:")
-        print(self.confusion_matrix)
-        print(f"\nChoice Prediction Accuracy: {self.choice_accuracy:.3f}")
-
 class MultinomialLogitModel_L(BaseLTDSModel):
     """Multinomial logit model implementation."""
     
@@ -354,18 +201,22 @@ class MultinomialLogitModel_L(BaseLTDSModel):
         # Associate availability conditions (assuming all modes available)
         av = {1: 1, 2: 1, 3: 1, 4: 1}
 
-        # Define and estimate the model
-        logprob = models.loglogit(V, av, self.CHOICE)
-        biogeme = bio.BIOGEME(self.database, logprob)
-        biogeme.modelName = "ltds_mnl"
+        if self.backend == 'numpy':
+            # Closed-form gradient and Hessian, no Biogeme expression evaluation
+            self.results = self._estimate_numpy("ltds_mnl")
+        else:
+            # Define and estimate the model
+            logprob = models.loglogit(V, av, self.CHOICE)
+            biogeme = bio.BIOGEME(self.database, self._weighted(logprob))
+            biogeme.modelName = "ltds_mnl"
         
-        # Enable HTML and Pickle generation
-        biogeme.generateHtml = True
-        biogeme.generatePickle = True
+            # Enable HTML and Pickle generation
+            biogeme.generateHtml = True
+            biogeme.generatePickle = True
         
-        # Calculate null log likelihood and estimate
-        biogeme.calculate_null_loglikelihood(av)
-        self.results = biogeme.estimate()
+            # Calculate null log likelihood and estimate
+            self._prepare_biogeme(biogeme, av)
+            self.results = biogeme.estimate()
         
         # Get general statistics
         stats = self.results.getGeneralStatistics()
@@ -494,18 +345,22 @@ class MultinomialLogitModelTotal_L(BaseLTDSModel):
         # Associate availability conditions (assuming all modes available)
         av = {1: 1, 2: 1, 3: 1, 4: 1}
 
-        # Define and estimate the model
-        logprob = models.loglogit(V, av, self.CHOICE)
-        biogeme = bio.BIOGEME(self.database, logprob)
-        biogeme.modelName = "ltds_mnl_total"
+        if self.backend == 'numpy':
+            # Closed-form gradient and Hessian, no Biogeme expression evaluation
+            self.results = self._estimate_numpy("ltds_mnl_total")
+        else:
+            # Define and estimate the model
+            logprob = models.loglogit(V, av, self.CHOICE)
+            biogeme = bio.BIOGEME(self.database, self._weighted(logprob))
+            biogeme.modelName = "ltds_mnl_total"
         
-        # Enable HTML and Pickle generation
-        biogeme.generateHtml = True
-        biogeme.generatePickle = True
+            # Enable HTML and Pickle generation
+            biogeme.generateHtml = True
+            biogeme.generatePickle = True
         
-        # Calculate null log likelihood and estimate
-        biogeme.calculate_null_loglikelihood(av)
-        self.results = biogeme.estimate()
+            # Calculate null log likelihood and estimate
+            self._prepare_biogeme(biogeme, av)
+            self.results = biogeme.estimate()
         
         # Get general statistics
         stats = self.results.getGeneralStatistics()
@@ -643,18 +498,22 @@ class NestedLogitModel_L(BaseLTDSModel):
         # Store nests for later use
         self.nests = nests
 
-        # Define and estimate the model
-        logprob = models.lognested(V, av, nests, self.CHOICE)
-        biogeme = bio.BIOGEME(self.database, logprob)
-        biogeme.modelName = "ltds_nl"
+        if self.backend == 'numpy':
+            # Analytic nested logit gradient, no Biogeme expression evaluation
+            self.results = self._estimate_numpy("ltds_nl", nests=nests)
+        else:
+            # Define and estimate the model
+            logprob = models.lognested(V, av, nests, self.CHOICE)
+            biogeme = bio.BIOGEME(self.database, self._weighted(logprob))
+            biogeme.modelName = "ltds_nl"
         
-        # Disable HTML and Pickle generation
-        biogeme.generateHtml = True
-        biogeme.generatePickle = True
+            # Disable HTML and Pickle generation
+            biogeme.generateHtml = True
+            biogeme.generatePickle = True
         
-        # Calculate null log likelihood and estimate
-        biogeme.calculate_null_loglikelihood(av)
-        self.results = biogeme.estimate()
+            # Calculate null log likelihood and estimate
+            self._prepare_biogeme(biogeme, av)
+            self.results = biogeme.estimate()
         
         # Get general statistics
         stats = self.results.get_general_statistics()
@@ -679,6 +538,29 @@ class NestedLogitModel_L(BaseLTDSModel):
         self.calculate_choice_accuracy_nest()
         
         return self.results
+
+    def _calculate_utilities(self, betas):
+        """Calculate utilities for each alternative using NL parameters."""
+        v1 = (0 + betas['B_TIME_WALKING'] * self.database.data['dur_walking'])  # ASC_WALKING fixed to 0
+        
+        v2 = (betas['ASC_CYCLING'] + 
+              betas['B_TIME_CYCLING'] * self.database.data['dur_cycling'])
+        
+        v3 = (betas['ASC_PT'] + 
+              betas['B_COST_PT'] * self.database.data['cost_transit'] + 
+              betas['B_TIME_PT_ACCESS'] * self.database.data['dur_pt_access'] + 
+              betas['B_TIME_PT_RAIL'] * self.database.data['dur_pt_rail'] + 
+              betas['B_TIME_PT_BUS'] * self.database.data['dur_pt_bus'] +
+              betas['B_TIME_PT_INT'] * self.database.data['dur_pt_int_total'])
+        
+        v4 = (betas['ASC_DRIVING'] + 
+              betas['B_TIME_DRIVING'] * self.database.data['dur_driving'] + 
+              betas['B_COST_DRIVING'] * (self.database.data['cost_driving_fuel'] + 
+                                       self.database.data['cost_driving_con_charge']) +
+              betas['B_TRAFFIC_DRIVING'] * self.database.data['driving_traffic_percent'])
+        
+        # The nesting structure is applied by the probability engine
+        return np.column_stack([v1, v2, v3, v4])
     
     def _get_utility_function(self, alternative):
         """Get utility function for a specific alternative."""
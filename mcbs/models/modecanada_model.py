@@ -12,31 +12,41 @@ Based on the same structure as the Swissmetro model.
 
 import biogeme.biogeme as bio
 from biogeme import models
-from biogeme.expressions import Beta, Variable, bioDraws, log, MonteCarlo
+from biogeme.expressions import Beta, Variable, log, MonteCarlo, PanelLikelihoodTrajectory
 from biogeme.database import Database
 from biogeme.nests import OneNestForNestedLogit, NestsForNestedLogit
 from .base import BaseDiscreteChoiceModel
+from ..engine.draws import biogeme_draws
+from ..engine.integration import DEFAULT_NODES, biogeme_normal_expectation
+from ..engine.mixed import RandomCoefficient
 import pandas as pd
 import numpy as np
 
 class BaseModeCanadaModel(BaseDiscreteChoiceModel):
     """Base class for ModeCanada models with shared initialization."""
+
+    # 1: Train, 2: Car, 3: Bus, 4: Air
+    alternatives = [1, 2, 3, 4]
+    availability_columns = ['TRAIN_AV', 'CAR_AV', 'BUS_AV', 'AIR_AV']
     
-    def __init__(self, data):
-        # Convert from long to wide format before creating database
-        data = self._preprocess_data(data)
-        super().__init__(data)
+    def __init__(self, data, backend=None, collapse=None, test_data=None):
+        super().__init__(data, backend=backend, collapse=collapse, test_data=test_data)
         self._initialize_variables()
+        if self.collapse_duplicates:
+            self._collapse_duplicates()
     
-    def _preprocess_data(self, data):
+    @classmethod
+    def _preprocess_data(cls, data):
         """
         Preprocess the data:
         1. Convert alt column to numeric
         2. Convert from long to wide format
+
+        The reshape is done in a single pass with a pivot on (case, alt), so its
+        cost grows linearly with the number of rows instead of cases x rows.
+        Cases keep their order of first appearance, and alternatives missing from
+        a case get zero availability, cost, time and frequency.
         """
-        # Create a copy
-        df = data.copy()
-        
         # Define mode mapping (1-based for Biogeme)
         mode_mapping = {
             'train': 1,
@@ -44,47 +54,52 @@ class BaseModeCanadaModel(BaseDiscreteChoiceModel):
             'bus': 3,
             'air': 4
         }
-        
-        # Convert alt column from strings to numeric
-        df['alt_num'] = df['alt'].map(mode_mapping)
-        
-        # Create wide format dataframe
-        cases = df['case'].unique()
-        wide_data = []
-        
-        for case_id in cases:
-            case_data = df[df['case'] == case_id]
-            
-            # Get case-specific variables
-            row = {
-                'case': case_id,
-                'income': case_data['income'].iloc[0],
-                'urban': case_data['urban'].iloc[0]
-            }
-            
-            # Get the chosen alternative
-            chosen = case_data[case_data['choice'] == 1]['alt_num'].iloc[0]
-            row['CHOICE'] = chosen
-            
-            # Add mode-specific variables
-            for mode, num in mode_mapping.items():
-                mode_data = case_data[case_data['alt'] == mode]
-                if len(mode_data) > 0:
-                    row[f'{mode.upper()}_AV'] = 1
-                    row[f'{mode.upper()}_COST'] = mode_data['cost'].iloc[0]
-                    row[f'{mode.upper()}_TIME'] = mode_data['ivt'].iloc[0] + mode_data['ovt'].iloc[0]
-                    if mode != 'car':  # Add frequency for transit modes
-                        row[f'{mode.upper()}_FREQ'] = mode_data['freq'].iloc[0]
+
+        # Only the first row of each (case, alt) pair is used, as in the
+        # original row-by-row reshape
+        df = data.drop_duplicates(subset=['case', 'alt'])
+        cases = pd.Index(data['case'].unique(), name='case')
+
+        # Case-specific variables come from the first row of each case
+        case_rows = data.drop_duplicates(subset='case').set_index('case')
+
+        # Chosen alternative, converted from strings to numeric
+        chosen = data[data['choice'] == 1].drop_duplicates(subset='case')
+        chosen = chosen.set_index('case')['alt'].map(mode_mapping)
+
+        wide = pd.DataFrame({
+            'case': cases,
+            'income': case_rows['income'].reindex(cases).to_numpy(),
+            'urban': case_rows['urban'].reindex(cases).to_numpy(),
+            'CHOICE': chosen.reindex(cases).to_numpy()
+        })
+
+        # Pivot mode-specific attributes to one column per (attribute, mode)
+        attributes = pd.DataFrame({
+            'case': df['case'],
+            'alt': df['alt'],
+            'COST': df['cost'],
+            'TIME': df['ivt'] + df['ovt'],
+            'FREQ': df['freq']
+        })
+        pivoted = attributes.pivot(index='case', columns='alt').reindex(cases)
+        present = pivoted['TIME'].notna()
+
+        # Add mode-specific variables
+        for mode in mode_mapping:
+            prefix = mode.upper()
+            available = present[mode] if mode in present.columns else pd.Series(False, index=cases)
+            wide[f'{prefix}_AV'] = available.to_numpy().astype(np.int64)
+
+            variables = ['COST', 'TIME'] if mode == 'car' else ['COST', 'TIME', 'FREQ']
+            for variable in variables:
+                if mode in pivoted[variable].columns:
+                    values = pivoted[variable][mode].fillna(0)
                 else:
-                    row[f'{mode.upper()}_AV'] = 0
-                    row[f'{mode.upper()}_COST'] = 0
-                    row[f'{mode.upper()}_TIME'] = 0
-                    if mode != 'car':
-                        row[f'{mode.upper()}_FREQ'] = 0
-            
-            wide_data.append(row)
-        
-        return pd.DataFrame(wide_data)
+                    values = pd.Series(0, index=cases)
+                wide[f'{prefix}_{variable}'] = values.to_numpy().astype(attributes[variable].dtype)
+
+        return wide
     
     def _initialize_variables(self):
         """Initialize all variables needed for ModeCanada models."""
@@ -113,201 +128,6 @@ class BaseModeCanadaModel(BaseDiscreteChoiceModel):
         print("\nMode choice distribution:")
         print(self.database.data['CHOICE'].value_counts().sort_index())
 
-    def calculate_choice_accuracy(self):
-        """Calculate individual choice prediction accuracy and market shares."""
-        if not hasattr(self, 'results'):
-            raise RuntimeError("Model must be estimated before calculating accuracy")
-            
-        # Get utility functions for simulation
-        V1 = self._get_utility_function(1)
-        V2 = self._get_utility_function(2)
-        V3 = self._get_utility_function(3)
-        V4 = self._get_utility_function(4)
-        
-        # Associate utility functions with alternatives
-        V = {1: V1, 2: V2, 3: V3, 4: V4}
-        
-        # Associate availability conditions
-        av = {1: self.TRAIN_AV,
-              2: self.CAR_AV,
-              3: self.BUS_AV,
-              4: self.AIR_AV}
-        
-        # Calculate choice probabilities
-        prob_train = models.logit(V, av, 1)
-        prob_car = models.logit(V, av, 2)
-        prob_bus = models.logit(V, av, 3)
-        prob_air = models.logit(V, av, 4)
-        
-        # Setup simulation
-        simulate = {
-            'Prob. train': prob_train,
-            'Prob. car': prob_car,
-            'Prob. bus': prob_bus,
-            'Prob. air': prob_air
-        }
-        
-        # Run simulation
-        biogeme = bio.BIOGEME(self.database, simulate)
-        biogeme.modelName = "choice_prediction"
-        simulatedValues = biogeme.simulate(self.results.get_beta_values())
-        
-        # Calculate market shares
-        actual_counts = self.database.data['CHOICE'].value_counts()
-        total = len(self.database.data)
-        self.actual_shares = {i: actual_counts.get(i, 0) / total for i in [1, 2, 3, 4]}
-        
-        # Calculate predicted shares (mean probability for each alternative)
-        self.predicted_shares = {
-            1: simulatedValues['Prob. train'].mean(),
-            2: simulatedValues['Prob. car'].mean(),
-            3: simulatedValues['Prob. bus'].mean(),
-            4: simulatedValues['Prob. air'].mean()
-        }
-        
-        # Calculate market share accuracy
-        total_abs_error = sum(abs(self.actual_shares[i] - self.predicted_shares[i]) 
-                            for i in [1, 2, 3, 4])
-        self.market_share_accuracy = 1 - (total_abs_error / 2)
-        
-        print("\nMarket Shares:")
-        print("Mode      Actual    Predicted")
-        print("-" * 30)
-        for i in [1, 2, 3, 4]:
-            print(f"{i:4d}     {self.actual_shares[i]:.3f}     {self.predicted_shares[i]:.3f}")
-        print(f"\nMarket Share Accuracy: {self.market_share_accuracy:.3f}")
-        
-        # Calculate choice accuracy
-        prob_max = simulatedValues.idxmax(axis=1)
-        prob_max = prob_max.replace({
-            'Prob. train': 1, 
-            'Prob. car': 2, 
-            'Prob. bus': 3, 
-            'Prob. air': 4
-        })
-        
-        # Create confusion matrix
-        data_sim = {
-            'y_Actual': self.database.data['CHOICE'],
-            'y_Predicted': prob_max
-        }
-        df = pd.DataFrame(data_sim, columns=['y_Actual', 'y_Predicted'])
-        self.confusion_matrix = pd.crosstab(
-            df['y_Actual'], 
-            df['y_Predicted'], 
-            rownames=['Actual'], 
-            colnames=['Predicted']
-        )
-
-        ### THIS IS A QUICK FIX AND NEED TO DO PROPERLY
-        self.confusion_matrix.insert(2, '3', 0)
-        
-        # Calculate accuracy
-        self.choice_accuracy = (
-            np.diagonal(self.confusion_matrix.to_numpy()).sum() / 
-            self.confusion_matrix.to_numpy().sum()
-        )
-        
-        print("\nConfusion Matrix:")
-        print(self.confusion_matrix)
-        print(f"\nChoice Prediction Accuracy: {self.choice_accuracy:.3f}")
-
-    def calculate_choice_accuracy_nest(self):
-        """Calculate individual choice prediction accuracy and market shares for nested logit models."""
-        if not hasattr(self, 'results'):
-            raise RuntimeError("Model must be estimated before calculating accuracy")
-            
-        # Get utility functions for simulation
-        V1 = self._get_utility_function(1)
-        V2 = self._get_utility_function(2)
-        V3 = self._get_utility_function(3)
-        V4 = self._get_utility_function(4)
-        
-        # Associate utility functions with alternatives
-        V = {1: V1, 2: V2, 3: V3, 4: V4}
-        
-        # Associate availability conditions
-        av = {1: self.TRAIN_AV,
-              2: self.CAR_AV,
-              3: self.BUS_AV,
-              4: self.AIR_AV}
-        
-        # Calculate choice probabilities
-        prob_train = models.nested(V, None, self.nests, 1)
-        prob_car = models.nested(V, None, self.nests, 2)
-        prob_bus = models.nested(V, None, self.nests, 3)
-        prob_air = models.nested(V, None, self.nests, 4)
-        
-        # Setup simulation
-        simulate = {
-            'Prob. train': prob_train,
-            'Prob. car': prob_car,
-            'Prob. bus': prob_bus,
-            'Prob. air': prob_air
-        }
-        
-        # Run simulation
-        biogeme = bio.BIOGEME(self.database, simulate)
-        biogeme.modelName = "choice_prediction_nest"
-        simulatedValues = biogeme.simulate(self.results.get_beta_values())
-        
-        # Calculate market shares
-        actual_counts = self.database.data['CHOICE'].value_counts()
-        total = len(self.database.data)
-        self.actual_shares = {i: actual_counts.get(i, 0) / total for i in [1, 2, 3, 4]}
-        
-        # Calculate predicted shares (mean probability for each alternative)
-        self.predicted_shares = {
-            1: simulatedValues['Prob. train'].mean(),
-            2: simulatedValues['Prob. car'].mean(),
-            3: simulatedValues['Prob. bus'].mean(),
-            4: simulatedValues['Prob. air'].mean()
-        }
-        
-        # Calculate market share accuracy
-        total_abs_error = sum(abs(self.actual_shares[i] - self.predicted_shares[i]) 
-                            for i in [1, 2, 3, 4])
-        self.market_share_accuracy = 1 - (total_abs_error / 2)
-        
-        print("\nMarket Shares:")
-        print("Mode      Actual    Predicted")
-        print("-" * 30)
-        for i in [1, 2, 3, 4]:
-            print(f"{i:4d}     {self.actual_shares[i]:.3f}     {self.predicted_shares[i]:.3f}")
-        print(f"\nMarket Share Accuracy: {self.market_share_accuracy:.3f}")
-        
-        # Calculate choice accuracy
-        prob_max = simulatedValues.idxmax(axis=1)
-        prob_max = prob_max.replace({
-            'Prob. train': 1, 
-            'Prob. car': 2, 
-            'Prob. bus': 3, 
-            'Prob. air': 4
-        })
-        
-        # Create confusion matrix
-        data_sim = {
-            'y_Actual': self.database.data['CHOICE'],
-            'y_Predicted': prob_max
-        }
-        df = pd.DataFrame(data_sim, columns=['y_Actual', 'y_Predicted'])
-        self.confusion_matrix = pd.crosstab(
-            df['y_Actual'], 
-            df['y_Predicted'], 
-            rownames=['Actual'], 
-            colnames=['Predicted']
-        )
-        
-        # Calculate accuracy
-        self.choice_accuracy = (
-            np.diagonal(self.confusion_matrix.to_numpy()).sum() / 
-            self.confusion_matrix.to_numpy().sum()
-        )
-        
-        print("\nConfusion Matrix:")
-        print(self.confusion_matrix)
-        print(f"\nChoice Prediction Accuracy: {self.choice_accuracy:.3f}")
-
 class MultinomialLogitModel_MC(BaseModeCanadaModel):
     """Multinomial logit model implementation."""
     
@@ -348,18 +168,22 @@ class MultinomialLogitModel_MC(BaseModeCanadaModel):
               3: self.BUS_AV,
               4: self.AIR_AV}
 
-        # Define and estimate the model
-        logprob = models.loglogit(V, av, self.CHOICE)
-        biogeme = bio.BIOGEME(self.database, logprob)
-        biogeme.modelName = "modecanada_mnl"
+        if self.backend == 'numpy':
+            # Closed-form gradient and Hessian, no Biogeme expression evaluation
+            self.results = self._estimate_numpy("modecanada_mnl")
+        else:
+            # Define and estimate the model
+            logprob = models.loglogit(V, av, self.CHOICE)
+            biogeme = bio.BIOGEME(self.database, self._weighted(logprob))
+            biogeme.modelName = "modecanada_mnl"
         
-        # Enable HTML and Pickle generation
-        biogeme.generateHtml = True
-        biogeme.generatePickle = True
+            # Enable HTML and Pickle generation
+            biogeme.generateHtml = True
+            biogeme.generatePickle = True
 
-        # Calculate null log likelihood and estimate
-        biogeme.calculate_null_loglikelihood(av)
-        self.results = biogeme.estimate()
+            # Calculate null log likelihood and estimate
+            self._prepare_biogeme(biogeme, av)
+            self.results = biogeme.estimate()
         
         # Get general statistics
         stats = self.results.getGeneralStatistics()
@@ -491,18 +315,22 @@ class NestedLogitModel3_MC(BaseModeCanadaModel):
         )
         nests = NestsForNestedLogit(choice_set=list(V), tuple_of_nests=(public,))
 
-        # Define and estimate the model
-        logprob = models.lognested(V, av, nests, self.CHOICE)
-        biogeme = bio.BIOGEME(self.database, logprob)
-        biogeme.modelName = "modecanada_nl3"
+        if self.backend == 'numpy':
+            # Analytic nested logit gradient, no Biogeme expression evaluation
+            self.results = self._estimate_numpy("modecanada_nl3", nests=nests)
+        else:
+            # Define and estimate the model
+            logprob = models.lognested(V, av, nests, self.CHOICE)
+            biogeme = bio.BIOGEME(self.database, self._weighted(logprob))
+            biogeme.modelName = "modecanada_nl3"
         
-        # Enable HTML and Pickle generation
-        biogeme.generateHtml = True
-        biogeme.generatePickle = True
+            # Enable HTML and Pickle generation
+            biogeme.generateHtml = True
+            biogeme.generatePickle = True
         
-        # Calculate null log likelihood and estimate
-        biogeme.calculate_null_loglikelihood(av)
-        self.results = biogeme.estimate()
+            # Calculate null log likelihood and estimate
+            self._prepare_biogeme(biogeme, av)
+            self.results = biogeme.estimate()
         
         # Get general statistics
         stats = self.results.getGeneralStatistics()
@@ -540,13 +368,8 @@ class NestedLogitModel3_MC(BaseModeCanadaModel):
               betas['B_TIME'] * self.database.data['AIR_TIME'] + 
               betas['B_COST'] * self.database.data['AIR_COST']) 
         
-        utilities = np.column_stack([v1, v2, v3, v4])
-        
-        # Apply nesting structure
-        mu = betas['MU_PUBLIC']
-        utilities[:, [0, 2, 3]] = utilities[:, [0, 2, 3]] / mu  # Scale utilities in public transport nest
-        
-        return utilities
+        # The nesting structure is applied by the probability engine
+        return np.column_stack([v1, v2, v3, v4])
 
     def _get_utility_function(self, alternative):
         """Get utility function for a specific alternative."""
@@ -601,6 +424,43 @@ class NestedLogitModel3_MC(BaseModeCanadaModel):
 
 class MixedLogitModel_MC(BaseModeCanadaModel):
     """Mixed logit model implementation with random coefficients."""
+
+    # The simulated log likelihood is not weighted by row frequencies
+    frequency_weights = False
+
+    # Normally distributed time coefficient
+    random_coefficients = [RandomCoefficient('B_TIME', 'B_TIME_S', 1.0)]
+
+    def __init__(self, data, number_of_draws=100, draw_type='pseudo',
+                 integration='montecarlo', n_nodes=DEFAULT_NODES, panel=False, backend=None,
+                 test_data=None):
+        """
+        Initialize the mixed logit model.
+
+        Args:
+            data: DataFrame with choice data
+            number_of_draws: Number of draws per observation for the simulated likelihood
+            draw_type: Type of draws: 'pseudo', 'halton' (scrambled), 'sobol',
+                'mlhs' or any Biogeme draw type
+            integration: 'montecarlo' to simulate the likelihood with draws, or
+                'quadrature' to integrate the random time coefficient with
+                Gauss-Hermite quadrature
+            n_nodes: Number of quadrature nodes
+            panel: Whether to share the draws of each respondent (identified
+                by panel_column) across their choices
+            backend: Estimation backend, 'biogeme' or 'numpy'
+            test_data: Optional holdout DataFrame, in the raw format of data
+        """
+        if integration not in ('montecarlo', 'quadrature'):
+            raise ValueError("integration must be 'montecarlo' or 'quadrature'")
+        if panel and self.panel_column is None:
+            raise ValueError(f"{type(self).__name__} has no panel data")
+        super().__init__(data, backend=backend, test_data=test_data)
+        self.number_of_draws = number_of_draws
+        self.draw_type = draw_type
+        self.integration = integration
+        self.n_nodes = n_nodes
+        self.panel = panel
     
     def estimate(self):
         """Estimate the mixed logit model."""
@@ -614,27 +474,6 @@ class MixedLogitModel_MC(BaseModeCanadaModel):
         # Define random parameter for time
         B_TIME = Beta('B_TIME', 0, None, None, 0)
         B_TIME_S = Beta('B_TIME_S', 1, None, None, 0)  # Spread parameter
-        B_TIME_RND = B_TIME + B_TIME_S * bioDraws('b_time_rnd', 'NORMAL')
-
-        # Utility functions with random coefficient
-        V1 = (ASC_TRAIN + 
-              B_TIME_RND * self.TRAIN_TIME + 
-              B_COST * self.TRAIN_COST)
-        
-        V2 = (ASC_CAR + 
-              B_TIME_RND * self.CAR_TIME + 
-              B_COST * self.CAR_COST)
-        
-        V3 = (ASC_BUS + 
-              B_TIME_RND * self.BUS_TIME + 
-              B_COST * self.BUS_COST)
-        
-        V4 = (ASC_AIR + 
-              B_TIME_RND * self.AIR_TIME + 
-              B_COST * self.AIR_COST)
-
-        # Associate utility functions with alternatives
-        V = {1: V1, 2: V2, 3: V3, 4: V4}
 
         # Associate availability conditions
         av = {1: self.TRAIN_AV,
@@ -642,28 +481,68 @@ class MixedLogitModel_MC(BaseModeCanadaModel):
               3: self.BUS_AV,
               4: self.AIR_AV}
 
-        # Conditional on b_time_rnd, we have a logit model (kernel)
-        prob = models.logit(V, av, self.CHOICE)
-
-        # Integrate over b_time_rnd using Monte-Carlo
-        logprob = log(MonteCarlo(prob))
+        def conditional_probability(b_time_rnd):
+            """Logit kernel given a standard normal value of the time coefficient."""
+            B_TIME_RND = B_TIME + B_TIME_S * b_time_rnd
 
-        # Create and estimate the model
-        biogeme = bio.BIOGEME(
-            self.database, 
-            logprob, 
-            number_of_draws=100,  # You can adjust this
-            seed=1223
-        )
-        biogeme.modelName = "modecanada_mixed"
+            # Utility functions with random coefficient
+            V1 = (ASC_TRAIN + 
+                  B_TIME_RND * self.TRAIN_TIME + 
+                  B_COST * self.TRAIN_COST)
+            
+            V2 = (ASC_CAR + 
+                  B_TIME_RND * self.CAR_TIME + 
+                  B_COST * self.CAR_COST)
+            
+            V3 = (ASC_BUS + 
+                  B_TIME_RND * self.BUS_TIME + 
+                  B_COST * self.BUS_COST)
+            
+            V4 = (ASC_AIR + 
+                  B_TIME_RND * self.AIR_TIME + 
+                  B_COST * self.AIR_COST)
+
+            # Associate utility functions with alternatives
+            V = {1: V1, 2: V2, 3: V3, 4: V4}
+            return models.logit(V, av, self.CHOICE)
+
+        if self.backend == 'numpy':
+            # Chunked simulated likelihood with an analytic gradient
+            self.results = self._estimate_numpy(
+                "modecanada_mixed", random_coefficients=self.random_coefficients)
+        else:
+            if self.panel:
+                # One draw per respondent, kept across all their choices
+                database = self._panel_database()
+                kernel = lambda b_time_rnd: PanelLikelihoodTrajectory(conditional_probability(b_time_rnd))
+            else:
+                database = self.database
+                kernel = conditional_probability
+
+            if self.integration == 'quadrature':
+                # Integrate over b_time_rnd using Gauss-Hermite quadrature
+                logprob = log(biogeme_normal_expectation(kernel, self.n_nodes))
+            else:
+                # Integrate over b_time_rnd using Monte-Carlo
+                prob = kernel(biogeme_draws(database, 'b_time_rnd', self.draw_type, seed=1223))
+                logprob = log(MonteCarlo(prob))
+
+            # Create and estimate the model
+            biogeme = bio.BIOGEME(
+                database, 
+                logprob, 
+                number_of_draws=self.number_of_draws,
+                seed=1223
+            )
+            biogeme.modelName = "modecanada_mixed"
         
-        # Enable HTML and Pickle generation
-        biogeme.generateHtml = True
-        biogeme.generatePickle = True
+            # Enable HTML and Pickle generation
+            biogeme.generateHtml = True
+            biogeme.generatePickle = True
         
-        # Calculate null log likelihood and estimate
-        biogeme.calculate_null_loglikelihood(av)
-        self.results = biogeme.estimate()
+            # Calculate null log likelihood and estimate
+            self._prepare_biogeme(biogeme, av)
+            self.results = biogeme.estimate()
         
         # Get general statistics
         stats = self.results.getGeneralStatistics()
@@ -7,28 +7,43 @@ in Switzerland.
 
 Based on: Michel Bierlaire's Biogeme tutorial
 """
-import pandas as pd
 import numpy as np
 import biogeme.biogeme_logging as blog
 import biogeme.biogeme as bio
 from biogeme import models
-from biogeme.expressions import Beta, Variable, bioDraws, log, MonteCarlo
+from biogeme.expressions import Beta, Variable, log, MonteCarlo, PanelLikelihoodTrajectory
 from biogeme.database import Database
 from biogeme.nests import OneNestForNestedLogit, NestsForNestedLogit
 from .base import BaseDiscreteChoiceModel
+from ..engine.draws import biogeme_draws
+from ..engine.integration import DEFAULT_NODES, biogeme_normal_expectation
+from ..engine.mixed import RandomCoefficient
 from biogeme.data.optima import read_data, normalized_weight
 #from scenarios import scenario
 
 class BaseSwissmetroModel(BaseDiscreteChoiceModel):
     """Base class for Swissmetro models with shared initialization."""
+
+    # 1: Train, 2: Swissmetro, 3: Car
+    alternatives = [1, 2, 3]
+    availability_columns = ['TRAIN_AV_SP', 'SM_AV', 'CAR_AV_SP']
+
+    # Each respondent answered several stated preference questions
+    panel_column = 'ID'
     
-    def __init__(self, data):
-        # Encode categorical variables before creating database
-        data = self._encode_categorical_variables(data)
-        super().__init__(data)
+    def __init__(self, data, backend=None, collapse=None, test_data=None):
+        super().__init__(data, backend=backend, collapse=collapse, test_data=test_data)
         self._initialize_variables()
+        if self.collapse_duplicates:
+            self._collapse_duplicates()
         
-    def _encode_categorical_variables(self, df):
+    @classmethod
+    def _preprocess_data(cls, data):
+        """Encode the categorical variables of raw data."""
+        return cls._encode_categorical_variables(data)
+
+    @classmethod
+    def _encode_categorical_variables(cls, df):
         """
         Encode categorical variables according to Swissmetro dataset specifications.
         
@@ -38,8 +53,8 @@ class BaseSwissmetroModel(BaseDiscreteChoiceModel):
         Returns:
         pandas.DataFrame: DataFrame with encoded categorical variables
         """
-        # Create a copy to avoid modifying the original
-        df_encoded = df.copy()
+        # No column is encoded, so a shallow copy of the frame is returned
+        df_encoded = df.copy(deep=False)
         
         # Print data statistics before encoding
         print("\nBefore encoding:")
@@ -80,16 +95,7 @@ class BaseSwissmetroModel(BaseDiscreteChoiceModel):
         self.CAR_CO = Variable('CAR_CO')
         self.CHOICE = Variable('CHOICE')
 
-        # Print data statistics before filtering
-        print("\nBefore filtering:")
-        print("Purpose values:", self.database.data['PURPOSE'].value_counts())
-        print("Choice values:", self.database.data['CHOICE'].value_counts())
-        
-        # Remove observations using Biogeme way
-        exclude = ((self.PURPOSE != 1) * (self.PURPOSE != 3) + (self.CHOICE == 0)) > 0
-        self.database.remove(exclude)
-
-        # Print data statistics after filtering
+        # Print data statistics after filtering (see _prepare_database)
         print("\nAfter filtering:")
         print("Purpose values:", self.database.data['PURPOSE'].value_counts())
         print("Choice values:", self.database.data['CHOICE'].value_counts())
@@ -97,33 +103,50 @@ class BaseSwissmetroModel(BaseDiscreteChoiceModel):
         print("Car availability:", self.database.data['CAR_AV'].value_counts())
         print("SM availability:", self.database.data['SM_AV'].value_counts())
 
+        # Derived variables
+        self.SM_COST = Variable('SM_COST')
+        self.TRAIN_COST = Variable('TRAIN_COST')
+        self.CAR_AV_SP = Variable('CAR_AV_SP')
+        self.TRAIN_AV_SP = Variable('TRAIN_AV_SP')
+        self.TRAIN_TT_SCALED = Variable('TRAIN_TT_SCALED')
+        self.TRAIN_COST_SCALED = Variable('TRAIN_COST_SCALED')
+        self.SM_TT_SCALED = Variable('SM_TT_SCALED')
+        self.SM_COST_SCALED = Variable('SM_COST_SCALED')
+        self.CAR_TT_SCALED = Variable('CAR_TT_SCALED')
+        self.CAR_CO_SCALED = Variable('CAR_CO_SCALED')
+
+    @classmethod
+    def _prepare_database(cls, database):
+        """
+        Remove the observations outside the estimation sample and define the
+        derived variables of a Swissmetro database.
+
+        Args:
+            database: Database of encoded Swissmetro data
+        """
+        # Remove observations using Biogeme way
+        PURPOSE = Variable('PURPOSE')
+        exclude = ((PURPOSE != 1) * (PURPOSE != 3) + (Variable('CHOICE') == 0)) > 0
+        database.remove(exclude)
+
         # Definition of new variables
-        def define_if_not_exists(name, expression):
-            if name not in self.database.data.columns:
-                self.database.define_variable(name, expression)
-            return Variable(name)
-
-        # Define derived variables
-        self.SM_COST = define_if_not_exists('SM_COST', 
-                                           self.SM_CO * (self.GA == 0))
-        self.TRAIN_COST = define_if_not_exists('TRAIN_COST', 
-                                              self.TRAIN_CO * (self.GA == 0))
-        self.CAR_AV_SP = define_if_not_exists('CAR_AV_SP', 
-                                             self.CAR_AV * (self.SP != 0))
-        self.TRAIN_AV_SP = define_if_not_exists('TRAIN_AV_SP', 
-                                               self.TRAIN_AV * (self.SP != 0))
-        self.TRAIN_TT_SCALED = define_if_not_exists('TRAIN_TT_SCALED', 
-                                                   self.TRAIN_TT / 100)
-        self.TRAIN_COST_SCALED = define_if_not_exists('TRAIN_COST_SCALED', 
-                                                     self.TRAIN_COST / 100)
-        self.SM_TT_SCALED = define_if_not_exists('SM_TT_SCALED', 
-                                                self.SM_TT / 100)
-        self.SM_COST_SCALED = define_if_not_exists('SM_COST_SCALED', 
-                                                  self.SM_COST / 100)
-        self.CAR_TT_SCALED = define_if_not_exists('CAR_TT_SCALED', 
-                                                 self.CAR_TT / 100)
-        self.CAR_CO_SCALED = define_if_not_exists('CAR_CO_SCALED', 
-                                                 self.CAR_CO / 100)
+        GA = Variable('GA')
+        SP = Variable('SP')
+        derived = {
+            'SM_COST': Variable('SM_CO') * (GA == 0),
+            'TRAIN_COST': Variable('TRAIN_CO') * (GA == 0),
+            'CAR_AV_SP': Variable('CAR_AV') * (SP != 0),
+            'TRAIN_AV_SP': Variable('TRAIN_AV') * (SP != 0),
+            'TRAIN_TT_SCALED': Variable('TRAIN_TT') / 100,
+            'TRAIN_COST_SCALED': Variable('TRAIN_COST') / 100,
+            'SM_TT_SCALED': Variable('SM_TT') / 100,
+            'SM_COST_SCALED': Variable('SM_COST') / 100,
+            'CAR_TT_SCALED': Variable('CAR_TT') / 100,
+            'CAR_CO_SCALED': Variable('CAR_CO') / 100,
+        }
+        for name, expression in derived.items():
+            if name not in database.data.columns:
+                database.define_variable(name, expression)
 
     # def calculate_market_shares(self):
     #     """Calculate actual and predicted market shares."""
@@ -161,177 +184,6 @@ class BaseSwissmetroModel(BaseDiscreteChoiceModel):
     #         print(f"{i:4d}     {self.actual_shares[i]:.3f}     {self.predicted_shares[i]:.3f}")
     #     print(f"\nMarket Share Accuracy: {self.market_share_accuracy:.3f}")
 
-    def calculate_choice_accuracy(self):
-        """Calculate individual choice prediction accuracy and market shares."""
-        if not hasattr(self, 'results'):
-            raise RuntimeError("Model must be estimated before calculating accuracy")
-            
-        # Get utility functions for simulation
-        V1 = self._get_utility_function(1)
-        V2 = self._get_utility_function(2)
-        V3 = self._get_utility_function(3)
-        
-        # Associate utility functions with alternatives
-        V = {1: V1, 2: V2, 3: V3}
-        
-        # Associate availability conditions
-        av = {1: self.TRAIN_AV_SP, 2: self.SM_AV, 3: self.CAR_AV_SP}
-        
-        # Calculate choice probabilities
-        prob_train = models.logit(V, av, 1)
-        prob_SM = models.logit(V, av, 2)
-        prob_car = models.logit(V, av, 3)
-        
-        # Setup simulation
-        simulate = {
-            'Prob. train': prob_train,
-            'Prob. SM': prob_SM,
-            'Prob. car': prob_car
-        }
-        
-        # Run simulation
-        biogeme = bio.BIOGEME(self.database, simulate)
-        biogeme.modelName = "choice_prediction"
-        simulatedValues = biogeme.simulate(self.results.get_beta_values())
-        
-        # Calculate market shares
-        actual_counts = self.database.data['CHOICE'].value_counts()
-        total = len(self.database.data)
-        self.actual_shares = {i: actual_counts.get(i, 0) / total for i in [1, 2, 3]}
-        
-        # Calculate predicted shares (mean probability for each alternative)
-        self.predicted_shares = {
-            1: simulatedValues['Prob. train'].mean(),
-            2: simulatedValues['Prob. SM'].mean(),
-            3: simulatedValues['Prob. car'].mean()
-        }
-        
-        # Calculate market share accuracy
-        total_abs_error = sum(abs(self.actual_shares[i] - self.predicted_shares[i]) 
-                            for i in [1, 2, 3])
-        self.market_share_accuracy = 1 - (total_abs_error / 2)  # Divide by 2 since errors are double counted
-        
-        print("\nMarket Shares:")
-        print("Mode      Actual    Predicted")
-        print("-" * 30)
-        for i in [1, 2, 3]:  # 1: Train, 2: SM, 3: Car
-            print(f"{i:4d}     {self.actual_shares[i]:.3f}     {self.predicted_shares[i]:.3f}")
-        print(f"\nMarket Share Accuracy: {self.market_share_accuracy:.3f}")
-        
-        # Calculate choice accuracy
-        prob_max = simulatedValues.idxmax(axis=1)
-        prob_max = prob_max.replace({'Prob. train': 1, 'Prob. SM': 2, 'Prob. car': 3})
-        
-        # Create confusion matrix
-        data_sim = {
-            'y_Actual': self.database.data['CHOICE'],
-            'y_Predicted': prob_max
-        }
-        df = pd.DataFrame(data_sim, columns=['y_Actual', 'y_Predicted'])
-        self.confusion_matrix = pd.crosstab(
-            df['y_Actual'], 
-            df['y_Predicted'], 
-            rownames=['Actual'], 
-            colnames=['Predicted']
-        )
-        
-        # Calculate accuracy
-        self.choice_accuracy = (
-            np.diagonal(self.confusion_matrix.to_numpy()).sum() / 
-            self.confusion_matrix.to_numpy().sum()
-        )
-        
-        print("\nConfusion Matrix:")
-        print(self.confusion_matrix)
-        print(f"\nChoice Prediction Accuracy: {self.choice_accuracy:.3f}")
-
-    def calculate_choice_accuracy_nest(self):
-        """Calculate individual choice prediction accuracy and market shares for nested logit models."""
-        if not hasattr(self, 'results'):
-            raise RuntimeError("Model must be estimated before calculating accuracy")
-            
-        # Get utility functions for simulation
-        V1 = self._get_utility_function(1)
-        V2 = self._get_utility_function(2)
-        V3 = self._get_utility_function(3)
-        
-        # Associate utility functions with alternatives
-        V = {1: V1, 2: V2, 3: V3}
-        
-        # Associate availability conditions
-        av = {1: self.TRAIN_AV_SP, 2: self.SM_AV, 3: self.CAR_AV_SP}
-
-        #V, self.nests, _, _ = scenario()
-        
-        # Calculate choice probabilities (CHECK THIS PART!)
-        prob_train = models.nested(V, None, self.nests, 1)
-        prob_SM = models.nested(V, None, self.nests, 3)
-        prob_car = models.nested(V, None, self.nests, 2)
-        
-        # Setup simulation
-        simulate = {
-            #'weight': 1,
-            'Prob. train': prob_train,
-            'Prob. SM': prob_SM,
-            'Prob. car': prob_car
-        }
-        
-        # Run simulation
-        biogeme = bio.BIOGEME(self.database, simulate)
-        biogeme.modelName = "choice_prediction_nest"
-        simulatedValues = biogeme.simulate(self.results.get_beta_values())
-        
-        # Calculate market shares
-        actual_counts = self.database.data['CHOICE'].value_counts()
-        total = len(self.database.data)
-        self.actual_shares = {i: actual_counts.get(i, 0) / total for i in [1, 2, 3]}
-        
-        # Calculate predicted shares (mean probability for each alternative)
-        self.predicted_shares = {
-            1: simulatedValues['Prob. train'].mean(),
-            2: simulatedValues['Prob. SM'].mean(),
-            3: simulatedValues['Prob. car'].mean()
-        }
-        
-        # Calculate market share accuracy
-        total_abs_error = sum(abs(self.actual_shares[i] - self.predicted_shares[i]) 
-                            for i in [1, 2, 3])
-        self.market_share_accuracy = 1 - (total_abs_error / 2)  # Divide by 2 since errors are double counted
-        
-        print("\nMarket Shares:")
-        print("Mode      Actual    Predicted")
-        print("-" * 30)
-        for i in [1, 2, 3]:  # 1: Train, 2: SM, 3: Car
-            print(f"{i:4d}     {self.actual_shares[i]:.3f}     {self.predicted_shares[i]:.3f}")
-        print(f"\nMarket Share Accuracy: {self.market_share_accuracy:.3f}")
-        
-        # Calculate choice accuracy
-        prob_max = simulatedValues.idxmax(axis=1)
-        prob_max = prob_max.replace({'Prob. train': 1, 'Prob. SM': 2, 'Prob. car': 3})
-        
-        # Create confusion matrix
-        data_sim = {
-            'y_Actual': self.database.data['CHOICE'],
-            'y_Predicted': prob_max
-        }
-        df = pd.DataFrame(data_sim, columns=['y_Actual', 'y_Predicted'])
-        self.confusion_matrix = pd.crosstab(
-            df['y_Actual'], 
-            df['y_Predicted'], 
-            rownames=['Actual'], 
-            colnames=['Predicted']
-        )
-        
-        # Calculate accuracy
-        self.choice_accuracy = (
-            np.diagonal(self.confusion_matrix.to_numpy()).sum() / 
-            self.confusion_matrix.to_numpy().sum()
-        )
-        
-        print("\nConfusion Matrix:")
-        print(self.confusion_matrix)
-        print(f"\nChoice Prediction Accuracy: {self.choice_accuracy:.3f}")
-
     def _calculate_utilities(self, betas):
             """Calculate utilities for each alternative using estimated parameters."""
             raise NotImplementedError("Subclasses must implement _calculate_utilities")
@@ -363,18 +215,22 @@ class MultinomialLogitModel_SM(BaseSwissmetroModel):
         # Associate availability conditions
         av = {1: self.TRAIN_AV_SP, 2: self.SM_AV, 3: self.CAR_AV_SP}
 
-        # Define and estimate the model
-        logprob = models.loglogit(V, av, self.CHOICE)
-        biogeme = bio.BIOGEME(self.database, logprob)
-        biogeme.modelName = "mnl_model"
+        if self.backend == 'numpy':
+            # Closed-form gradient and Hessian, no Biogeme expression evaluation
+            self.results = self._estimate_numpy("mnl_model")
+        else:
+            # Define and estimate the model
+            logprob = models.loglogit(V, av, self.CHOICE)
+            biogeme = bio.BIOGEME(self.database, self._weighted(logprob))
+            biogeme.modelName = "mnl_model"
         
-        # Disable HTML and Pickle generation
-        biogeme.generateHtml = True
-        biogeme.generatePickle = True
+            # Disable HTML and Pickle generation
+            biogeme.generateHtml = True
+            biogeme.generatePickle = True
         
-        # Calculate null log likelihood and estimate
-        biogeme.calculate_null_loglikelihood(av)
-        self.results = biogeme.estimate()
+            # Calculate null log likelihood and estimate
+            self._prepare_biogeme(biogeme, av)
+            self.results = biogeme.estimate()
         
         # Get general statistics
         stats = self.results.getGeneralStatistics()
@@ -482,18 +338,22 @@ class NestedLogitModel_SM(BaseSwissmetroModel):
         )
         nests = NestsForNestedLogit(choice_set=list(V), tuple_of_nests=(existing,))
 
-        # Define and estimate the model
-        logprob = models.lognested(V, av, nests, self.CHOICE)
-        biogeme = bio.BIOGEME(self.database, logprob)
-        biogeme.modelName = "nested_logit_model"
+        if self.backend == 'numpy':
+            # Analytic nested logit gradient, no Biogeme expression evaluation
+            self.results = self._estimate_numpy("nested_logit_model", nests=nests)
+        else:
+            # Define and estimate the model
+            logprob = models.lognested(V, av, nests, self.CHOICE)
+            biogeme = bio.BIOGEME(self.database, self._weighted(logprob))
+            biogeme.modelName = "nested_logit_model"
         
-        # Disable HTML and Pickle generation
-        biogeme.generateHtml = True
-        biogeme.generatePickle = True
+            # Disable HTML and Pickle generation
+            biogeme.generateHtml = True
+            biogeme.generatePickle = True
         
-        # Calculate null log likelihood and estimate
-        biogeme.calculate_null_loglikelihood(av)
-        self.results = biogeme.estimate()
+            # Calculate null log likelihood and estimate
+            self._prepare_biogeme(biogeme, av)
+            self.results = biogeme.estimate()
         
         # Get general statistics
         stats = self.results.getGeneralStatistics()
@@ -530,13 +390,8 @@ class NestedLogitModel_SM(BaseSwissmetroModel):
               betas['B_TIME'] * self.database.data['CAR_TT_SCALED'] + 
               betas['B_COST'] * self.database.data['CAR_CO_SCALED'])
         
-        utilities = np.column_stack([v1, v2, v3])
-        
-        # Apply nesting structure
-        mu = betas['MU']
-        utilities[:, [0, 2]] = utilities[:, [0, 2]] / mu  # Scale utilities in the nest
-        
-        return utilities
+        # The nesting structure is applied by the probability engine
+        return np.column_stack([v1, v2, v3])
 
     def _get_utility_function(self, alternative):
         """Get utility function for a specific alternative."""
@@ -587,6 +442,43 @@ class NestedLogitModel_SM(BaseSwissmetroModel):
     
 class MixedLogitModel_SM(BaseSwissmetroModel):
     """Mixed logit model implementation with random coefficients."""
+
+    # The simulated log likelihood is not weighted by row frequencies
+    frequency_weights = False
+
+    # Normally distributed time coefficient
+    random_coefficients = [RandomCoefficient('B_TIME', 'B_TIME_S', 1.0)]
+
+    def __init__(self, data, number_of_draws=100, draw_type='pseudo',
+                 integration='montecarlo', n_nodes=DEFAULT_NODES, panel=False, backend=None,
+                 test_data=None):
+        """
+        Initialize the mixed logit model.
+
+        Args:
+            data: DataFrame with choice data
+            number_of_draws: Number of draws per observation for the simulated likelihood
+            draw_type: Type of draws: 'pseudo', 'halton' (scrambled), 'sobol',
+                'mlhs' or any Biogeme draw type
+            integration: 'montecarlo' to simulate the likelihood with draws, or
+                'quadrature' to integrate the random time coefficient with
+                Gauss-Hermite quadrature
+            n_nodes: Number of quadrature nodes
+            panel: Whether to share the draws of each respondent (identified
+                by panel_column) across their choices
+            backend: Estimation backend, 'biogeme' or 'numpy'
+            test_data: Optional holdout DataFrame, in the raw format of data
+        """
+        if integration not in ('montecarlo', 'quadrature'):
+            raise ValueError("integration must be 'montecarlo' or 'quadrature'")
+        if panel and self.panel_column is None:
+            raise ValueError(f"{type(self).__name__} has no panel data")
+        super().__init__(data, backend=backend, test_data=test_data)
+        self.number_of_draws = number_of_draws
+        self.draw_type = draw_type
+        self.integration = integration
+        self.n_nodes = n_nodes
+        self.panel = panel
     
     def estimate(self):
         """Estimate the mixed logit model."""
@@ -599,41 +491,60 @@ class MixedLogitModel_SM(BaseSwissmetroModel):
         # Define random parameter for time
         B_TIME = Beta('B_TIME', 0, None, None, 0)
         B_TIME_S = Beta('B_TIME_S', 1, None, None, 0)  # Spread parameter
-        B_TIME_RND = B_TIME + B_TIME_S * bioDraws('b_time_rnd', 'NORMAL')
-
-        # Definition of the utility functions with random coefficient
-        V1 = ASC_TRAIN + B_TIME_RND * self.TRAIN_TT_SCALED + B_COST * self.TRAIN_COST_SCALED
-        V2 = ASC_SM + B_TIME_RND * self.SM_TT_SCALED + B_COST * self.SM_COST_SCALED
-        V3 = ASC_CAR + B_TIME_RND * self.CAR_TT_SCALED + B_COST * self.CAR_CO_SCALED
-
-        # Associate utility functions with alternatives
-        V = {1: V1, 2: V2, 3: V3}
 
         # Associate availability conditions
         av = {1: self.TRAIN_AV_SP, 2: self.SM_AV, 3: self.CAR_AV_SP}
 
-        # Conditional on b_time_rnd, we have a logit model (kernel)
-        prob = models.logit(V, av, self.CHOICE)
+        def conditional_probability(b_time_rnd):
+            """Logit kernel given a standard normal value of the time coefficient."""
+            B_TIME_RND = B_TIME + B_TIME_S * b_time_rnd
 
-        # Integrate over b_time_rnd using Monte-Carlo
-        logprob = log(MonteCarlo(prob))
+            # Definition of the utility functions with random coefficient
+            V1 = ASC_TRAIN + B_TIME_RND * self.TRAIN_TT_SCALED + B_COST * self.TRAIN_COST_SCALED
+            V2 = ASC_SM + B_TIME_RND * self.SM_TT_SCALED + B_COST * self.SM_COST_SCALED
+            V3 = ASC_CAR + B_TIME_RND * self.CAR_TT_SCALED + B_COST * self.CAR_CO_SCALED
 
-        # Create and estimate the model
-        biogeme = bio.BIOGEME(
-            self.database, 
-            logprob, 
-            number_of_draws=100,  # You can adjust this
-            seed=1223
-        )
-        biogeme.modelName = "mixed_logit_model"
+            # Associate utility functions with alternatives
+            V = {1: V1, 2: V2, 3: V3}
+            return models.logit(V, av, self.CHOICE)
+
+        if self.backend == 'numpy':
+            # Chunked simulated likelihood with an analytic gradient
+            self.results = self._estimate_numpy(
+                "mixed_logit_model", random_coefficients=self.random_coefficients)
+        else:
+            if self.panel:
+                # One draw per respondent, kept across all their choices
+                database = self._panel_database()
+                kernel = lambda b_time_rnd: PanelLikelihoodTrajectory(conditional_probability(b_time_rnd))
+            else:
+                database = self.database
+                kernel = conditional_probability
+
+            if self.integration == 'quadrature':
+                # Integrate over b_time_rnd using Gauss-Hermite quadrature
+                logprob = log(biogeme_normal_expectation(kernel, self.n_nodes))
+            else:
+                # Integrate over b_time_rnd using Monte-Carlo
+                prob = kernel(biogeme_draws(database, 'b_time_rnd', self.draw_type, seed=1223))
+                logprob = log(MonteCarlo(prob))
+
+            # Create and estimate the model
+            biogeme = bio.BIOGEME(
+                database, 
+                logprob, 
+                number_of_draws=self.number_of_draws,
+                seed=1223
+            )
+            biogeme.modelName = "mixed_logit_model"
         
-        # Disable HTML and Pickle generation
-        biogeme.generateHtml = False
-        biogeme.generatePickle = False
+            # Disable HTML and Pickle generation
+            biogeme.generateHtml = False
+            biogeme.generatePickle = False
         
-        # Calculate null log likelihood and estimate
-        biogeme.calculate_null_loglikelihood(av)
-        self.results = biogeme.estimate()
+            # Calculate null log likelihood and estimate
+            self._prepare_biogeme(biogeme, av)
+            self.results = biogeme.estimate()
         
         # Get general statistics
         stats = self.results.getGeneralStatistics()
@@ -1,7 +1,6 @@
 """Wrapper utility for integrating Biogeme models with the benchmarker."""
 
 from ..models.base import BaseDiscreteChoiceModel
-import pandas as pd
 import numpy as np
 
 class BiogemeModelWrapper(BaseDiscreteChoiceModel):
@@ -65,38 +64,12 @@ class BiogemeModelWrapper(BaseDiscreteChoiceModel):
         else:
             simulatedValues = self.results.data.simulatedValues
         
-        # Calculate actual shares
-        choices = self.database.data[self.choice_column]
-        total = len(choices)
-        self.actual_shares = choices.value_counts(normalize=True).to_dict()
-        
-        # Calculate predicted shares
-        prob_means = simulatedValues.mean()
-        self.predicted_shares = {
-            i+1: prob_means[f'Prob. {i+1}'] 
-            for i in range(len(prob_vars))
-        }
-        
-        # Calculate market share accuracy
-        total_abs_error = sum(
-            abs(self.actual_shares.get(i, 0) - self.predicted_shares.get(i, 0))
-            for i in set(self.actual_shares) | set(self.predicted_shares)
-        )
-        self.market_share_accuracy = 1 - (total_abs_error / 2)
-        
-        # Calculate choice accuracy
-        predicted_choices = simulatedValues.idxmax(axis=1)
-        predicted_choices = predicted_choices.map(
-            lambda x: int(x.split()[-1])  # Extract choice number
-        )
-        
-        # Create confusion matrix
-        self.confusion_matrix = pd.crosstab(
-            choices,
-            predicted_choices,
-            rownames=['Actual'],
-            colnames=['Predicted']
+        # Order the probability columns by alternative id ('Prob. 1', 'Prob. 2', ...)
+        prob_columns = sorted(
+            (c for c in simulatedValues.columns if c.startswith('Prob')),
+            key=lambda x: int(x.split()[-1])  # Extract choice number
         )
+        self.alternatives = [int(c.split()[-1]) for c in prob_columns]
         
-        # Calculate choice accuracy
-        self.choice_accuracy = (choices == predicted_choices).mean()
+        # Market shares, confusion matrix and choice accuracy in one pass
+        self.calculate_choice_accuracy(simulatedValues[prob_columns].to_numpy())
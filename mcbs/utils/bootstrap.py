@@ -0,0 +1,262 @@
+"""
+Bootstrap standard errors and confidence intervals of estimated models.
+
+Each replicate resamples the observations, or the respondents or households
+of panel data, with replacement. A resampled unit drawn k times is the same
+as its rows standing for k observations, so the replicates are estimated as
+frequency-weighted data (see BaseDiscreteChoiceModel._collapse_duplicates)
+without copying the rows, warm-started from the full-sample estimates.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager, redirect_stdout
+import copy
+import csv
+import io
+import logging
+import os
+import shutil
+import tempfile
+from typing import Dict, Optional, Sequence, Union
+import numpy as np
+import pandas as pd
+
+# Number of replicates when the parameter file does not set bootstrap_samples
+DEFAULT_REPLICATES = 100
+
+# Model and resampling units of the replicates run by this process
+_template = None
+_units = None
+
+
+def bootstrap_samples(parameter_file: str) -> int:
+    """
+    Get the number of bootstrap replicates set in a Biogeme parameter file.
+
+    Args:
+        parameter_file: Path of the biogeme.toml file
+
+    Returns:
+        int: bootstrap_samples of the [Estimation] section, or
+        DEFAULT_REPLICATES if the file or the setting does not exist
+    """
+    import tomlkit
+
+    if not os.path.exists(parameter_file):
+        return DEFAULT_REPLICATES
+    with open(parameter_file, encoding='utf-8') as f:
+        parameters = tomlkit.parse(f.read())
+    return int(parameters.get('Estimation', {}).get('bootstrap_samples', DEFAULT_REPLICATES))
+
+
+def resampling_units(model, resample_by: Optional[Union[str, Sequence[str]]]) -> np.ndarray:
+    """
+    Get the resampling unit (0..U-1) of each row of a model's data.
+
+    Args:
+        model: Estimated BaseDiscreteChoiceModel
+        resample_by: Column, or list of columns, identifying the units (None
+            or an empty list to resample the rows)
+
+    Returns:
+        np.ndarray: Unit number of each row
+    """
+    data = model.database.data
+    if resample_by is None or len(resample_by) == 0:
+        return np.arange(len(data))
+    if model.frequencies is not None:
+        raise ValueError("Collapsed data can only be resampled by rows, since its rows "
+                         "may merge several respondents")
+    columns = [resample_by] if isinstance(resample_by, str) else list(resample_by)
+    return data.groupby(columns, sort=False).ngroup().to_numpy()
+
+
+def replicate_counts(rng: np.random.Generator, units: np.ndarray,
+                     frequencies: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Draw the number of times each row is resampled in a replicate.
+
+    Args:
+        rng: Random generator of the replicate
+        units: Resampling unit of each row
+        frequencies: Number of observations each row stands for in
+            collapsed data (None if not collapsed)
+
+    Returns:
+        np.ndarray: Count of each row (zero for the rows left out)
+    """
+    if frequencies is not None:
+        n_obs = int(frequencies.sum())
+        return rng.multinomial(n_obs, frequencies / n_obs)
+    n_units = int(units.max()) + 1
+    unit_counts = np.bincount(rng.integers(0, n_units, n_units), minlength=n_units)
+    return unit_counts[units]
+
+
+def replicate_statistics(model) -> Dict[str, float]:
+    """
+    Get the bootstrapped statistics of an estimated model.
+
+    These are the parameters, the values of time reported by get_metrics,
+    and the predicted market share of each alternative (share_<alternative>).
+
+    Args:
+        model: Estimated BaseDiscreteChoiceModel
+
+    Returns:
+        Dict mapping statistic names to values
+    """
+    statistics = {name: float(value) for name, value in model.results.get_beta_values().items()}
+    metrics = model.get_metrics()
+    for name, value in metrics.items():
+        if name.startswith('vot') and isinstance(value, (int, float, np.number)):
+            statistics[name] = float(value)
+    for alternative, share in (metrics.get('predicted_shares') or {}).items():
+        statistics[f'share_{alternative}'] = float(share)
+    return statistics
+
+
+@contextmanager
+def _quiet():
+    """Silence the model output and the Biogeme log of a replicate."""
+    previous = logging.root.manager.disable
+    logging.disable(logging.WARNING)
+    try:
+        with redirect_stdout(io.StringIO()):
+            yield
+    finally:
+        logging.disable(previous)
+
+
+def _initialize(template, units):
+    """Set the model and resampling units of the replicates run by this process."""
+    global _template, _units
+    _template, _units = template, units
+
+
+def _run_replicate(replicate: int, seed: np.random.SeedSequence, work_dir: str):
+    """
+    Estimate one bootstrap replicate of the template model.
+
+    Args:
+        replicate: Replicate number
+        seed: Seed of the replicate, so the replicates do not depend on
+            which process runs them
+        work_dir: Directory under which the replicate gets its own scratch
+            directory, so Biogeme never warm-starts from another run's
+            iteration file
+
+    Returns:
+        Tuple of (replicate, statistics dict, or an error message string)
+    """
+    counts = replicate_counts(np.random.default_rng(seed), _units, _template.frequencies)
+    rows = np.flatnonzero(counts)
+    model = _template._subset(rows, counts[rows])
+    model.work_dir = tempfile.mkdtemp(prefix=f'replicate_{replicate}_', dir=work_dir)
+    try:
+        with _quiet(), model.working_directory():
+            model.estimate()
+        return replicate, replicate_statistics(model)
+    except Exception as e:
+        return replicate, f"{type(e).__name__}: {e}"
+    finally:
+        shutil.rmtree(model.work_dir, ignore_errors=True)
+
+
+def bootstrap_model(model,
+                    n_replicates: Optional[int] = None,
+                    n_jobs: int = 1,
+                    seed: Optional[int] = None,
+                    output_file: Optional[str] = None,
+                    resample_by: Optional[Union[str, Sequence[str]]] = None,
+                    alpha: float = 0.05) -> pd.DataFrame:
+    """
+    Bootstrap the estimates of a model.
+
+    Args:
+        model: Estimated BaseDiscreteChoiceModel supporting frequency weights
+        n_replicates: Number of replicates (defaults to bootstrap_samples of
+            the model's parameter file)
+        n_jobs: Number of worker processes; 1 estimates the replicates one
+            after another in the current process
+        seed: Seed of the resampling
+        output_file: Optional CSV file to which the statistics of each
+            replicate are written as soon as it is estimated
+        resample_by: Column, or list of columns, identifying the units to
+            resample (defaults to the model's panel_column; an empty list
+            resamples the rows)
+        alpha: Significance level of the percentile confidence intervals
+
+    Returns:
+        DataFrame indexed by statistic with its full-sample value, bootstrap
+        standard error and percentile confidence interval
+    """
+    if model.results is None:
+        raise RuntimeError("Model must be estimated before bootstrapping")
+    if not model.frequency_weights:
+        raise ValueError(f"{type(model).__name__} does not support frequency-weighted "
+                         f"estimation, which the bootstrap replicates use")
+    if n_replicates is None:
+        n_replicates = bootstrap_samples(model.parameter_file)
+    if resample_by is None:
+        resample_by = model.panel_column
+
+    full_sample = replicate_statistics(model)
+    template = copy.copy(model)
+    template.parameter_file = os.path.abspath(model.parameter_file)
+    template.start_values = model.results.get_beta_values()
+    units = resampling_units(model, resample_by)
+    seeds = np.random.SeedSequence(seed).spawn(n_replicates)
+    work_dir = tempfile.mkdtemp(prefix='mcbs_bootstrap_')
+
+    replicates = {}
+    errors = {}
+    output = open(output_file, 'w', newline='', encoding='utf-8') if output_file else None
+    try:
+        writer = None
+        if output is not None:
+            writer = csv.DictWriter(output, fieldnames=['replicate'] + list(full_sample),
+                                    extrasaction='ignore')
+            writer.writeheader()
+            output.flush()
+
+        def record(replicate, result):
+            if isinstance(result, str):
+                errors[replicate] = result
+                return
+            replicates[replicate] = result
+            if writer is not None:
+                writer.writerow({'replicate': replicate, **result})
+                output.flush()
+
+        if n_jobs == 1:
+            _initialize(template, units)
+            for replicate, replicate_seed in enumerate(seeds):
+                record(*_run_replicate(replicate, replicate_seed, work_dir))
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=_initialize,
+                                     initargs=(template, units)) as pool:
+                futures = [pool.submit(_run_replicate, replicate, replicate_seed, work_dir)
+                           for replicate, replicate_seed in enumerate(seeds)]
+                for future in as_completed(futures):
+                    record(*future.result())
+    finally:
+        if output is not None:
+            output.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if errors:
+        model.logger.warning(f"{len(errors)} of {n_replicates} bootstrap replicates failed, "
+                             f"e.g. replicate {min(errors)}: {errors[min(errors)]}")
+    if not replicates:
+        raise RuntimeError("All bootstrap replicates failed")
+
+    values = pd.DataFrame.from_dict(replicates, orient='index').sort_index()
+    values = values.reindex(columns=list(full_sample))
+    model.bootstrap_replicates = values
+    return pd.DataFrame({
+        'Value': pd.Series(full_sample),
+        'Bootstrap std err': values.std(ddof=1),
+        f'Lower {100 * (1 - alpha):g}% CI': values.quantile(alpha / 2),
+        f'Upper {100 * (1 - alpha):g}% CI': values.quantile(1 - alpha / 2),
+    })
@@ -1,11 +1,41 @@
 # mcbs/utils/individual_parameters.py
 
 import numpy as np
-from typing import Dict, Any, List, Tuple
+from typing import Any, Optional, Sequence, Tuple
 import pandas as pd
 import biogeme.database as db
-import biogeme.biogeme as bio
-from biogeme.expressions import Expression, Beta, bioDraws, exp
+from biogeme.expressions import Beta, bioDraws, exp
+
+def _swissmetro_choices(chosen: np.ndarray) -> np.ndarray:
+    """
+    Map Swissmetro choices to the columns of the car, train and Swissmetro utilities
+
+    Args:
+        chosen: Array of chosen alternatives (1 car, 2 train, otherwise Swissmetro)
+
+    Returns:
+        Array of column indices
+    """
+    return np.where(chosen == 1, 0, np.where(chosen == 2, 1, 2))
+
+def _posterior_frame(posterior: Any,
+                     quantiles: Sequence[float],
+                     index: pd.Index) -> pd.DataFrame:
+    """
+    Arrange the posterior distributions of the individuals in a DataFrame
+
+    Args:
+        posterior: Posterior returned by the engine
+        quantiles: Levels of the posterior quantiles
+        index: Index of the individuals
+
+    Returns:
+        DataFrame with the posterior mean, standard deviation and quantiles
+    """
+    frame = pd.DataFrame({'mean': posterior.mean, 'std': posterior.std}, index=index)
+    for level, values in zip(quantiles, posterior.quantiles.T):
+        frame[f"q{level:g}"] = values
+    return frame
 
 class IndividualParameterCalculator:
     """Calculates individual-specific parameters from mixture model results"""
@@ -29,6 +59,39 @@ class IndividualParameterCalculator:
         self.choice_col = choice_col
         self.parameter_name = parameter_name
         
+    def calculate_posterior(self,
+                            n_draws: int = 1000,
+                            seed: int = 42,
+                            quantiles: Sequence[float] = (0.05, 0.5, 0.95)) -> pd.DataFrame:
+        """
+        Calculate the posterior distribution of the parameter for each observation
+
+        The parameter is drawn from a normal distribution with the estimate
+        as mean and its robust standard error as standard deviation, and the
+        draws are weighted by the probability of the observed choice.
+
+        Args:
+            n_draws: Number of draws to use in Monte Carlo simulation
+            seed: Random seed for reproducibility
+            quantiles: Levels of the posterior quantiles
+
+        Returns:
+            DataFrame with the posterior mean, standard deviation and
+            quantiles, indexed like the data
+        """
+        from ..engine.posterior import individual_posteriors
+
+        estimates = self.model_results.getEstimatedParameters()
+        param_mean = estimates.loc[self.parameter_name, 'Value']
+        param_std = estimates.loc[self.parameter_name, 'Rob. Std err']
+        draws = np.random.RandomState(seed).standard_normal(n_draws)
+
+        utilities, attributes, choices, availability = self._utility_components()
+        posterior = individual_posteriors(utilities, attributes, choices, draws,
+                                          param_mean, param_std,
+                                          availability=availability, quantiles=quantiles)
+        return _posterior_frame(posterior, quantiles, self.database.data.index)
+
     def calculate_individual_parameters(self, 
                                      n_draws: int = 1000,
                                      seed: int = 42) -> pd.Series:
@@ -42,84 +105,34 @@ class IndividualParameterCalculator:
         Returns:
             Series containing individual parameter values indexed by person ID
         """
-        # Set random seed
-        np.random.seed(seed)
-        
-        # Get parameter distribution from model results
-        betas = self.model_results.getBetaValues()
-        std_errs = self.model_results.getStdErrValues()
-        param_mean = betas[self.parameter_name]
-        param_std = std_errs[self.parameter_name]
-        
-        # Generate random draws
-        random_draws = np.random.normal(param_mean, param_std, n_draws)
-        
-        # Calculate probabilities for each draw
-        probs = []
-        for beta_r in random_draws:
-            # Update model formulation with this draw
-            prob = self._calculate_choice_probability(beta_r)
-            probs.append(prob)
-            
-        probs = np.array(probs)
-        
-        # Calculate individual parameters using Bayes formula
-        beta_weights = random_draws[:, np.newaxis] * probs
-        individual_betas = np.sum(beta_weights, axis=0) / np.sum(probs, axis=0)
-        
-        return pd.Series(individual_betas, 
-                        index=self.database.data.index,
-                        name=f"{self.parameter_name}_individual")
+        posterior = self.calculate_posterior(n_draws, seed)
+        return posterior['mean'].rename(f"{self.parameter_name}_individual")
     
-    def _calculate_choice_probability(self, beta_value: float) -> np.ndarray:
+    def _utility_components(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, Optional[np.ndarray]]:
         """
-        Calculate choice probability for a given parameter value
+        Split the utilities into the terms with and without the parameter
         
-        Args:
-            beta_value: Parameter value to evaluate probability for
-            
         Returns:
-            Array of probabilities
+            Tuple of (N x J utilities without the parameter, N x J attributes
+            multiplied by the parameter, N chosen column indices, optional
+            N x J availabilities)
         """
         raise NotImplementedError(
-            "Implement specific choice probability calculation")
+            "Implement specific utility components")
 
 class SwissmetroIndividualCalculator(IndividualParameterCalculator):
     """Individual parameter calculator specifically for Swissmetro"""
     
-    def _calculate_choice_probability(self, beta_value: float) -> np.ndarray:
+    def _utility_components(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, Optional[np.ndarray]]:
         """
-        Calculate Swissmetro choice probabilities for a parameter value
+        Split the Swissmetro utilities into the time terms and the rest
         """
-        # Create database expressions
-        CAR_TT = Expression('CAR_TT', self.database.data['CAR_TT'])
-        TRAIN_TT = Expression('TRAIN_TT', self.database.data['TRAIN_TT'])
-        SM_TT = Expression('SM_TT', self.database.data['SM_TT'])
-        
-        # Parameters with fixed beta value
-        TRAIN_ASC = Beta('TRAIN_ASC', 0, None, None, 0)
-        SM_ASC = Beta('SM_ASC', 0, None, None, 0) 
-        BETA_TIME = Beta('BETA_TIME', beta_value, None, None, 0)
-        
-        # Calculate utilities
-        V_TRAIN = TRAIN_ASC + BETA_TIME * TRAIN_TT 
-        V_SM = SM_ASC + BETA_TIME * SM_TT
-        V_CAR = BETA_TIME * CAR_TT
-        
-        # Calculate exponentials of utilities
-        e_train = np.exp(V_TRAIN.getValue())
-        e_sm = np.exp(V_SM.getValue())  
-        e_car = np.exp(V_CAR.getValue())
-        
-        # Get denominator
-        denom = e_train + e_sm + e_car
-        
-        # Get probabilities for chosen alternative
-        chosen = self.database.data[self.choice_col].values
-        probs = np.where(chosen == 1, e_car/denom,
-                np.where(chosen == 2, e_train/denom, e_sm/denom))
-        
-        return probs
+        data = self.database.data
+        # Car, train and Swissmetro, without constants
+        attributes = data[['CAR_TT', 'TRAIN_TT', 'SM_TT']].to_numpy(dtype=float)
+        utilities = np.zeros_like(attributes)
+        choices = _swissmetro_choices(data[self.choice_col].values)
+        return utilities, attributes, choices, None
 
 def plot_individual_parameters(param_values: pd.Series,
                              chosen_alt: pd.Series,
@@ -171,9 +184,46 @@ class RandomCoefficientCalculator:
         self.database = db.Database("random_coef", data)
         self.choice_col = choice_col
         
+    def calculate_posterior(self,
+                            n_draws: int = 1000,
+                            seed: int = 42,
+                            quantiles: Sequence[float] = (0.05, 0.5, 0.95)) -> pd.DataFrame:
+        """
+        Calculate the posterior distribution of the time parameter for each observation
+
+        The time parameter is -exp(MU + SIGMA * xi) with xi standard normal,
+        and one set of draws of xi is shared by all observations.
+
+        Args:
+            n_draws: Number of draws for Monte Carlo simulation
+            seed: Random seed for reproducibility
+            quantiles: Levels of the posterior quantiles
+
+        Returns:
+            DataFrame with the posterior mean, standard deviation and
+            quantiles, indexed like the data
+        """
+        from ..engine.posterior import individual_posteriors
+
+        betas = self.model_results.getBetaValues()
+        draws = np.random.RandomState(seed).standard_normal(n_draws)
+
+        data = self.database.data
+        # Car, train and Swissmetro
+        attributes = data[['CAR_TT', 'TRAIN_TT', 'SM_TT']].to_numpy(dtype=float)
+        costs = data[['CAR_CO', 'TRAIN_CO', 'SM_CO']].to_numpy(dtype=float)
+        constants = np.array([betas['ASC_CAR'], betas['ASC_TRAIN'], betas['ASC_SM']])
+        utilities = constants + betas['B_COST'] * costs
+        choices = _swissmetro_choices(data[self.choice_col].values)
+
+        posterior = individual_posteriors(utilities, attributes, choices, draws,
+                                          betas['MU'], betas['SIGMA'], 'negative_lognormal',
+                                          quantiles=quantiles)
+        return _posterior_frame(posterior, quantiles, data.index)
+
     def calculate_individual_betas(self, 
                                  n_draws: int = 1000,
-                                 seed: int = 42) -> pd.DataFrame:
+                                 seed: int = 42) -> pd.Series:
         """
         Calculate individual-specific parameters using Bayes theorem
         
@@ -184,77 +234,10 @@ class RandomCoefficientCalculator:
             seed: Random seed for reproducibility
             
         Returns:
-            DataFrame containing individual parameter values
-        """
-        np.random.seed(seed)
-        
-        # Get parameter estimates
-        betas = self.model_results.getBetaValues()
-        mu = betas['MU']  
-        sigma = betas['SIGMA']
-        
-        # Generate random draws from lognormal distribution
-        beta_draws = -np.exp(mu + sigma * np.random.normal(0, 1, (n_draws, len(self.database.data))))
-        
-        # Calculate choice probabilities for each draw
-        all_probs = []
-        for draw in range(n_draws):
-            probs = self._calculate_choice_probability(beta_draws[draw])
-            all_probs.append(probs)
-        
-        # Stack probabilities
-        all_probs = np.array(all_probs)
-        
-        # Calculate individual parameters using Bayes formula
-        # E[β|i] = ∑(β_r * P(i|β_r)) / ∑P(i|β_r)
-        weights = beta_draws * all_probs
-        individual_betas = np.sum(weights, axis=0) / np.sum(all_probs, axis=0)
-        
-        return pd.Series(individual_betas, 
-                        index=self.database.data.index,
-                        name='beta_time_individual')
-
-    def _calculate_choice_probability(self, beta_time: float) -> np.ndarray:
+            Series containing individual parameter values
         """
-        Calculate choice probability for given time parameter
-        """
-        # Get other parameters from model
-        betas = self.model_results.getBetaValues()
-        
-        # Parameters
-        ASC_CAR = Beta('ASC_CAR', betas['ASC_CAR'], None, None, 0)
-        ASC_TRAIN = Beta('ASC_TRAIN', betas['ASC_TRAIN'], None, None, 0)
-        ASC_SM = Beta('ASC_SM', betas['ASC_SM'], None, None, 0)
-        B_COST = Beta('B_COST', betas['B_COST'], None, None, 0)
-        B_TIME = Beta('B_TIME', beta_time, None, None, 0)
-        
-        # Calculate utilities
-        V_TRAIN = ASC_TRAIN + \
-                  B_TIME * self.database.TRAIN_TT + \
-                  B_COST * self.database.TRAIN_CO
-        
-        V_CAR = ASC_CAR + \
-                B_TIME * self.database.CAR_TT + \
-                B_COST * self.database.CAR_CO
-        
-        V_SM = ASC_SM + \
-               B_TIME * self.database.SM_TT + \
-               B_COST * self.database.SM_CO
-        
-        # Calculate exponentials
-        e_train = np.exp(V_TRAIN.getValue())
-        e_sm = np.exp(V_SM.getValue())  
-        e_car = np.exp(V_CAR.getValue())
-        
-        # Get denominator
-        denom = e_train + e_sm + e_car
-        
-        # Get probabilities for chosen alternative
-        chosen = self.database.data[self.choice_col].values
-        probs = np.where(chosen == 1, e_car/denom,
-                        np.where(chosen == 2, e_train/denom, e_sm/denom))
-        
-        return probs
+        posterior = self.calculate_posterior(n_draws, seed)
+        return posterior['mean'].rename('beta_time_individual')
 
 def plot_individual_betas_by_mode(betas: pd.Series,
                                 chosen_mode: pd.Series,
@@ -1,7 +1,7 @@
 # mcbs/utils/metrics.py
 
 import numpy as np
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Sequence
 
 def calculate_metrics(biogeme_results: Any, y_true: np.ndarray, y_pred: np.ndarray) -> Dict[str, float]:
     """
@@ -74,4 +74,72 @@ def calculate_value_of_time(time_coeff: float, cost_coeff: float) -> float:
     """
     return abs(time_coeff / cost_coeff) * 60  # Assuming time is in minutes and cost is in currency units
 
+def _choice_codes(choices: np.ndarray, alternatives: Sequence[int]) -> np.ndarray:
+    """
+    Map alternative ids to column indices of the probability matrix.
+    
+    Args:
+        choices (np.ndarray): Chosen alternative ids
+        alternatives (Sequence[int]): Alternative ids, in column order
+    
+    Returns:
+        np.ndarray: Column index of each choice
+    """
+    choices = np.asarray(choices).astype(np.int64)
+    alternatives = np.asarray(alternatives, dtype=np.int64)
+    lookup = np.full(max(alternatives.max(), choices.max(initial=0)) + 1, -1, dtype=np.int64)
+    lookup[alternatives] = np.arange(len(alternatives))
+    if choices.min(initial=0) < 0 or np.any(lookup[choices] < 0):
+        unknown = np.setdiff1d(np.unique(choices), alternatives)
+        raise ValueError(f"Choices {unknown.tolist()} are not in alternatives {alternatives.tolist()}")
+    return lookup[choices]
+
+def calculate_choice_metrics(probabilities: np.ndarray,
+                             choices: np.ndarray,
+                             alternatives: Optional[Sequence[int]] = None,
+                             weights: Optional[np.ndarray] = None) -> Dict[str, Any]:
+    """
+    Calculate market shares, confusion matrix and choice accuracy in one pass.
+    
+    Args:
+        probabilities (np.ndarray): N x J matrix of choice probabilities
+        choices (np.ndarray): Chosen alternative id of each observation
+        alternatives (Sequence[int], optional): Alternative ids, in column order
+            (defaults to 1..J)
+        weights (np.ndarray, optional): Observation weights
+    
+    Returns:
+        Dict[str, Any]: Actual and predicted shares (length J arrays), market
+        share accuracy, J x J confusion matrix (rows actual, columns predicted)
+        and choice accuracy
+    """
+    probabilities = np.asarray(probabilities, dtype=float)
+    n_alternatives = probabilities.shape[1]
+    if alternatives is None:
+        alternatives = np.arange(1, n_alternatives + 1)
+    
+    actual = _choice_codes(choices, alternatives)
+    predicted = np.argmax(probabilities, axis=1)
+    if weights is not None:
+        weights = np.asarray(weights, dtype=float)
+        total = weights.sum()
+        predicted_shares = weights @ probabilities / total
+    else:
+        total = len(actual)
+        predicted_shares = probabilities.mean(axis=0)
+    
+    # Each (actual, predicted) pair is a cell of the flattened J x J matrix
+    confusion = np.bincount(actual * n_alternatives + predicted, weights=weights,
+                            minlength=n_alternatives * n_alternatives)
+    confusion = confusion.reshape(n_alternatives, n_alternatives)
+    actual_shares = confusion.sum(axis=1) / total
+    
+    return {
+        'actual_shares': actual_shares,
+        'predicted_shares': predicted_shares,
+        'market_share_accuracy': 1 - np.abs(actual_shares - predicted_shares).sum() / 2,
+        'confusion_matrix': confusion,
+        'choice_accuracy': np.trace(confusion) / total
+    }
+
 # Additional helper functions can be added here as needed
\ No newline at end of file
@@ -1,11 +1,10 @@
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from typing import Dict, Tuple, Callable
-from scipy.optimize import minimize
+from typing import Dict, Callable
 
-from mcbs.benchmarking.benchmark import Benchmark
 from mcbs.datasets.dataset_loader import DatasetLoader
+from mcbs.engine.calibration import calibrate_constants
 
 
 class SwissmetroCalibrator:
@@ -47,19 +46,6 @@ class SwissmetroCalibrator:
         
         return probabilities
     
-    def _objective_function(self, asc_values: np.ndarray) -> float:
-        """Objective function for optimization."""
-        params = {
-            'ASC_TRAIN': asc_values[0],
-            'ASC_CAR': asc_values[1]
-        }
-        
-        probabilities = self._calculate_probabilities(params)
-        predicted_shares = probabilities.mean(axis=0)
-        
-        observed = np.array([self.observed_shares[mode] for mode in self.mode_list])
-        return np.sum((predicted_shares - observed) ** 2)
-    
     def calibrate(self, initial_ascs: Dict[str, float] = None) -> Dict[str, float]:
         """
         Calibrate alternative specific constants.
@@ -70,18 +56,21 @@ class SwissmetroCalibrator:
         if initial_ascs is None:
             initial_ascs = {'ASC_TRAIN': 0.0, 'ASC_CAR': 0.0}
         
-        x0 = np.array([initial_ascs['ASC_TRAIN'], initial_ascs['ASC_CAR']])
+        availabilities = self.data[['TRAIN_AV', 'SM_AV', 'CAR_AV']].to_numpy()
+        observed = np.array([self.observed_shares[mode] for mode in self.mode_list])
         
-        result = minimize(
-            self._objective_function,
-            x0,
-            method='Nelder-Mead',
-            options={'maxiter': 1000}
+        # Newton's method on the share equations, from the utilities without the ASCs
+        result = calibrate_constants(
+            self.utility_func(self.data, {}),
+            observed,
+            columns=[0, 2],
+            constants=[initial_ascs['ASC_TRAIN'], initial_ascs['ASC_CAR']],
+            availability=availabilities
         )
         
         return {
-            'ASC_TRAIN': result.x[0],
-            'ASC_CAR': result.x[1]
+            'ASC_TRAIN': result.constants[0],
+            'ASC_CAR': result.constants[1]
         }
 
 class SwissmetroValidator:
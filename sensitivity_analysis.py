@@ -4,50 +4,33 @@ Sensitivity Analysis Script for ModeCanada Models
 This script performs sensitivity analysis by:
 1. Estimating models ONCE on original dataset
 2. Calibrating ASCs for NL and ML models to match observed shares
-3. Creating modified datasets with different cost/time scenarios
-4. Simulating using calibrated models on modified datasets
+3. Defining cost/time scenarios as modifications of the dataset
+4. Simulating all scenarios at once using the calibrated models
 5. Plotting evolution of predicted shares
 """
 
 from mcbs.datasets import DatasetLoader
 from mcbs.models.modecanada_model import MultinomialLogitModel_MC, NestedLogitModel3_MC, MixedLogitModel_MC
-import pandas as pd
-import numpy as np
 import json
 from datetime import datetime
 import matplotlib.pyplot as plt
-import biogeme.database as db
-import biogeme.biogeme as bio
-from biogeme import models
+from mcbs.engine import Modification, Scenario
 
-def modify_dataset(data, modification):
+def modification_scenario(modification):
     """
-    Create a modified version of the dataset based on specified changes.
+    Create the scenario of a modification of the dataset.
     
     Args:
-        data (pd.DataFrame): Original dataset
         modification (dict): Dictionary specifying the modifications
-            e.g., {'mode': 'bus', 'variable': 'cost', 'change': -0.25}
+            e.g., {'mode': 'bus', 'variable': 'cost', 'change': -0.25, 'name': 'bus_cost_minus25'}
     
     Returns:
-        pd.DataFrame: Modified dataset
+        Scenario: Scenario scaling the attribute of the mode (total time is
+        in-vehicle plus out-of-vehicle time, so both are scaled)
     """
-    modified_data = data.copy()
-    
-    mode = modification['mode']
-    variable = modification['variable']
-    change = modification['change']
-    
-    # Apply modification only to specified mode
-    mask = modified_data['alt'] == mode
-    if variable == 'cost':
-        modified_data.loc[mask, 'cost'] *= (1 + change)
-    elif variable == 'time':
-        # Modify both in-vehicle and out-of-vehicle time
-        modified_data.loc[mask, 'ivt'] *= (1 + change)
-        modified_data.loc[mask, 'ovt'] *= (1 + change)
-    
-    return modified_data
+    column = f"{modification['mode']}_{modification['variable']}".upper()
+    return Scenario(modification['name'],
+                    [Modification(column, multiplier=1 + modification['change'])])
 
 def calculate_actual_shares(data):
     """
@@ -69,173 +52,37 @@ def calculate_actual_shares(data):
     
     return actual_shares
 
-def get_utility_functions(model, betas):
-    """
-    Get utility functions using provided beta values.
-    
-    Args:
-        model: Model instance
-        betas: Dictionary of beta values to use
-    
-    Returns:
-        tuple: (V1, V2, V3, V4) utility functions
-    """
-    if isinstance(model, NestedLogitModel3_MC):
-        V1 = (betas['ASC_TRAIN'] + 
-              betas['B_TIME'] * model.TRAIN_TIME + 
-              betas['B_COST'] * model.TRAIN_COST)
-        
-        V2 = (betas.get('ASC_CAR', 0) + 
-              betas['B_TIME'] * model.CAR_TIME + 
-              betas['B_COST'] * model.CAR_COST)
-        
-        V3 = (betas['ASC_BUS'] + 
-              betas['B_TIME'] * model.BUS_TIME + 
-              betas['B_COST'] * model.BUS_COST)
-        
-        V4 = (betas['ASC_AIR'] + 
-              betas['B_TIME'] * model.AIR_TIME + 
-              betas['B_COST'] * model.AIR_COST)
-    else:  # MNL and Mixed Logit
-        V1 = (betas['ASC_TRAIN'] + 
-              betas['B_TIME'] * model.TRAIN_TIME + 
-              betas['B_COST'] * model.TRAIN_COST)
-        
-        V2 = (betas.get('ASC_CAR', 0) + 
-              betas['B_TIME'] * model.CAR_TIME + 
-              betas['B_COST'] * model.CAR_COST)
-        
-        V3 = (betas['ASC_BUS'] + 
-              betas['B_TIME'] * model.BUS_TIME + 
-              betas['B_COST'] * model.BUS_COST)
-        
-        V4 = (betas['ASC_AIR'] + 
-              betas['B_TIME'] * model.AIR_TIME + 
-              betas['B_COST'] * model.AIR_COST)
-    
-    return V1, V2, V3, V4
-
 def simulate_market_shares(model, data, betas=None):
     """
     Simulate market shares for a given model and dataset.
     
     Args:
         model: Estimated model object (MNL, NL, or Mixed Logit)
-        data (pd.DataFrame): Dataset to simulate on
-        betas: Optional dictionary of beta values to use (if None, uses model.results.betas)
+        data (pd.DataFrame): Dataset the model was built on
+        betas: Optional dictionary of beta values to use (if None, uses the estimated values)
     
     Returns:
         dict: Dictionary containing simulated market shares
     """
-    # Use provided betas or get from model
-    if betas is None:
-        betas = model.results.get_beta_values()
-    
-    # Get utility functions
-    V1, V2, V3, V4 = get_utility_functions(model, betas)
-    
-    # Associate utility functions with alternatives
-    V = {1: V1, 2: V2, 3: V3, 4: V4}
-    
-    # Associate availability conditions
-    av = {1: model.TRAIN_AV,
-          2: model.CAR_AV,
-          3: model.BUS_AV,
-          4: model.AIR_AV}
-    
-    # Calculate choice probabilities based on model type
-    if isinstance(model, NestedLogitModel3_MC):
-        prob_train = models.nested(V, None, model.nests, 1)
-        prob_car = models.nested(V, None, model.nests, 2)
-        prob_bus = models.nested(V, None, model.nests, 3)
-        prob_air = models.nested(V, None, model.nests, 4)
-    else:  # MNL and Mixed Logit use standard logit probabilities
-        prob_train = models.logit(V, av, 1)
-        prob_car = models.logit(V, av, 2)
-        prob_bus = models.logit(V, av, 3)
-        prob_air = models.logit(V, av, 4)
-    
-    # Setup simulation
-    simulate = {
-        'Prob. train': prob_train,
-        'Prob. car': prob_car,
-        'Prob. bus': prob_bus,
-        'Prob. air': prob_air
-    }
-    
-    # Run simulation
-    biogeme = bio.BIOGEME(model.database, simulate)
-    biogeme.modelName = "market_share_simulation"
-    simulatedValues = biogeme.simulate(betas)
-    
-    # Calculate market shares (mean probability for each alternative)
-    market_shares = {
-        1: simulatedValues['Prob. train'].mean(),
-        2: simulatedValues['Prob. car'].mean(),
-        3: simulatedValues['Prob. bus'].mean(),
-        4: simulatedValues['Prob. air'].mean()
-    }
-    
-    return market_shares
+    shares = model.simulate_scenarios([Scenario('baseline', [])], betas)
+    return shares.loc['baseline'].to_dict()
 
 def calibrate_alternative_constants(model, data, actual_shares, max_iter=10, tolerance=1e-6):
     """
     Calibrate alternative-specific constants to match observed market shares.
-    Uses iterative process to ensure convergence.
+    Solves the share equations by Newton's method on the model's utilities.
     
     Args:
-        model: Estimated model object (NL or Mixed Logit)
+        model: Estimated model object (MNL, NL or Mixed Logit)
         data (pd.DataFrame): Original dataset
         actual_shares (dict): Dictionary of actual market shares
-        max_iter: Maximum number of iterations
+        max_iter: Maximum number of Newton iterations
         tolerance: Convergence tolerance for share differences
     
     Returns:
         dict: Adjusted beta values with calibrated ASCs
     """
-    # Get current beta values
-    beta_values = model.results.get_beta_values()
-    
-    # Add ASC_CAR if it doesn't exist (it's not estimated, fixed at 0)
-    if 'ASC_CAR' not in beta_values:
-        beta_values['ASC_CAR'] = 0
-    
-    # Define modes to calibrate
-    modes = {
-        1: 'ASC_TRAIN',
-        2: 'ASC_CAR',
-        3: 'ASC_BUS',
-        4: 'ASC_AIR'
-    }
-    
-    # Iterative calibration
-    for iteration in range(max_iter):
-        # Get current predicted shares using current betas
-        predicted_shares = simulate_market_shares(model, data, beta_values)
-        
-        # Calculate maximum absolute difference in shares
-        max_diff = max(abs(actual_shares[mode] - predicted_shares[mode]) 
-                      for mode in modes.keys())
-        
-        print(f"\nIteration {iteration + 1}")
-        print("Current shares:")
-        for mode in modes.keys():
-            print(f"Mode {mode}: Actual = {actual_shares[mode]:.3f}, "
-                  f"Predicted = {predicted_shares[mode]:.3f}")
-        print(f"Max difference: {max_diff:.6f}")
-        
-        # Check convergence
-        if max_diff < tolerance:
-            print("Converged!")
-            break
-        
-        # Adjust ASCs
-        for mode_num, asc_name in modes.items():
-            if mode_num in actual_shares and mode_num in predicted_shares:
-                adjustment = np.log(actual_shares[mode_num] / predicted_shares[mode_num])
-                beta_values[asc_name] += adjustment
-    
-    return beta_values
+    return model.calibrate_constants(actual_shares, tolerance=tolerance, max_iter=max_iter)
 
 def estimate_base_models(data):
     """
@@ -303,50 +150,34 @@ def estimate_base_models(data):
     
     return mnl, nl, ml
 
-def simulate_models(data, mnl, nl, ml, scenario_name):
+def simulate_models(models, scenarios):
     """
-    Simulate using all model types on a given dataset.
+    Simulate all scenarios using all model types.
+    
+    Each model evaluates every scenario in one vectorized pass over its
+    baseline utilities, without copying the dataset or re-building the model.
     
     Args:
-        data (pd.DataFrame): Dataset to simulate on
-        mnl (MultinomialLogitModel_MC): Estimated MNL model
-        nl (NestedLogitModel3_MC): Estimated NL model
-        ml (MixedLogitModel_MC): Estimated Mixed Logit model
-        scenario_name (str): Name of the scenario being simulated
+        models (dict): Estimated and calibrated models by model type ('mnl', 'nl', 'ml');
+            the calibrated beta values are in results.betas
+        scenarios (list): Scenarios to simulate
     
     Returns:
-        dict: Dictionary containing simulation results for all models
+        list: One dictionary per scenario containing the results of all models
     """
-    results = {'scenario': scenario_name}
-    
-    # Create new model instances for simulation but use parameters from estimated models
-    mnl_sim = MultinomialLogitModel_MC(data)
-    mnl_sim.results = mnl.results
-    mnl_shares = simulate_market_shares(mnl_sim, data)
-    
-    nl_sim = NestedLogitModel3_MC(data)
-    nl_sim.results = nl.results
-    nl_sim.nests = nl.nests  # Need to copy nests for NL model
-    nl_shares = simulate_market_shares(nl_sim, data)
-    
-    ml_sim = MixedLogitModel_MC(data)
-    ml_sim.results = ml.results
-    ml_shares = simulate_market_shares(ml_sim, data)
-    
-    # Store results for each model type
-    results['mnl'] = {
-        'predicted_shares': mnl_shares,
-    }
+    shares = {name: model.simulate_scenarios(scenarios, model.results.betas)
+              for name, model in models.items()}
     
-    results['nl'] = {
-        'predicted_shares': nl_shares,
-    }
-    
-    results['ml'] = {
-        'predicted_shares': ml_shares,
-    }
+    all_results = []
+    for scenario in scenarios:
+        results = {'scenario': scenario.name}
+        for name in models:
+            results[name] = {
+                'predicted_shares': shares[name].loc[scenario.name].to_dict(),
+            }
+        all_results.append(results)
     
-    return results
+    return all_results
 
 def plot_share_evolution(results, modification_group):
     """
@@ -423,20 +254,10 @@ def run_sensitivity_analysis():
         {'mode': 'air', 'variable': 'cost', 'change': 0.30, 'name': 'air_cost_plus30'}
     ]
     
-    # Store all results
-    all_results = []
-    
-    # Run baseline scenario simulation
-    print("\nSimulating baseline scenario...")
-    baseline_results = simulate_models(data, mnl, nl, ml, 'baseline')
-    all_results.append(baseline_results)
-    
-    # Simulate on each modified scenario
-    for mod in modifications:
-        print(f"\nSimulating {mod['name']} scenario...")
-        modified_data = modify_dataset(data, mod)
-        results = simulate_models(modified_data, mnl, nl, ml, mod['name'])
-        all_results.append(results)
+    # Simulate the baseline and all modified scenarios at once
+    print("\nSimulating scenarios...")
+    scenarios = [Scenario('baseline', [])] + [modification_scenario(mod) for mod in modifications]
+    all_results = simulate_models({'mnl': mnl, 'nl': nl, 'ml': ml}, scenarios)
     
     # Save results to JSON file
     output_file = f'sensitivity_analysis_results_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
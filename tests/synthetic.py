@@ -0,0 +1,44 @@
+"""Small synthetic choice models shared by the model-level tests."""
+
+import numpy as np
+import pandas as pd
+from mcbs.engine.mixed import RandomCoefficient
+from mcbs.models.base import BaseDiscreteChoiceModel
+
+def synthetic_data(n_obs=300, seed=0):
+    """Simulate MNL choices among three alternatives, three choices per respondent."""
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({'ID': np.arange(n_obs) // 3})
+    for j in (1, 2, 3):
+        data[f'TIME_{j}'] = rng.uniform(1, 5, n_obs)
+        data[f'COST_{j}'] = rng.uniform(1, 5, n_obs)
+    utilities = np.column_stack([-0.8 * data[f'TIME_{j}'] - 0.5 * data[f'COST_{j}'] + asc
+                                 for j, asc in ((1, 0.0), (2, 0.3), (3, -0.2))])
+    data['CHOICE'] = np.argmax(utilities + rng.gumbel(size=utilities.shape), axis=1) + 1
+    return data
+
+class SyntheticMNL(BaseDiscreteChoiceModel):
+    alternatives = [1, 2, 3]
+    panel_column = 'ID'
+    backend = 'numpy'
+
+    def estimate(self):
+        self.results = self._estimate_numpy('synthetic_mnl', random_coefficients=self.random_coefficients)
+        self.final_ll = self.results.getGeneralStatistics()['Final log likelihood'][0]
+        self.calculate_choice_accuracy()
+        return self.results
+
+    def _calculate_utilities(self, betas):
+        data = self.database.data
+        return np.column_stack([
+            betas['B_TIME'] * data['TIME_1'] + betas['B_COST'] * data['COST_1'],
+            betas['ASC_2'] + betas['B_TIME'] * data['TIME_2'] + betas['B_COST'] * data['COST_2'],
+            betas['ASC_3'] + betas['B_TIME'] * data['TIME_3'] + betas['B_COST'] * data['COST_3'],
+        ])
+
+class SyntheticMixed(SyntheticMNL):
+    frequency_weights = False
+    random_coefficients = [RandomCoefficient('B_TIME', 'B_TIME_S', 0.5)]
+    number_of_draws = 50
+    draw_type = 'pseudo'
+    panel = False
@@ -0,0 +1,96 @@
+import contextlib
+import io
+import os
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from mcbs.benchmarker import ModelBenchmarker
+from tests.synthetic import SyntheticMNL, synthetic_data
+
+class SlowMNL(SyntheticMNL):
+    delay = 1.0
+
+    def estimate(self):
+        time.sleep(self.delay)
+        return super().estimate()
+
+class StuckMNL(SlowMNL):
+    delay = 60.0
+
+class FailingMNL(SyntheticMNL):
+    def estimate(self):
+        raise RuntimeError("Estimation failed")
+
+class TestParallelBenchmark(unittest.TestCase):
+    def setUp(self):
+        self.data = synthetic_data()
+        self.benchmarker = ModelBenchmarker()
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.work_dir.cleanup)
+
+    def run_benchmark(self, models, **options):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return self.benchmarker.run_benchmark(self.data, models, work_dir=self.work_dir.name, **options)
+
+    def test_results_follow_model_order(self):
+        # The slow model is given first but finishes last
+        self.run_benchmark([SlowMNL, SyntheticMNL], n_jobs=2)
+        self.assertEqual(list(self.benchmarker.results), ['SlowMNL', 'SyntheticMNL'])
+        parallel = {name: outcome['metrics']['final_ll'] for name, outcome in self.benchmarker.results.items()}
+        self.assertIsInstance(self.benchmarker.results['SlowMNL']['model'], SlowMNL)
+
+        sequential = ModelBenchmarker()
+        with contextlib.redirect_stdout(io.StringIO()):
+            sequential.run_benchmark(self.data, [SyntheticMNL])
+        self.assertAlmostEqual(parallel['SyntheticMNL'], sequential.results['SyntheticMNL']['metrics']['final_ll'])
+        self.assertAlmostEqual(parallel['SlowMNL'], parallel['SyntheticMNL'])
+
+    def test_timed_out_model_is_stopped(self):
+        start = time.monotonic()
+        metrics = self.run_benchmark([StuckMNL, SyntheticMNL], n_jobs=2, timeout=1)
+        self.assertLess(time.monotonic() - start, 30)
+        self.assertEqual(self.benchmarker.results['StuckMNL']['error'], "Timed out after 1 seconds")
+        self.assertNotIn('error', self.benchmarker.results['SyntheticMNL'])
+        self.assertEqual(sorted(metrics['model_name']), ['StuckMNL', 'SyntheticMNL'])
+
+    def test_timeout_with_caller_executor(self):
+        # The second model waits for the single worker, which does not count towards its timeout
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            self.run_benchmark([SlowMNL, SyntheticMNL], timeout=0.3, executor=executor)
+        self.assertIn("keeps running in the executor", self.benchmarker.results['SlowMNL']['error'])
+        self.assertNotIn('error', self.benchmarker.results['SyntheticMNL'])
+
+class TestScratchDirectories(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.work_dir.cleanup)
+        self.parameter_file = os.path.join(self.work_dir.name, 'parameters.toml')
+        with open(self.parameter_file, 'w') as f:
+            f.write('[Estimation]\n')
+
+    def test_concurrent_runs_get_own_directories(self):
+        benchmarker = ModelBenchmarker()
+        runs = os.path.join(self.work_dir.name, 'runs')
+        with contextlib.redirect_stdout(io.StringIO()):
+            benchmarker.run_benchmark(synthetic_data(), [SlowMNL, SyntheticMNL], n_jobs=2,
+                                      work_dir=runs, parameter_file=self.parameter_file)
+        run_dirs = [outcome['work_dir'] for outcome in benchmarker.results.values()]
+        self.assertNotEqual(run_dirs[0], run_dirs[1])
+        for run_dir in run_dirs:
+            self.assertEqual(os.path.dirname(run_dir), runs)
+            with open(os.path.join(run_dir, 'biogeme.toml')) as f:
+                self.assertEqual(f.read(), '[Estimation]\n')
+
+    def test_directory_is_restored_when_estimation_fails(self):
+        previous_dir = os.getcwd()
+        with contextlib.redirect_stdout(io.StringIO()):
+            outcome = ModelBenchmarker._run_model(FailingMNL, synthetic_data(), work_dir=self.work_dir.name,
+                                                  parameter_file=self.parameter_file)
+        self.assertEqual(outcome, {'error': "Estimation failed"})
+        self.assertEqual(os.getcwd(), previous_dir)
+        run_dir, = [name for name in os.listdir(self.work_dir.name) if name.startswith('FailingMNL_')]
+        self.assertTrue(os.path.exists(os.path.join(self.work_dir.name, run_dir, 'biogeme.toml')))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from mcbs.utils.bootstrap import bootstrap_model, replicate_counts
+from tests.synthetic import SyntheticMixed, SyntheticMNL, synthetic_data
+
+class FailingMNL(SyntheticMNL):
+    """MNL whose bootstrap replicates fail (they are the warm-started estimations)."""
+
+    def estimate(self):
+        if self.start_values is not None:
+            raise RuntimeError("replicate failed")
+        return super().estimate()
+
+def estimated(model_class):
+    model = model_class(synthetic_data())
+    with contextlib.redirect_stdout(io.StringIO()):
+        model.estimate()
+    return model
+
+class TestReplicateCounts(unittest.TestCase):
+    def test_units_are_resampled_whole(self):
+        units = np.repeat(np.arange(50), np.arange(1, 51) % 4 + 1)
+        counts = replicate_counts(np.random.default_rng(2), units)
+        for unit in range(50):
+            self.assertEqual(len(set(counts[units == unit])), 1)
+        unit_counts = counts[np.unique(units, return_index=True)[1]]
+        self.assertEqual(unit_counts.sum(), 50)
+
+    def test_collapsed_rows_are_resampled_by_observation(self):
+        frequencies = np.array([5, 1, 3, 1])
+        counts = replicate_counts(np.random.default_rng(3), np.arange(4), frequencies)
+        self.assertEqual(counts.sum(), frequencies.sum())
+        seeded = replicate_counts(np.random.default_rng(3), np.arange(4), frequencies)
+        np.testing.assert_array_equal(counts, seeded)
+
+class TestBootstrapModel(unittest.TestCase):
+    def test_replicates_do_not_depend_on_the_number_of_processes(self):
+        model = estimated(SyntheticMNL)
+        with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()):
+            output_file = os.path.join(directory, 'replicates.csv')
+            serial = bootstrap_model(model, n_replicates=4, n_jobs=1, seed=7)
+            serial_replicates = model.bootstrap_replicates
+            parallel = bootstrap_model(model, n_replicates=4, n_jobs=2, seed=7,
+                                       output_file=output_file)
+            streamed = pd.read_csv(output_file, index_col='replicate').sort_index()
+
+        pd.testing.assert_frame_equal(serial, parallel)
+        pd.testing.assert_frame_equal(serial_replicates, model.bootstrap_replicates)
+        pd.testing.assert_frame_equal(streamed, model.bootstrap_replicates, check_names=False)
+        self.assertEqual(list(serial.index[:4]), ['ASC_2', 'ASC_3', 'B_COST', 'B_TIME'])
+        self.assertIn('share_1', serial.index)
+        self.assertTrue((serial['Bootstrap std err'] > 0).all())
+        self.assertTrue((serial.iloc[:, 2] <= serial.iloc[:, 3]).all())
+
+    def test_failed_replicates(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            with self.assertRaisesRegex(RuntimeError, "All bootstrap replicates failed"):
+                bootstrap_model(estimated(FailingMNL), n_replicates=2, seed=1)
+
+    def test_mixed_models_are_rejected(self):
+        with self.assertRaisesRegex(ValueError, "frequency-weighted"):
+            bootstrap_model(estimated(SyntheticMixed), n_replicates=2)
+
+if __name__ == '__main__':
+    unittest.main()
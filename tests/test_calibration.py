@@ -0,0 +1,63 @@
+import unittest
+import numpy as np
+from mcbs.engine.calibration import calibrate_constants
+from mcbs.engine.probabilities import logit_probabilities, nested_logit_probabilities
+
+class TestCalibration(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(5)
+        self.utilities = rng.normal(size=(200, 3)) - [0.0, 1.0, 2.0]
+        self.availability = np.ones((200, 3))
+        self.availability[:20, 2] = 0
+        self.target = np.array([0.3, 0.45, 0.25])
+
+    def shifted(self, constants):
+        return self.utilities + [constants[0], constants[1], 0.0]
+
+    def test_logit_shares_are_reproduced(self):
+        result = calibrate_constants(self.utilities, self.target, [0, 1],
+                                     availability=self.availability)
+        self.assertTrue(result.converged)
+        self.assertLess(result.iterations, 10)
+        shares = logit_probabilities(self.shifted(result.constants), self.availability).mean(axis=0)
+        np.testing.assert_allclose(shares, self.target, atol=1e-10)
+
+    def test_nested_logit_shares_are_reproduced(self):
+        nests = [(2.0, [1, 2])]
+        result = calibrate_constants(self.utilities, self.target, [0, 1],
+                                     availability=self.availability, nests=nests)
+        self.assertTrue(result.converged)
+        shares = nested_logit_probabilities(self.shifted(result.constants), nests,
+                                            self.availability).mean(axis=0)
+        np.testing.assert_allclose(shares, self.target, atol=1e-10)
+
+    def test_mixed_logit_shares_are_averaged_over_draws(self):
+        draws = np.random.default_rng(6).standard_normal((200, 50, 1))
+        utilities = self.utilities[:, np.newaxis] + draws * [0.0, 1.5, 0.0]
+        result = calibrate_constants(utilities, self.target, [0, 1], availability=self.availability)
+        self.assertTrue(result.converged)
+        kernel = logit_probabilities(utilities + [result.constants[0], result.constants[1], 0.0],
+                                     self.availability[:, np.newaxis])
+        np.testing.assert_allclose(kernel.mean(axis=(0, 1)), self.target, atol=1e-10)
+
+    def test_blocks_of_observations_give_the_same_constants(self):
+        draws = np.random.default_rng(6).standard_normal((200, 50, 1))
+        random_attributes = np.tile([0.0, 1.0, 0.0], (1, 200, 1))
+        full = calibrate_constants(self.utilities[:, np.newaxis] + draws * [0.0, 1.5, 0.0], self.target,
+                                   [0, 1], availability=self.availability)
+        blocked = calibrate_constants(self.utilities, self.target, [0, 1], availability=self.availability,
+                                      random_attributes=random_attributes, spreads=[1.5], draws=draws,
+                                      memory_budget=1)
+        self.assertTrue(blocked.converged)
+        np.testing.assert_allclose(blocked.constants, full.constants, atol=1e-10)
+        nests = [(2.0, [1, 2])]
+        for memory_budget in (1, 8 * 3 * 6 * 64):
+            result = calibrate_constants(self.utilities, self.target, [0, 1], availability=self.availability,
+                                         nests=nests, memory_budget=memory_budget)
+            np.testing.assert_allclose(result.constants,
+                                       calibrate_constants(self.utilities, self.target, [0, 1],
+                                                           availability=self.availability,
+                                                           nests=nests).constants, atol=1e-10)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+import numpy as np
+import pandas as pd
+from mcbs.engine.collapse import collapse_duplicates
+from mcbs.engine.mnl import estimate_mnl
+
+class TestCollapseDuplicates(unittest.TestCase):
+    def test_groups(self):
+        data = pd.DataFrame({'a': [1, 2, 1, 3, 2, 1],
+                             'b': [0.5, np.nan, 0.5, 1.0, np.nan, 0.7],
+                             'other': list('uvwxyz')})
+        collapsed, frequencies = collapse_duplicates(data, ['a', 'b'])
+        self.assertEqual(collapsed['other'].tolist(), ['u', 'v', 'x', 'z'])
+        self.assertEqual(frequencies.tolist(), [2, 2, 1, 1])
+        self.assertEqual(collapsed.index.tolist(), [0, 1, 2, 3])
+
+    def test_weighted_estimation_matches_full_data(self):
+        rng = np.random.default_rng(4)
+        n_unique = 300
+        X = np.zeros((n_unique, 3, 3))
+        X[:, 1, 0] = 1.0
+        X[:, 2, 1] = 1.0
+        X[:, :, 2] = rng.integers(0, 4, (n_unique, 3))
+        choices = rng.integers(0, 3, n_unique)
+        frequencies = rng.integers(1, 5, n_unique)
+        rows = np.repeat(np.arange(n_unique), frequencies)
+
+        full = estimate_mnl(X[rows], choices[rows])
+        collapsed = estimate_mnl(X, choices, frequencies=frequencies)
+        self.assertAlmostEqual(full.data.logLike, collapsed.data.logLike, places=8)
+        self.assertEqual(collapsed.data.sampleSize, len(rows))
+        np.testing.assert_allclose(collapsed.get_estimated_parameters().to_numpy(),
+                                   full.get_estimated_parameters().to_numpy(), rtol=1e-7)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import contextlib
+import io
+import tempfile
+import unittest
+import numpy as np
+from mcbs.benchmarker import ModelBenchmarker
+from mcbs.benchmarker.cross_validation import (cross_validate, group_kfold_splits, kfold_splits,
+                                               model_folds, time_splits)
+from tests.synthetic import SyntheticMNL, synthetic_data
+
+class TestFolds(unittest.TestCase):
+    def test_kfold_partitions_rows(self):
+        folds = kfold_splits(23, n_folds=4, seed=1)
+        held_out = np.concatenate([fold.test for fold in folds])
+        np.testing.assert_array_equal(np.sort(held_out), np.arange(23))
+        for fold in folds:
+            self.assertEqual(len(np.intersect1d(fold.train, fold.test)), 0)
+            self.assertEqual(len(fold.train) + len(fold.test), 23)
+
+    def test_groups_are_kept_whole(self):
+        groups = np.repeat(np.arange(10), 3)
+        for fold in group_kfold_splits(groups, n_folds=3, seed=2):
+            self.assertEqual(len(np.intersect1d(groups[fold.train], groups[fold.test])), 0)
+
+    def test_time_splits_predict_later_periods(self):
+        times = np.array([2, 1, 3, 1, 2, 3])
+        folds = time_splits(times)
+        self.assertEqual([fold.name for fold in folds], ['2', '3'])
+        np.testing.assert_array_equal(folds[0].train, [1, 3])
+        np.testing.assert_array_equal(folds[1].test, [2, 5])
+
+class TestCrossValidation(unittest.TestCase):
+    def setUp(self):
+        self.model = SyntheticMNL(synthetic_data())
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.model.estimate()
+
+    def test_folds_match_direct_evaluation(self):
+        folds = model_folds(self.model, n_folds=3, group_by='ID', seed=4)
+        with contextlib.redirect_stdout(io.StringIO()):
+            outcomes = cross_validate(self.model, folds, n_jobs=2)
+        self.assertNotIn('error', outcomes.columns)
+        self.assertEqual(outcomes['n_train'].tolist(), [len(fold.train) for fold in folds])
+        self.assertEqual(outcomes['n_test'].tolist(), [len(fold.test) for fold in folds])
+        self.assertEqual((outcomes['n_train'] + outcomes['n_test']).tolist(), [300] * 3)
+        self.assertTrue(np.isfinite(outcomes['test_ll']).all())
+        # The folds are warm-started on a copy of the model
+        self.assertIsNone(self.model.start_values)
+
+        for fold, outcome in zip(folds, outcomes.to_dict('records')):
+            train = self.model._subset(fold.train)
+            train.start_values = self.model.results.get_beta_values()
+            with contextlib.redirect_stdout(io.StringIO()):
+                train.estimate()
+            self.assertAlmostEqual(outcome['train_ll'], train.final_ll, places=6)
+            expected = self.model._subset(fold.test).evaluate(train.results.get_beta_values())
+            self.assertAlmostEqual(outcome['test_ll'], expected['test_ll'], places=6)
+            self.assertAlmostEqual(outcome['choice_accuracy'], expected['choice_accuracy'])
+
+    def test_benchmarker_cross_validation(self):
+        with tempfile.TemporaryDirectory() as work_dir, contextlib.redirect_stdout(io.StringIO()):
+            results = ModelBenchmarker().run_cross_validation(
+                synthetic_data(), [SyntheticMNL], n_folds=2, seed=1, n_jobs=2,
+                dataset_name='synthetic', work_dir=work_dir)
+        self.assertEqual(results['model_name'].tolist(), ['SyntheticMNL'] * 2)
+        self.assertEqual(results['dataset'].tolist(), ['synthetic'] * 2)
+        self.assertEqual(results['n_test'].sum(), 300)
+        self.assertTrue((results['test_ll'] < 0).all())
+
+if __name__ == '__main__':
+    unittest.main()
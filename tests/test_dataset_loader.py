@@ -0,0 +1,91 @@
+import unittest
+import os
+import shutil
+import tempfile
+from unittest import mock
+import pandas as pd
+from mcbs.datasets.dataset_loader import DatasetLoader, PARQUET_AVAILABLE
+from mcbs.datasets.memory_cache import DatasetCache
+
+class TestDatasetLoaderCache(unittest.TestCase):
+    def setUp(self):
+        # Seed the cache with the packaged file so no download is attempted
+        self.cache_dir = tempfile.mkdtemp()
+        self.loader = DatasetLoader(local_cache_dir=self.cache_dir)
+        filename = self.loader.get_dataset_info('swissmetro_dataset')['filename']
+        self.source = os.path.join(self.loader.datasets_path, filename)
+        os.makedirs(os.path.join(self.cache_dir, os.path.dirname(filename)))
+        shutil.copyfile(self.source, os.path.join(self.cache_dir, filename))
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    @unittest.skipUnless(PARQUET_AVAILABLE, "pyarrow is not installed")
+    def test_columnar_cache_round_trip(self):
+        first = self.loader.fetch_data('swissmetro_dataset')
+        parquet_files = [f for f in os.listdir(os.path.join(self.cache_dir, 'swissmetro'))
+                         if f.endswith('.parquet')]
+        self.assertEqual(len(parquet_files), 1)
+
+        second = self.loader.fetch_data('swissmetro_dataset')
+        pd.testing.assert_frame_equal(first, second)
+        pd.testing.assert_frame_equal(second, pd.read_csv(self.source), check_dtype=False)
+
+    def test_columns_and_filters(self):
+        full = pd.read_csv(self.source)
+        expected = full[full['PURPOSE'].isin([1, 3]) & (full['CHOICE'] != 0)]
+        expected = expected[['ID', 'CHOICE']].reset_index(drop=True)
+
+        filters = [('PURPOSE', 'in', [1, 3]), ('CHOICE', '!=', 0)]
+        # The first call parses the file, the second one reads the columnar cache
+        for _ in range(2):
+            df = self.loader.fetch_data('swissmetro_dataset', columns=['ID', 'CHOICE'], filters=filters)
+            pd.testing.assert_frame_equal(df, expected, check_dtype=False)
+
+    def test_unsupported_filter(self):
+        with self.assertRaises(ValueError):
+            self.loader.fetch_data('swissmetro_dataset', filters=[('ID', '~', 1)])
+
+    def test_dtype_schema(self):
+        df = self.loader.fetch_data('swissmetro_dataset')
+        dtypes = self.loader.get_dataset_info('swissmetro_dataset')['dtypes']
+        self.assertEqual({col: str(dtype) for col, dtype in df.dtypes.items()}, dtypes)
+        pd.testing.assert_frame_equal(df, pd.read_csv(self.source), check_dtype=False)
+
+    def test_memory_cache_is_read_only(self):
+        first = self.loader.fetch_data('swissmetro_dataset')
+        with self.assertRaises(ValueError):
+            first.loc[0, 'CHOICE'] = 99
+
+        # Replacing a column only affects the caller's own view
+        first['CHOICE'] = 99
+        second = DatasetLoader(local_cache_dir=self.cache_dir).fetch_data('swissmetro_dataset')
+        pd.testing.assert_series_equal(second['CHOICE'], pd.read_csv(self.source)['CHOICE'],
+                                       check_dtype=False)
+
+class TestRemoteLoads(unittest.TestCase):
+    def test_memory_cache_hit_does_not_download(self):
+        loader = DatasetLoader(use_local_cache=False)
+        loader.memory_cache = DatasetCache()
+        filename = loader.get_dataset_info('swissmetro_dataset')['filename']
+        with open(os.path.join(loader.datasets_path, filename), 'rb') as f:
+            content = f.read()
+        with mock.patch.object(loader, '_download_content', return_value=content) as download:
+            first = loader.fetch_data('swissmetro_dataset')
+            second = loader.fetch_data('swissmetro_dataset')
+        self.assertEqual(download.call_count, 1)
+        pd.testing.assert_frame_equal(first, second)
+
+class TestDatasetCache(unittest.TestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = DatasetCache(maxsize=2)
+        for key in 'abc':
+            if key == 'c':
+                cache.get('a')
+            cache.put(key, pd.DataFrame({'x': [1, 2]}))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(len(cache), 2)
+
+if __name__ == '__main__':
+    unittest.main()
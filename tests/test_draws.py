@@ -0,0 +1,26 @@
+import unittest
+import numpy as np
+from mcbs.engine.draws import GENERATORS, normal_draws
+
+class TestDraws(unittest.TestCase):
+    def test_shapes(self):
+        for draw_type in GENERATORS:
+            draws = normal_draws(draw_type, 7, 16, seed=1)
+            self.assertEqual(draws.shape, (7, 16))
+            self.assertTrue(np.all(np.isfinite(draws)))
+
+    def test_quasi_random_draws_are_more_accurate(self):
+        # Simulated E[exp(X)] = exp(0.5) per observation
+        errors = {}
+        for draw_type in GENERATORS:
+            draws = normal_draws(draw_type, 500, 20, seed=3)
+            errors[draw_type] = np.abs(np.exp(draws).mean(axis=1) - np.exp(0.5)).mean()
+        for draw_type in ('halton', 'sobol', 'mlhs'):
+            self.assertLess(errors[draw_type], errors['pseudo'])
+
+    def test_unknown_draw_type(self):
+        with self.assertRaises(ValueError):
+            normal_draws('uniform', 2, 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+import numpy as np
+from mcbs.engine.elasticities import (aggregate_elasticities, logit_elasticities,
+                                      mixed_logit_elasticities, nested_logit_elasticities)
+from mcbs.engine.probabilities import logit_probabilities, nested_logit_probabilities
+
+class TestElasticities(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        self.cost = rng.uniform(1, 5, size=(40, 3))
+        self.asc = np.array([0.0, 0.4, -0.2])
+        self.beta = -0.5
+        self.availability = np.ones((40, 3))
+        self.availability[:5, 1] = 0
+        # The cost of alternative j only enters its own utility
+        self.gradients = np.broadcast_to(self.beta * np.eye(3), (40, 3, 3)).copy()
+
+    def utilities(self, cost):
+        return self.asc + self.beta * cost
+
+    def finite_differences(self, probability_function, h=1e-6):
+        """Elasticities of the probabilities with respect to the cost of each alternative."""
+        base = probability_function(self.utilities(self.cost))
+        expected = np.empty((40, 3, 3))
+        for k in range(3):
+            step = np.zeros(3)
+            step[k] = h
+            up = probability_function(self.utilities(self.cost * (1 + step)))
+            down = probability_function(self.utilities(self.cost * (1 - step)))
+            with np.errstate(invalid='ignore'):
+                expected[:, :, k] = (up - down) / (2 * h) / base
+        return base, expected
+
+    def test_logit_matches_finite_differences(self):
+        probabilities, expected = self.finite_differences(
+            lambda v: logit_probabilities(v, self.availability))
+        elasticities = logit_elasticities(probabilities, self.gradients, self.cost)
+        np.testing.assert_allclose(elasticities, expected, atol=1e-6)
+        self.assertTrue(np.isnan(elasticities[:5, 1]).all())
+        # Aggregate elasticities are those of the predicted shares
+        _, share_elasticity = self.finite_differences(
+            lambda v: logit_probabilities(v, self.availability).sum(axis=0, keepdims=True))
+        np.testing.assert_allclose(aggregate_elasticities(probabilities, elasticities),
+                                   share_elasticity[0], atol=1e-6)
+
+    def test_nested_logit_matches_finite_differences(self):
+        nests = [(2.5, [1, 2])]
+        _, expected = self.finite_differences(
+            lambda v: nested_logit_probabilities(v, nests, self.availability))
+        _, elasticities = nested_logit_elasticities(self.utilities(self.cost), nests,
+                                                    self.gradients, self.cost, self.availability)
+        np.testing.assert_allclose(elasticities, expected, atol=1e-6)
+
+    def test_mixed_logit_with_zero_spread_is_logit(self):
+        draws = np.random.default_rng(0).standard_normal((40, 20, 1))
+        random_attributes = self.cost[np.newaxis]
+        random_gradients = np.eye(3)[np.newaxis, np.newaxis].repeat(40, axis=1)
+        probabilities, elasticities = mixed_logit_elasticities(
+            self.utilities(self.cost), self.gradients, self.cost, random_attributes,
+            random_gradients, np.array([0.0]), draws, availability=self.availability,
+            memory_budget=1)
+        expected = logit_probabilities(self.utilities(self.cost), self.availability)
+        np.testing.assert_allclose(probabilities, expected)
+        np.testing.assert_allclose(elasticities, logit_elasticities(expected, self.gradients, self.cost))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,22 @@
+import unittest
+import numpy as np
+from mcbs.engine.integration import gauss_hermite_normal, normal_expectation
+
+class TestGaussHermite(unittest.TestCase):
+    def test_normal_moments_are_exact(self):
+        nodes, weights = gauss_hermite_normal(5)
+        self.assertAlmostEqual(weights.sum(), 1.0)
+        for power, moment in [(1, 0.0), (2, 1.0), (4, 3.0), (6, 15.0)]:
+            self.assertAlmostEqual(np.dot(weights, nodes ** power), moment)
+
+    def test_logit_kernel_expectation(self):
+        # P = E[1 / (1 + exp(-(a + s X)))] against a fine grid integration
+        a, s = 0.3, 1.5
+        grid = np.linspace(-10, 10, 200001)
+        density = np.exp(-grid ** 2 / 2) / np.sqrt(2 * np.pi)
+        exact = np.sum(density / (1 + np.exp(-(a + s * grid)))) * (grid[1] - grid[0])
+        approx = normal_expectation(lambda x: 1 / (1 + np.exp(-(a + s * x))), 15)
+        self.assertAlmostEqual(approx, exact, places=5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+import numpy as np
+from mcbs.utils.metrics import calculate_choice_metrics
+
+class TestChoiceMetrics(unittest.TestCase):
+    def setUp(self):
+        # The third alternative is never chosen and never predicted
+        self.probabilities = np.array([[0.6, 0.3, 0.1],
+                                       [0.5, 0.4, 0.1],
+                                       [0.2, 0.7, 0.1],
+                                       [0.3, 0.6, 0.1]])
+        self.choices = np.array([10, 20, 20, 10])
+        self.alternatives = [10, 20, 30]
+
+    def test_metrics(self):
+        metrics = calculate_choice_metrics(self.probabilities, self.choices, self.alternatives)
+        np.testing.assert_allclose(metrics['actual_shares'], [0.5, 0.5, 0.0])
+        np.testing.assert_allclose(metrics['predicted_shares'], [0.4, 0.5, 0.1])
+        self.assertAlmostEqual(metrics['market_share_accuracy'], 0.9)
+        self.assertAlmostEqual(metrics['choice_accuracy'], 0.5)
+        np.testing.assert_array_equal(metrics['confusion_matrix'], [[1, 1, 0], [1, 1, 0], [0, 0, 0]])
+
+    def test_default_alternatives(self):
+        metrics = calculate_choice_metrics(self.probabilities, self.choices // 10)
+        np.testing.assert_array_equal(metrics['confusion_matrix'], [[1, 1, 0], [1, 1, 0], [0, 0, 0]])
+
+    def test_weights(self):
+        metrics = calculate_choice_metrics(self.probabilities, self.choices, self.alternatives,
+                                           weights=np.array([1, 3, 1, 1]))
+        np.testing.assert_allclose(metrics['actual_shares'], [2 / 6, 4 / 6, 0.0])
+        np.testing.assert_allclose(metrics['predicted_shares'], [2.6 / 6, 2.8 / 6, 0.1])
+        self.assertAlmostEqual(metrics['market_share_accuracy'], 1 - (0.6 / 6 + 1.2 / 6 + 0.1) / 2)
+        self.assertAlmostEqual(metrics['choice_accuracy'], 2 / 6)
+        np.testing.assert_allclose(metrics['confusion_matrix'], [[1, 1, 0], [3, 1, 0], [0, 0, 0]])
+
+    def test_unknown_choice(self):
+        with self.assertRaisesRegex(ValueError, r"Choices \[40\] are not in alternatives"):
+            calculate_choice_metrics(self.probabilities, [10, 20, 40, 10], self.alternatives)
+
+if __name__ == '__main__':
+    unittest.main()
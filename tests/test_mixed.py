@@ -0,0 +1,104 @@
+import unittest
+import numpy as np
+from mcbs.engine.mixed import MixedLogitDesign, RandomCoefficient, estimate_mixed_logit
+
+class TestNativeMixedLogit(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        n_obs = 2000
+        self.X = np.zeros((n_obs, 3, 4))
+        self.X[:, 1, 0] = 1.0
+        self.X[:, 2, 1] = 1.0
+        self.X[:, :, 2:] = rng.uniform(0, 2, (n_obs, 3, 2))
+        self.availability = np.ones((n_obs, 3))
+        self.availability[::4, 2] = 0
+
+        # Simulate choices with a normal coefficient N(-1, 0.8) on column 2
+        beta = np.array([0.3, -0.2, -1.0, -0.8])
+        utilities = self.X @ beta + 0.8 * self.X[:, :, 2] * rng.standard_normal((n_obs, 1))
+        utilities = np.where(self.availability == 1, utilities + rng.gumbel(size=(n_obs, 3)), -np.inf)
+        self.choices = utilities.argmax(axis=1)
+        self.draws = rng.standard_normal((n_obs, 50, 1))
+
+    def test_chunks_do_not_change_the_result(self):
+        theta = np.array([0.3, -0.2, -1.0, -0.8, 0.5])
+        whole = MixedLogitDesign(self.X, self.choices, [2], self.draws, self.availability)
+        chunked = MixedLogitDesign(self.X, self.choices, [2], self.draws, self.availability,
+                                   memory_budget=100_000)
+        self.assertEqual(len(whole.chunks), 1)
+        self.assertGreater(len(chunked.chunks), 20)
+        ll, gradient, _, _ = whole.loglikelihood(theta)
+        chunked_ll, chunked_gradient, _, _ = chunked.loglikelihood(theta)
+        self.assertAlmostEqual(ll, chunked_ll, places=8)
+        np.testing.assert_allclose(gradient, chunked_gradient, rtol=1e-10)
+
+    def test_gradient_matches_finite_differences(self):
+        design = MixedLogitDesign(self.X, self.choices, [2], self.draws, self.availability,
+                                  weights=np.linspace(0.5, 1.5, len(self.choices)),
+                                  memory_budget=500_000)
+        theta = np.array([0.3, -0.2, -1.0, -0.8, 0.5])
+        _, gradient, _, scores = design.loglikelihood(theta)
+        np.testing.assert_allclose(scores.sum(axis=0), gradient)
+        step = 1e-6
+        for k in range(len(theta)):
+            shift = np.zeros_like(theta)
+            shift[k] = step
+            numeric = (design.loglikelihood(theta + shift)[0] -
+                       design.loglikelihood(theta - shift)[0]) / (2 * step)
+            self.assertAlmostEqual(numeric, gradient[k], places=3)
+
+    def test_panel(self):
+        # Observations of the same individual are not consecutive
+        panel = np.arange(len(self.choices)) % 400
+        draws = self.draws[:400]
+        theta = np.array([0.3, -0.2, -1.0, -0.8, 0.5])
+        design = MixedLogitDesign(self.X, self.choices, [2], draws, self.availability,
+                                  panel=panel, memory_budget=100_000)
+        ll, gradient, _, scores = design.loglikelihood(theta)
+        self.assertEqual(scores.shape, (400, 5))
+
+        # Product of the kernels of each individual, averaged over their draws
+        expected = 0.0
+        for p in range(400):
+            rows = panel == p
+            utilities = (self.X[rows] @ theta[:4])[:, :, np.newaxis] + \
+                theta[4] * self.X[rows, :, 2][:, :, np.newaxis] * draws[p, :, 0]
+            utilities = np.where(self.availability[rows][:, :, np.newaxis] == 1, utilities, -np.inf)
+            log_kernel = (utilities[np.arange(rows.sum()), self.choices[rows]] -
+                          np.log(np.exp(utilities).sum(axis=1))).sum(axis=0)
+            expected += np.log(np.exp(log_kernel).mean())
+        self.assertAlmostEqual(ll, expected, places=8)
+
+        step = 1e-6
+        shift = np.zeros_like(theta)
+        shift[4] = step
+        numeric = (design.loglikelihood(theta + shift)[0] -
+                   design.loglikelihood(theta - shift)[0]) / (2 * step)
+        self.assertAlmostEqual(numeric, gradient[4], places=3)
+
+    def test_estimation(self):
+        results = estimate_mixed_logit(self.X, self.choices, [RandomCoefficient('B_TIME', 'B_TIME_S', 1.0)],
+                                       self.availability, names=['ASC_1', 'ASC_2', 'B_TIME', 'B_COST'],
+                                       number_of_draws=100, draw_type='halton', seed=1)
+        betas = results.get_beta_values()
+        self.assertEqual(list(betas), ['ASC_1', 'ASC_2', 'B_TIME', 'B_COST', 'B_TIME_S'])
+        std_err = results.get_estimated_parameters()['Rob. Std err']
+        self.assertLess(abs(betas['B_TIME'] + 1.0), 3 * std_err['B_TIME'])
+        self.assertLess(abs(betas['B_TIME_S'] - 0.8), 3 * std_err['B_TIME_S'])
+        self.assertEqual(results.data.numberOfDraws, 100)
+
+    def test_reported_spread_is_non_negative(self):
+        # Starting from a negative standard deviation converges to a negative one
+        results = estimate_mixed_logit(self.X, self.choices, [RandomCoefficient('B_TIME', 'B_TIME_S', 1.0)],
+                                       self.availability, names=['ASC_1', 'ASC_2', 'B_TIME', 'B_COST'],
+                                       draws=self.draws, beta0=[0.3, -0.2, -1.0, -0.8, -0.8])
+        betas = results.get_beta_values()
+        self.assertGreater(betas['B_TIME_S'], 0)
+        self.assertGreater(results.get_estimated_parameters()['Rob. t-test']['B_TIME_S'], 0)
+        # Same log likelihood as with the sign of the draws flipped
+        design = MixedLogitDesign(self.X, self.choices, [2], -self.draws, self.availability)
+        self.assertAlmostEqual(design.loglikelihood(results.data.betaValues)[0],
+                               results.data.logLike, places=8)
+
+if __name__ == '__main__':
+    unittest.main()
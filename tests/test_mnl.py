@@ -0,0 +1,56 @@
+import unittest
+import numpy as np
+from mcbs.engine.mnl import MNLDesign, estimate_mnl
+
+class TestNativeMNL(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        n_obs, n_alts = 2000, 3
+        # Parameters: ASC of alternatives 1 and 2, generic time, cost of alternative 2
+        self.X = np.zeros((n_obs, n_alts, 4))
+        self.X[:, 1, 0] = 1.0
+        self.X[:, 2, 1] = 1.0
+        self.X[:, :, 2] = rng.uniform(0, 2, (n_obs, n_alts))
+        self.X[:, 2, 3] = rng.uniform(0, 3, n_obs)
+        self.availability = np.ones((n_obs, n_alts))
+        self.availability[::4, 0] = 0
+        self.beta = np.array([0.5, -0.3, -1.2, -0.8])
+
+        utilities = self.X @ self.beta + rng.gumbel(size=(n_obs, n_alts))
+        utilities[self.availability == 0] = -np.inf
+        self.choices = utilities.argmax(axis=1)
+
+    def test_derivatives_match_finite_differences(self):
+        design = MNLDesign(self.X, self.choices, self.availability, weights=np.linspace(0.5, 1.5, 2000))
+        beta = np.array([0.1, 0.2, -0.5, 0.3])
+        _, gradient, hessian, scores = design.loglikelihood(beta)
+        np.testing.assert_allclose(scores.sum(axis=0), gradient)
+
+        step = 1e-6
+        for k in range(len(beta)):
+            shift = np.zeros_like(beta)
+            shift[k] = step
+            up, grad_up, _, _ = design.loglikelihood(beta + shift, hessian=False)
+            down, grad_down, _, _ = design.loglikelihood(beta - shift, hessian=False)
+            self.assertAlmostEqual((up - down) / (2 * step), gradient[k], places=3)
+            np.testing.assert_allclose((grad_up - grad_down) / (2 * step), hessian[:, k], rtol=1e-4, atol=1e-3)
+
+    def test_estimation_recovers_parameters(self):
+        names = ['ASC_1', 'ASC_2', 'B_TIME', 'B_COST']
+        results = estimate_mnl(self.X, self.choices, self.availability, names=names)
+        betas = results.get_beta_values()
+        self.assertEqual(list(betas), names)
+
+        table = results.get_estimated_parameters()
+        for name, true_value in zip(names, self.beta):
+            self.assertLess(abs(betas[name] - true_value), 3 * table.loc[name, 'Rob. Std err'])
+
+        stats = results.getGeneralStatistics()
+        self.assertLess(stats['Final gradient norm'][0], 1e-4)
+        expected_null = -np.log(self.availability.sum(axis=1)).sum()
+        self.assertAlmostEqual(stats['Null log likelihood'][0], expected_null)
+        self.assertGreater(stats['Final log likelihood'][0], stats['Init log likelihood'][0])
+        self.assertEqual(results.data.numberOfObservations, 2000)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import contextlib
+import io
+import unittest
+from unittest import mock
+from biogeme.database import Database
+from tests.synthetic import SyntheticMixed, SyntheticMNL, synthetic_data
+
+class TestNumpyBackend(unittest.TestCase):
+    def test_mixed_logit_warm_start(self):
+        data = synthetic_data()
+        model = SyntheticMixed(data)
+        warm = SyntheticMixed(data)
+        with contextlib.redirect_stdout(io.StringIO()):
+            model.estimate()
+            warm.start_values = model.results.get_beta_values()
+            warm.estimate()
+        self.assertLessEqual(warm.results.data.optimizationMessages['Number of iterations'], 2)
+        for name, value in model.results.get_beta_values().items():
+            self.assertAlmostEqual(warm.results.get_beta_values()[name], value, places=5)
+
+    def test_mixed_logit_evaluation_is_simulated(self):
+        for panel in (False, True):
+            model = SyntheticMixed(synthetic_data())
+            model.panel = panel
+            with contextlib.redirect_stdout(io.StringIO()):
+                model.estimate()
+            # The likelihood the model was estimated with, over the same draws
+            self.assertAlmostEqual(model.evaluate()['test_ll'], model.final_ll, places=8)
+
+class TestDatabases(unittest.TestCase):
+    def test_holdout_database_is_built_lazily(self):
+        data = synthetic_data()
+        train, test = data.iloc[:240].reset_index(drop=True), data.iloc[240:].reset_index(drop=True)
+        with mock.patch.object(SyntheticMNL, 'prepare_data', wraps=SyntheticMNL.prepare_data) as prepare_data:
+            model = SyntheticMNL(train, test_data=test)
+            # A single database for the estimation data, none yet for the holdout data
+            databases = [value for value in vars(model).values() if isinstance(value, Database)]
+            self.assertEqual(databases, [model.database])
+            self.assertEqual(prepare_data.call_count, 1)
+
+            holdout = model.test_database
+            self.assertEqual(prepare_data.call_count, 2)
+            self.assertIs(model.test_database, holdout)
+            self.assertEqual(prepare_data.call_count, 2)
+        self.assertEqual(len(holdout.data), 60)
+        self.assertEqual(len(model.database.data), 240)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            model.estimate()
+        direct = SyntheticMNL(test)
+        betas = model.results.get_beta_values()
+        self.assertAlmostEqual(model.evaluate(holdout=True)['test_ll'], direct.evaluate(betas)['test_ll'])
+
+    def test_no_holdout_database_without_test_data(self):
+        model = SyntheticMNL(synthetic_data())
+        self.assertIsNone(model.test_database)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+import numpy as np
+from mcbs.engine.mnl import MNLDesign
+from mcbs.engine.nested import NestParameter, NestedLogitDesign, estimate_nested_logit
+from mcbs.engine.probabilities import nested_logit_probabilities
+
+class TestNativeNestedLogit(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(2)
+        n_obs = 1500
+        self.X = np.zeros((n_obs, 4, 4))
+        self.X[:, 1, 0] = 1.0
+        self.X[:, 2, 1] = 1.0
+        self.X[:, 3, 2] = 1.0
+        self.X[:, :, 3] = rng.uniform(0, 2, (n_obs, 4))
+        self.availability = np.ones((n_obs, 4))
+        self.availability[::5, 3] = 0
+        self.nests = [(NestParameter('MU', 1.0, 1.0, 10.0), [2, 3])]
+
+        # Simulate choices from a nested logit with mu = 2
+        beta = np.array([0.2, -0.4, 0.1, -1.0])
+        design = NestedLogitDesign(self.X, np.zeros(n_obs, dtype=int), self.nests, self.availability)
+        probabilities = design.probabilities(np.r_[beta, 2.0]).T
+        cumulative = probabilities.cumsum(axis=1)
+        self.choices = (rng.random((n_obs, 1)) > cumulative).sum(axis=1)
+
+    def test_probabilities_match_engine(self):
+        design = NestedLogitDesign(self.X, self.choices, self.nests, self.availability)
+        theta = np.array([0.3, -0.2, 0.4, -0.7, 1.8])
+        utilities = self.X @ theta[:4]
+        expected = nested_logit_probabilities(utilities, [(1.8, [2, 3])], self.availability)
+        np.testing.assert_allclose(design.probabilities(theta).T, expected, atol=1e-12)
+
+    def test_unit_mu_is_mnl(self):
+        design = NestedLogitDesign(self.X, self.choices, self.nests, self.availability)
+        beta = np.array([0.3, -0.2, 0.4, -0.7])
+        ll, gradient, _, _ = design.loglikelihood(np.r_[beta, 1.0])
+        mnl_ll, mnl_gradient, _, _ = MNLDesign(self.X, self.choices, self.availability).loglikelihood(beta)
+        self.assertAlmostEqual(ll, mnl_ll)
+        np.testing.assert_allclose(gradient[:4], mnl_gradient, atol=1e-8)
+
+    def test_gradient_matches_finite_differences(self):
+        design = NestedLogitDesign(self.X, self.choices, self.nests, self.availability,
+                                   weights=np.linspace(0.5, 1.5, len(self.choices)))
+        theta = np.array([0.3, -0.2, 0.4, -0.7, 1.6])
+        _, gradient, _, scores = design.loglikelihood(theta)
+        np.testing.assert_allclose(scores.sum(axis=0), gradient)
+        step = 1e-6
+        for k in range(len(theta)):
+            shift = np.zeros_like(theta)
+            shift[k] = step
+            numeric = (design.loglikelihood(theta + shift)[0] -
+                       design.loglikelihood(theta - shift)[0]) / (2 * step)
+            self.assertAlmostEqual(numeric, gradient[k], places=3)
+
+    def test_estimation(self):
+        results = estimate_nested_logit(self.X, self.choices, self.nests, self.availability,
+                                        names=['ASC_1', 'ASC_2', 'ASC_3', 'B_TIME'])
+        betas = results.get_beta_values()
+        self.assertEqual(list(betas), ['ASC_1', 'ASC_2', 'ASC_3', 'B_TIME', 'MU'])
+        std_err = results.get_estimated_parameters().loc['MU', 'Rob. Std err']
+        self.assertLess(abs(betas['MU'] - 2.0), 3 * std_err)
+        self.assertLess(results.getGeneralStatistics()['Final gradient norm'][0], 1e-3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import unittest
+import numpy as np
+import pandas as pd
+from mcbs.engine.posterior import COEFFICIENT_DISTRIBUTIONS, individual_posteriors
+from mcbs.engine.probabilities import logit_probabilities
+from mcbs.utils.individual_parameters import RandomCoefficientCalculator, SwissmetroIndividualCalculator
+
+class TestPosterior(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.utilities = rng.normal(size=(30, 3))
+        self.attributes = rng.uniform(0, 3, size=(30, 3))
+        self.availability = np.ones((30, 3))
+        self.availability[:4, 2] = 0
+        self.choices = rng.integers(0, 2, size=30)
+        # Ten individuals with three observations each, in shuffled order
+        self.panel = np.repeat(np.arange(10), 3)[rng.permutation(30)]
+        self.draws = rng.standard_normal((10, 50))
+
+    def test_matches_loop_over_draws(self):
+        levels = (0.1, 0.5, 0.9)
+        for distribution in COEFFICIENT_DISTRIBUTIONS:
+            posterior = individual_posteriors(
+                self.utilities, self.attributes, self.choices, self.draws, -0.3, 0.5,
+                distribution, self.availability, self.panel, levels, memory_budget=1)
+            coefficients = COEFFICIENT_DISTRIBUTIONS[distribution](-0.3, 0.5, self.draws)
+            for person in range(10):
+                rows = self.panel == person
+                likelihood = np.array([
+                    logit_probabilities(self.utilities[rows] + beta * self.attributes[rows],
+                                        self.availability[rows])[np.arange(3), self.choices[rows]].prod()
+                    for beta in coefficients[person]])
+                weights = likelihood / likelihood.sum()
+                mean = weights @ coefficients[person]
+                self.assertAlmostEqual(posterior.mean[person], mean)
+                self.assertAlmostEqual(posterior.std[person],
+                                       np.sqrt(weights @ (coefficients[person] - mean) ** 2))
+                order = np.argsort(coefficients[person])
+                cumulative = np.cumsum(weights[order])
+                expected = coefficients[person][order][np.searchsorted(cumulative, np.array(levels) - 1e-12)]
+                np.testing.assert_allclose(posterior.quantiles[person], expected)
+
+    def test_shared_draws_do_not_depend_on_memory_budget(self):
+        draws = self.draws[0]
+        small = individual_posteriors(self.utilities, self.attributes, self.choices, draws,
+                                      -0.3, 0.5, memory_budget=1)
+        large = individual_posteriors(self.utilities, self.attributes, self.choices, draws, -0.3, 0.5)
+        for small_values, large_values in zip(small, large):
+            np.testing.assert_allclose(small_values, large_values)
+        self.assertEqual(small.quantiles.shape, (30, 3))
+
+class FittedResults:
+    """Estimation results of a random time coefficient model, as returned by Biogeme."""
+    def __init__(self, betas, robust_std_err):
+        self.betas = betas
+        self.robust_std_err = robust_std_err
+
+    def getBetaValues(self):
+        return dict(self.betas)
+
+    def getEstimatedParameters(self):
+        return pd.DataFrame({'Value': self.betas, 'Rob. Std err': self.robust_std_err})
+
+class TestIndividualParameterCalculators(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(2)
+        self.data = pd.DataFrame({'CHOICE': rng.integers(1, 4, size=20)})
+        for mode in ('CAR', 'TRAIN', 'SM'):
+            self.data[f'{mode}_TT'] = rng.uniform(0.2, 2, size=20)
+            self.data[f'{mode}_CO'] = rng.uniform(0.1, 1, size=20)
+        betas = {'ASC_CAR': 0.2, 'ASC_TRAIN': -0.4, 'ASC_SM': 0.0, 'B_COST': -1.1,
+                 'B_TIME': -0.7, 'MU': -0.3, 'SIGMA': 0.6}
+        self.results = FittedResults(betas, {name: 0.25 for name in betas})
+        self.columns = {1: 0, 2: 1, 3: 2}
+
+    def expected_means(self, utilities, coefficients):
+        times = self.data[['CAR_TT', 'TRAIN_TT', 'SM_TT']].to_numpy()
+        choices = self.data['CHOICE'].map(self.columns).to_numpy()
+        means = []
+        for n in range(len(self.data)):
+            likelihood = np.array([logit_probabilities(utilities[n] + beta * times[n])[choices[n]]
+                                   for beta in coefficients])
+            means.append(likelihood @ coefficients / likelihood.sum())
+        return np.array(means)
+
+    def test_swissmetro_calculator(self):
+        calculator = SwissmetroIndividualCalculator(self.results, self.data, 'CHOICE', 'B_TIME')
+        posterior = calculator.calculate_posterior(n_draws=200, seed=3, quantiles=(0.5,))
+        self.assertEqual(list(posterior.columns), ['mean', 'std', 'q0.5'])
+        draws = np.random.RandomState(3).standard_normal(200)
+        # Normal around the estimate, with its robust standard error as spread
+        expected = self.expected_means(np.zeros((20, 3)), -0.7 + 0.25 * draws)
+        np.testing.assert_allclose(posterior['mean'], expected)
+        np.testing.assert_allclose(calculator.calculate_individual_parameters(200, 3), expected)
+
+    def test_random_coefficient_calculator(self):
+        calculator = RandomCoefficientCalculator(self.results, self.data, 'CHOICE')
+        posterior = calculator.calculate_posterior(n_draws=200, seed=3)
+        draws = np.random.RandomState(3).standard_normal(200)
+        costs = self.data[['CAR_CO', 'TRAIN_CO', 'SM_CO']].to_numpy()
+        utilities = np.array([0.2, -0.4, 0.0]) - 1.1 * costs
+        expected = self.expected_means(utilities, -np.exp(-0.3 + 0.6 * draws))
+        np.testing.assert_allclose(posterior['mean'], expected)
+        self.assertTrue((posterior['q0.05'] <= posterior['q0.95']).all())
+        self.assertTrue((posterior['mean'] < 0).all())
+
+if __name__ == '__main__':
+    unittest.main()
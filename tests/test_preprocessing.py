@@ -0,0 +1,87 @@
+import tempfile
+import unittest
+import pandas as pd
+from mcbs.benchmarker.preprocessing import PreprocessingCache
+from mcbs.models.base import BaseDiscreteChoiceModel
+from mcbs.models.modecanada_model import BaseModeCanadaModel
+
+class CountingModel(BaseDiscreteChoiceModel):
+    calls = 0
+
+    @classmethod
+    def _preprocess_data(cls, data):
+        CountingModel.calls += 1
+        return data.assign(SCALED=data['TIME'] / 100)
+
+    def estimate(self):
+        pass
+
+class OtherCountingModel(CountingModel):
+    pass
+
+class TestPreprocessingCache(unittest.TestCase):
+    def setUp(self):
+        CountingModel.calls = 0
+        self.data = pd.DataFrame({'TIME': [10.0, 20.0, 30.0], 'CHOICE': [1, 2, 1]})
+
+    def test_family_is_prepared_once(self):
+        cache = PreprocessingCache()
+        prepared = cache.prepare(CountingModel, self.data)
+        self.assertEqual(OtherCountingModel.preprocessing_key(), CountingModel.preprocessing_key())
+        cache.prepare(OtherCountingModel, self.data)
+        # Prepared data is recognized and not prepared again
+        self.assertIs(CountingModel.prepare_data(prepared), prepared)
+        self.assertEqual(CountingModel.calls, 1)
+        self.assertEqual(prepared['SCALED'].tolist(), [0.1, 0.2, 0.3])
+        self.assertNotIn('SCALED', self.data.columns)
+
+    def test_disk_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            first = PreprocessingCache(cache_dir).prepare(CountingModel, self.data)
+            second = PreprocessingCache(cache_dir).prepare(CountingModel, self.data)
+            changed = PreprocessingCache(cache_dir).prepare(CountingModel, self.data.assign(TIME=1.0))
+        self.assertEqual(CountingModel.calls, 2)
+        pd.testing.assert_frame_equal(first, second)
+        self.assertEqual(second.attrs, first.attrs)
+        self.assertEqual(changed['SCALED'].tolist(), [0.01] * 3)
+
+class TestModeCanadaReshape(unittest.TestCase):
+    def test_long_to_wide(self):
+        # Case 7 has no bus row and chooses air; case 2 only has car and bus rows
+        long = pd.DataFrame({
+            'case': [7, 7, 7, 2, 2],
+            'alt': ['train', 'car', 'air', 'car', 'bus'],
+            'choice': [0, 0, 1, 1, 0],
+            'cost': [50.0, 30.0, 120.0, 20.0, 15.0],
+            'ivt': [100, 90, 40, 60, 80],
+            'ovt': [20, 0, 60, 0, 30],
+            'freq': [4, 0, 6, 0, 3],
+            'income': [45.0, 45.0, 45.0, 30.0, 30.0],
+            'urban': [1, 1, 1, 0, 0],
+        })
+        wide = BaseModeCanadaModel._preprocess_data(long)
+
+        self.assertEqual(wide['case'].tolist(), [7, 2])
+        self.assertEqual(wide['CHOICE'].tolist(), [4, 2])
+        self.assertEqual(wide['income'].tolist(), [45.0, 30.0])
+        self.assertEqual(wide['urban'].tolist(), [1, 0])
+        self.assertNotIn('CAR_FREQ', wide.columns)
+        self.assertEqual(wide['TRAIN_AV'].tolist(), [1, 0])
+        self.assertEqual(wide['CAR_AV'].tolist(), [1, 1])
+        self.assertEqual(wide['BUS_AV'].tolist(), [0, 1])
+        self.assertEqual(wide['AIR_AV'].tolist(), [1, 0])
+        self.assertEqual(wide['TRAIN_COST'].tolist(), [50.0, 0.0])
+        self.assertEqual(wide['TRAIN_TIME'].tolist(), [120, 0])
+        self.assertEqual(wide['TRAIN_FREQ'].tolist(), [4, 0])
+        self.assertEqual(wide['CAR_TIME'].tolist(), [90, 60])
+        self.assertEqual(wide['BUS_COST'].tolist(), [0.0, 15.0])
+        self.assertEqual(wide['BUS_TIME'].tolist(), [0, 110])
+        self.assertEqual(wide['BUS_FREQ'].tolist(), [0, 3])
+        self.assertEqual(wide['AIR_TIME'].tolist(), [100, 0])
+        self.assertEqual(wide['AIR_FREQ'].tolist(), [6, 0])
+        # Zero filling keeps the dtypes of the long columns
+        self.assertEqual(wide['AIR_TIME'].dtype, long['ivt'].dtype)
+        self.assertEqual(wide['BUS_COST'].dtype, long['cost'].dtype)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+import numpy as np
+from mcbs.engine.probabilities import logit_probabilities, nested_logit_probabilities
+
+class TestProbabilityEngine(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.utilities = rng.normal(size=(50, 4))
+        self.availability = np.ones((50, 4))
+        self.availability[::3, 2] = 0
+
+    def test_logit_probabilities_sum_to_one(self):
+        probs = logit_probabilities(self.utilities, self.availability)
+        np.testing.assert_allclose(probs.sum(axis=1), 1.0)
+        self.assertTrue(np.all(probs[::3, 2] == 0))
+
+    def test_logit_is_stable_for_large_utilities(self):
+        probs = logit_probabilities(self.utilities + 1000.0, self.availability)
+        expected = logit_probabilities(self.utilities, self.availability)
+        np.testing.assert_allclose(probs, expected)
+
+    def test_nested_with_unit_mu_is_logit(self):
+        nested = nested_logit_probabilities(self.utilities, [(1.0, [0, 2, 3])], self.availability)
+        np.testing.assert_allclose(nested, logit_probabilities(self.utilities, self.availability))
+
+    def test_nested_probabilities(self):
+        mu = 2.0
+        v = self.utilities[0]
+        probs = nested_logit_probabilities(v[np.newaxis, :], [(mu, [0, 2])])[0]
+
+        # Closed-form two-level nested logit
+        inclusive = np.log(np.exp(mu * v[0]) + np.exp(mu * v[2])) / mu
+        denominator = np.exp(inclusive) + np.exp(v[1]) + np.exp(v[3])
+        p_nest = np.exp(inclusive) / denominator
+        p_train = p_nest * np.exp(mu * v[0]) / (np.exp(mu * v[0]) + np.exp(mu * v[2]))
+        self.assertAlmostEqual(probs[0], p_train)
+        self.assertAlmostEqual(probs[1], np.exp(v[1]) / denominator)
+        self.assertAlmostEqual(probs.sum(), 1.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+import numpy as np
+from mcbs.engine.probabilities import nested_logit_probabilities
+from mcbs.engine.scenarios import (Modification, Scenario, attribute_term, scenario_shares,
+                                   scenario_utilities)
+from tests.synthetic import SyntheticMixed, synthetic_data
+
+class TestScenarios(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.attributes = rng.uniform(1, 5, size=(50, 2))
+        self.beta = np.array([-0.4, -0.2])
+        self.asc = np.array([0.0, 0.5, -0.3])
+
+    def utilities(self, attributes):
+        # Column 0 is the cost of alternative 0, column 1 the time of alternative 2
+        utilities = np.tile(self.asc, (len(attributes), 1))
+        utilities[:, 0] += self.beta[0] * attributes[:, 0]
+        utilities[:, 2] += self.beta[1] * attributes[:, 1]
+        return utilities
+
+    def terms(self):
+        gradients = np.zeros((2, 50, 3))
+        gradients[0, :, 0] = self.beta[0]
+        gradients[1, :, 2] = self.beta[1]
+        return {column: attribute_term(gradients[c], self.attributes[:, c])
+                for c, column in enumerate(['COST', 'TIME'])}
+
+    def test_modifications_compose_in_order(self):
+        terms = self.terms()
+        np.testing.assert_array_equal(terms['COST'].alternatives, [0])
+        scenarios = [Scenario('base', []),
+                     Scenario('both', [Modification('COST', 2.0), Modification('COST', shift=1.0)])]
+        utilities = scenario_utilities(self.utilities(self.attributes), terms, scenarios)
+        np.testing.assert_array_equal(utilities[0], self.utilities(self.attributes))
+        modified = self.attributes * [2, 1] + [1, 0]
+        np.testing.assert_allclose(utilities[1], self.utilities(modified))
+
+    def test_shares_match_modified_data(self):
+        nests = [(2.0, [0, 1])]
+        scenarios = [Scenario(f'cost_{k}', [Modification('COST', 1 - k / 10),
+                                            Modification('TIME', shift=k)])
+                     for k in range(5)]
+        shares = scenario_shares(self.utilities(self.attributes), self.terms(), scenarios,
+                                 nests=nests, memory_budget=1)
+        for k, share in enumerate(shares):
+            modified = self.attributes * [1 - k / 10, 1] + [0, k]
+            expected = nested_logit_probabilities(self.utilities(modified), nests).mean(axis=0)
+            np.testing.assert_allclose(share, expected)
+
+class TestMixedScenarios(unittest.TestCase):
+    def test_calibrated_mixed_model_reproduces_target_shares(self):
+        model = SyntheticMixed(synthetic_data())
+        betas = {'ASC_2': 0.1, 'ASC_3': 0.0, 'B_TIME': -0.6, 'B_TIME_S': 0.8, 'B_COST': -0.4}
+        target = {1: 0.5, 2: 0.3, 3: 0.2}
+        calibrated = model.calibrate_constants(target, betas=betas)
+        shares = model.simulate_scenarios([Scenario('baseline', []),
+                                           Scenario('slower', [Modification('TIME_1', 1.5)])],
+                                          calibrated)
+        np.testing.assert_allclose(shares.loc['baseline'], [0.5, 0.3, 0.2], atol=1e-9)
+        # Same as the baseline of the modified data, simulated over the same draws
+        model.database.data = model.database.data.assign(TIME_1=model.database.data['TIME_1'] * 1.5)
+        modified = model.simulate_scenarios([Scenario('baseline', [])], calibrated)
+        np.testing.assert_allclose(shares.loc['slower'], modified.loc['baseline'])
+        self.assertLess(shares.loc['slower', 1], 0.5)
+
+if __name__ == '__main__':
+    unittest.main()